@@ -1,46 +1,140 @@
 from pathlib import Path
-from utils import log, execute
+from utils import log
 
-def magic_guess(target, mime=False):
-    cmd = 'file "{}"'.format(target)
-    if mime: cmd += ' --mime-type'
-    output = execute(cmd, showlog=False)
-    return output.split(':', 1)[-1].strip() if output else ''
+# the super image geometry lies at 4096
+HEADER_SIZE = 8192
 
 ARCHIVE_EXT = ('.gz', '.tgz', '.bz2', '.xz', '.tar', '.zip', '.rar', '.7z','.md5','.APP')
 INTERESTING_EXT = ('.ko', '.so', '.dex', '.odex', '.apk', '.jar', '.ozip')
 
-def AttributeClassifier(target):
+# (offset, magic bytes, magic type) checked in order against the file header
+MagicSigList = (
+    (0x0, b'\x7fELF', 'elf'),
+    (0x0, b'\x3a\xff\x26\xed', 'sparse'),
+    (0x0, b'ANDROID!', 'bootimg'),
+    (0x0, b'PK\x03\x04', 'zip'),
+    (0x0, b'PK\x05\x06', 'zip'),
+    (0x0, b'CrAU', 'payload'),
+    (0x0, b'OPPOENCRYPT!', 'ozip'),
+    (0x5c, b'\x55\xaa\x5a\xa5', 'updateapp'),
+    (0x400, b'\xe2\xe1\xf5\xe0', 'erofs'),
+    (0x438, b'\x53\xef', 'ext4'),
+    (0x1000, b'gDla', 'super'),
+)
+
+# (offset, magic bytes) of formats `file` names but the classifier has no type for,
+# files like these used to end up 'unknown' rather than 'data'
+NamedMagicList = (
+    (0x0, b'\x89PNG\r\n\x1a\n'),
+    (0x0, b'\xff\xd8\xff'),
+    (0x0, b'GIF8'),
+    (0x0, b'RIFF'),
+    (0x0, b'OggS'),
+    (0x0, b'ID3'),
+    (0x4, b'ftyp'),
+    (0x0, b'%PDF'),
+    (0x0, b'<?xml'),
+    (0x0, b'\xef\xbb\xbf'),
+    (0x0, b'\xff\xfe'),
+    (0x0, b'\xfe\xff'),
+    (0x0, b'\xca\xfe\xba\xbe'),
+    (0x0, b'dex\n'),
+    (0x0, b'dey\n'),
+    (0x0, b'vdex'),
+    (0x0, b'\x03\x00\x08\x00'),
+    (0x0, b'\x02\x00\x0c\x00'),
+    (0x0, b'SQLite format 3\x00'),
+    (0x0, b'\x1f\x8b'),
+    (0x0, b'BZh'),
+    (0x0, b'\xfd7zXZ\x00'),
+    (0x0, b'7z\xbc\xaf\x27\x1c'),
+    (0x0, b'Rar!'),
+    (0x0, b'\x28\xb5\x2f\xfd'),
+    (0x0, b'\x04\x22\x4d\x18'),
+    (0x101, b'ustar'),
+    (0x0, b'MZ'),
+    (0x0, b'\x00asm'),
+    (0x0, b'TZif'),
+    (0x0, b'\xd0\xcf\x11\xe0'),
+    (0x0, b'\x00\x01\x00\x00\x00'),
+    (0x0, b'OTTO'),
+    (0x0, b'ttcf'),
+    (0x0, b'wOFF'),
+)
+
+TEXT_CHARS = bytes(range(0x20, 0x7f)) + b'\t\n\r\f\b\x1b'
+
+def read_header(target, size=HEADER_SIZE):
+    try:
+        with open(target, 'rb') as f:
+            return f.read(size)
+    except OSError:
+        return b''
+
+def magic_type(header):
+    for offset, magic, name in MagicSigList:
+        if header[offset:offset+len(magic)] == magic:
+            return name
+    return ''
+
+def is_text(header):
+    return bool(header) and not header.translate(None, TEXT_CHARS)
+
+def is_unicode_text(header):
+    """Whether header reads as UTF-8 text, as `file` would call it."""
+    # a character may be cut off at the end of the header
+    for end in range(len(header), max(0, len(header) - 4), -1):
+        try:
+            text = header[:end].decode('utf-8')
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return False
+    return bool(text) and all(c >= ' ' or c in '\t\n\r\f\b\x1b' for c in text)
+
+def is_named(header):
+    """Whether `file` has a name for header instead of plain 'data'."""
+    if is_text(header) or is_unicode_text(header): return True
+    return any(header[offset:offset+len(magic)] == magic for offset, magic in NamedMagicList)
+
+def AttributeClassifier(target, header):
     if target.is_dir(): return 'dir'
     if target.is_symlink(): return 'symlink'
 
-def ExtensionClassifier(target):    
+def ExtensionClassifier(target, header):
     return target.suffix.strip('.') if target.suffix in INTERESTING_EXT else ''
 
-TextSigMap = {
-    'ELF': 'elf',
-    'ASCII': 'text',
-    'Android bootimg': 'bootimg',
-    'Android sparse image': 'sparseimg',
-    'ext4 filesystem': 'extimg'
+MagicSigMap = {
+    'elf': 'elf',
+    'bootimg': 'bootimg',
+    'sparse': 'sparseimg',
+    'ext4': 'extimg',
+    'erofs': 'erofsimg',
+    'super': 'superimg'
 }
 
-def TextSigClassifier(target):
-    for key in TextSigMap.keys():
-        if key in magic_guess(target):
-            return TextSigMap[key]
+def MagicSigClassifier(target, header):
+    if is_text(header): return 'text'
+    return MagicSigMap.get(magic_type(header), '')
 
-def ArchiveClassifier(target):
-    if target.suffix in ARCHIVE_EXT or \
-        magic_guess(target, mime=True)=='application/zip':
+def UpdateAppClassifier(target, header):
+    if magic_type(header) == 'updateapp': return 'updateapp'
+
+def ArchiveClassifier(target, header):
+    if target.suffix in ARCHIVE_EXT or magic_type(header) == 'zip':
         return 'archive'
 
-def NewDatBrClassifier(target):
+def NewDatBrClassifier(target, header):
     if target.name.endswith('.new.dat'): return 'newdat'
     if target.name.endswith('.new.dat.br'): return 'brotli'
 
-def SpecialDataClassifier(target):
-    if magic_guess(target) != 'data': return ''
+def SpecialDataClassifier(target, header):
+    if not header: return ''
+    magic = magic_type(header)
+    if magic == 'payload': return 'otapayload'
+    # only what `file` calls data, anything it names stays unknown
+    if magic in MagicSigMap or is_named(header): return ''
     if target.name == 'payload.bin': return 'otapayload'
     return 'dataimg' if target.suffix in ('.img', '.bin') else 'data'
 
@@ -48,19 +142,38 @@ classify_queue = [
     AttributeClassifier,
     NewDatBrClassifier,
     ExtensionClassifier,
+    UpdateAppClassifier,
     ArchiveClassifier,
     SpecialDataClassifier,
-    TextSigClassifier,
+    MagicSigClassifier,
 ]
 
+def guess_by_name(name):
+    """Classifier type of a file that is not on disk yet, e.g. an archive
+    member, judged by its name only."""
+    name = Path(name).name
+    if name.endswith('.lz4'): name = name[:-len('.lz4')]
+    if name.endswith('.new.dat.br'): return 'brotli'
+    if name.endswith('.new.dat'): return 'newdat'
+    if name == 'payload.bin': return 'otapayload'
+    if name.endswith('.ozip'): return 'ozip'
+    if name == 'UPDATE.APP': return 'updateapp'
+    if name.startswith(('boot', 'recovery')) and name.endswith('.img'): return 'bootimg'
+    if name.startswith('super') and name.endswith(('.img', '.ext4')): return 'superimg'
+    if name.endswith(('.img', '.ext4')) or '_sparsechunk.' in name: return 'sparseimg'
+    if Path(name).suffix in ARCHIVE_EXT: return 'archive'
+    if name.endswith('.bin'): return 'dataimg'
+    return ''
+
 def Classify(target):
     target = Path(target)
     if not target.exists():
         log.warn("Not exists: {}".format(target))
-        return 
+        return
 
+    header = read_header(target) if target.is_file() else b''
     for classifier in classify_queue:
-        result = classifier(target)
+        result = classifier(target, header)
         if result: return result
 
     return 'unknown'
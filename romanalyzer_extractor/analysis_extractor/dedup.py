@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from analysis_extractor.digest import file_digests
+from settings import DEDUP_INDEX, DEDUP_PARTIAL_SIZE
+
+log = logging.getLogger('analysis_static')
+
+# per file analyses that are skipped for known content
+ANALYSIS_DOCUMENT = 'document'
+ANALYSIS_UPLOAD = 'upload'
+ANALYSIS_APK_REPORT = 'apk_report'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    prekey TEXT NOT NULL,
+    md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS contents_prekey ON contents (size, prekey);
+CREATE TABLE IF NOT EXISTS analyses (
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    result TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (sha256, name)
+);
+CREATE TABLE IF NOT EXISTS belongs (
+    sha256 TEXT NOT NULL,
+    rom_md5 TEXT NOT NULL,
+    rom_path TEXT NOT NULL,
+    rom_name TEXT,
+    PRIMARY KEY (sha256, rom_md5, rom_path)
+);
+"""
+
+def partial_hash(path, size, partial=DEDUP_PARTIAL_SIZE):
+    """sha256 of the head and tail of a file, the whole file when it is small."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        sha256.update(f.read(partial))
+        if size > 2 * partial:
+            f.seek(-partial, os.SEEK_END)
+        sha256.update(f.read(partial))
+    return sha256.hexdigest()
+
+class DedupIndex(object):
+    """Persistent index of the file contents analyzed across ROMs.
+
+    Contents are keyed by sha256. (size, partial hash) is a cheap pre-key,
+    so a new file is only hashed in full when a known file could match it.
+    For each content the index records which analyses are done, plus a
+    belongs edge per (ROM, path) it was seen at. The sqlite file is shared
+    by the analyze threads and processes (WAL, one connection per thread).
+    """
+
+    def __init__(self, path=DEDUP_INDEX):
+        self.path = str(path)
+        self.local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.db.executescript(SCHEMA)
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def prekey(self, path):
+        size = os.stat(path).st_size
+        return size, partial_hash(path, size)
+
+    def lookup(self, path):
+        """Return (sha256, size, prekey) of a file. sha256 is only computed
+        (and the digests cached) when the pre-key matches known content,
+        it is None for content the index never saw."""
+        size, prekey = self.prekey(path)
+        rows = self.db.execute('SELECT sha256 FROM contents WHERE size=? AND prekey=?', (size, prekey)).fetchall()
+        if not rows: return None, size, prekey
+
+        sha256 = file_digests(path)['sha256']
+        if sha256 not in {row[0] for row in rows}: return None, size, prekey
+        return sha256, size, prekey
+
+    def done(self, sha256, names):
+        """Whether all the named analyses of a content are recorded."""
+        if not sha256: return False
+        rows = self.db.execute('SELECT name FROM analyses WHERE sha256=?', (sha256,)).fetchall()
+        return set(names) <= {row[0] for row in rows}
+
+    def result(self, sha256, name):
+        row = self.db.execute('SELECT result FROM analyses WHERE sha256=? AND name=?', (sha256, name)).fetchone()
+        return row[0] if row else None
+
+    def add_content(self, sha256, size, prekey, md5=None):
+        self.db.execute('INSERT OR IGNORE INTO contents (sha256, size, prekey, md5) VALUES (?, ?, ?, ?)',
+                        (sha256, size, prekey, md5))
+
+    def add_analyses(self, sha256, names, result=None):
+        now = time.time()
+        self.db.executemany('INSERT OR REPLACE INTO analyses (sha256, name, result, created) VALUES (?, ?, ?, ?)',
+                            [(sha256, name, result, now) for name in names])
+
+    def add_belongs(self, sha256, rom_md5, rom_path, rom_name=None):
+        self.db.execute('INSERT OR IGNORE INTO belongs (sha256, rom_md5, rom_path, rom_name) VALUES (?, ?, ?, ?)',
+                        (sha256, rom_md5, rom_path, rom_name))
+
+    def record(self, entries):
+        """Record [(sha256, size, prekey, md5, analyses, rom_md5, rom_path, rom_name)] in one transaction."""
+        db = self.db
+        now = time.time()
+        with db:
+            db.execute('BEGIN')
+            db.executemany('INSERT OR IGNORE INTO contents (sha256, size, prekey, md5) VALUES (?, ?, ?, ?)',
+                           [entry[:4] for entry in entries])
+            db.executemany('INSERT OR REPLACE INTO analyses (sha256, name, result, created) VALUES (?, ?, NULL, ?)',
+                           [(entry[0], name, now) for entry in entries for name in entry[4]])
+            db.executemany('INSERT OR IGNORE INTO belongs (sha256, rom_md5, rom_path, rom_name) VALUES (?, ?, ?, ?)',
+                           [(entry[0],) + tuple(entry[5:]) for entry in entries])
+
+    def roms(self, sha256):
+        """(rom md5, rom path, rom name) of every ROM a content was seen in."""
+        return self.db.execute('SELECT rom_md5, rom_path, rom_name FROM belongs WHERE sha256=?', (sha256,)).fetchall()
+
+    def reuse_report(self, path, report_path):
+        """Copy the earlier APK report of a content to report_path. Return
+        the sha256 of path, and whether a report was reused."""
+        sha256 = file_digests(path)['sha256']
+        previous = self.result(sha256, ANALYSIS_APK_REPORT)
+        if not previous or not os.path.isdir(previous):
+            return sha256, False
+        if os.path.abspath(previous) != os.path.abspath(report_path):
+            shutil.copytree(previous, report_path, dirs_exist_ok=True)
+        log.debug("reused apk report {} for {}".format(previous, path))
+        return sha256, True
+
+    def add_report(self, path, sha256, report_path):
+        size, prekey = self.prekey(path)
+        with self.db:
+            self.add_content(sha256, size, prekey, file_digests(path)['md5'])
+            self.add_analyses(sha256, [ANALYSIS_APK_REPORT], os.path.abspath(report_path))
+
+dedup_index = DedupIndex() if DEDUP_INDEX else None
@@ -0,0 +1,71 @@
+import os
+import zlib
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+from settings import DIGEST_BUFSIZE, DIGEST_CACHE_SIZE
+
+class DigestCache(object):
+    """md5, sha1, sha256 and crc32 of files, read once in large chunks.
+
+    Results are kept per (device, inode, mtime, size), so hard links out of
+    the extract cache and files analyzed again are never read twice. hashlib
+    and zlib release the GIL on large buffers, so files hash in parallel
+    from a thread pool.
+    """
+
+    def __init__(self, bufsize=DIGEST_BUFSIZE, size=DIGEST_CACHE_SIZE):
+        self.bufsize = bufsize
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def key(self, st):
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def digests(self, path):
+        """Return {'md5', 'sha1', 'sha256', 'crc32'} of path as hex strings,
+        crc32 as its decimal string."""
+        with open(path, 'rb') as f:
+            key = self.key(os.fstat(f.fileno()))
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return dict(self.entries[key])
+
+            result = self.compute(f)
+
+        with self.lock:
+            self.entries[key] = result
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return dict(result)
+
+    def compute(self, f):
+        md5, sha1, sha256, crc = hashlib.md5(), hashlib.sha1(), hashlib.sha256(), 0
+        buf = bytearray(self.bufsize)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n: break
+            data = view[:n]
+            md5.update(data)
+            sha1.update(data)
+            sha256.update(data)
+            crc = zlib.crc32(data, crc)
+        return {
+            'md5': md5.hexdigest(),
+            'sha1': sha1.hexdigest(),
+            'sha256': sha256.hexdigest(),
+            'crc32': str(crc),
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+digest_cache = DigestCache()
+
+def file_digests(path):
+    return digest_cache.digests(path)
@@ -1,15 +1,21 @@
+import logging
 from datetime import datetime
+from threading import Lock
+from contextlib import contextmanager
+from elasticsearch.helpers import streaming_bulk, parallel_bulk
 from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl import Document, Date, Integer, Text, Keyword
 
 from utils import readcfg
-from settings import ES_ANDROID_ROM_INDEX
+from settings import ES_ANDROID_ROM_INDEX, ES_BULK_CHUNK_SIZE, ES_BULK_THREAD_NUM, ES_BULK_FLUSH_SIZE, ES_BACKFILL_REFRESH_INTERVAL
+
+log = logging.getLogger('analysis_static')
 
 ip_addr = readcfg('configs/elastic.cfg', 'ElasticSearch', 'IP')
 connections.create_connection(hosts=[ip_addr])
 
 class ESRomFile(Document):
-    
+
     # basic
     name = Text()
     type = Keyword()
@@ -30,7 +36,9 @@ class ESRomFile(Document):
     class Index:
         name = ES_ANDROID_ROM_INDEX
 
-def SaveRomFileToES(androfile):
+def ESRomAction(androfile):
+    """Bulk index action of a file. Libraries, imports and exports come from
+    the ELF metadata the file already parsed for its other analyses."""
     es_rom = ESRomFile(
             meta = {'id': androfile.md5},
             name = androfile.name,
@@ -48,7 +56,84 @@ def SaveRomFileToES(androfile):
         )
 
     es_rom.pubdate = datetime.now()
-    es_rom.save()
+    return es_rom.to_dict(include_meta=True)
+
+class ESBulkIndexer(object):
+    """Buffers index actions and sends them with the bulk helpers, in
+    requests of chunk_size documents. With more than one thread the
+    requests go out in parallel, otherwise they are streamed.
+
+    Failed documents are logged and counted, they do not stop a flush.
+    """
+
+    def __init__(self, client=None, chunk_size=ES_BULK_CHUNK_SIZE, threads=ES_BULK_THREAD_NUM, flush_size=ES_BULK_FLUSH_SIZE):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.threads = threads
+        self.flush_size = flush_size
+        self.pending = []
+        self.lock = Lock()
+        self.indexed = 0
+        self.failed = 0
+
+    def add(self, action):
+        with self.lock:
+            self.pending.append(action)
+            if len(self.pending) < self.flush_size: return
+            batch, self.pending = self.pending, []
+        self.write(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch: self.write(batch)
+
+    def write(self, batch):
+        client = self.client or connections.get_connection()
+        if self.threads > 1:
+            results = parallel_bulk(client, batch, thread_count=self.threads, chunk_size=self.chunk_size, raise_on_error=False)
+        else:
+            results = streaming_bulk(client, batch, chunk_size=self.chunk_size, raise_on_error=False)
+
+        indexed = failed = 0
+        for ok, item in results:
+            if ok:
+                indexed += 1
+            else:
+                failed += 1
+                log.warning("failed to index {}".format(item))
+        with self.lock:
+            self.indexed += indexed
+            self.failed += failed
+        log.debug("indexed {} documents, {} failed".format(indexed, failed))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+es_indexer = ESBulkIndexer()
+
+def SaveRomFileToES(androfile):
+    es_indexer.add(ESRomAction(androfile))
+
+@contextmanager
+def ESBackfill(index=ES_ANDROID_ROM_INDEX, refresh_interval=ES_BACKFILL_REFRESH_INTERVAL, client=None):
+    """Index with refresh_interval (no refreshes by default) for a large
+    backfill, then flush, restore the previous interval and refresh once."""
+    client = client or connections.get_connection()
+    settings = client.indices.get_settings(index=index, name='index.refresh_interval')
+    previous = settings.get(index, {}).get('settings', {}).get('index', {}).get('refresh_interval')
+    client.indices.put_settings(index=index, body={'index': {'refresh_interval': refresh_interval}})
+    try:
+        yield es_indexer
+        es_indexer.flush()
+    finally:
+        # None resets the index to the default interval
+        client.indices.put_settings(index=index, body={'index': {'refresh_interval': previous}})
+        client.indices.refresh(index=index)
+        log.info("backfill of {} done, {} indexed, {} failed".format(index, es_indexer.indexed, es_indexer.failed))
 
 def ESInitMap():
-    ESRomFile.init()
\ No newline at end of file
+    ESRomFile.init()
@@ -1,124 +1,102 @@
-from zlib import crc32
 from pathlib import Path
 
-from collections import defaultdict
-from hashlib import md5, sha1, sha256
-
-from utils import log, execute
+from utils import log, run
 #from analysis.esrom import ESRomFile
 from analysis_extractor.classifier import Classify
+from analysis_extractor.digest import file_digests
+from formats.elf import ElfFile, ElfError
+
+def rom_path_of(file, extracted):
+    """Path of an extracted file inside its ROM, without the .extracted suffixes."""
+    return "/".join([p.replace('.extracted', '') for p in Path(file).relative_to(Path(extracted)).parts])
 
 class AndroRomFile(object):
 
     def __init__(self, file, meta):
         self._file = Path(file)
-        self._arch = ''
-        self._bits = 0
-        self._endian = ''
-        self._machine = ''
-        self._crypto = defaultdict(list)
+        self._elf_info = None
+        self._digests = None
         self.type = Classify(self.path)
 
         self.belongs = meta['romName']
         self.belongsMd5 = meta['romMd5']
 
-        self.rom_path = "/".join([p.replace('.extracted', '') for p in self._file.relative_to(Path(meta['extracted'])).parts])
+        self.rom_path = rom_path_of(self._file, meta['extracted'])
+
+    @property
+    def elf_info(self):
+        """arch, bits, endian, machine, imports, exports, libraries and the
+        file(1) summary of an ELF, all from one in-process read."""
+        if self._elf_info is None:
+            self._elf_info = {}
+            if self.type in ['elf', 'so']:
+                try:
+                    with ElfFile(self._file) as elf:
+                        self._elf_info = elf.info()
+                except (ElfError, OSError, ValueError) as e:
+                    log.warn("failed to parse ELF {}: {}".format(self.path, e))
+        return self._elf_info
 
     def get_binary_info(self):
         if self.type not in ['elf', 'so']: return None
-
-        output = execute('rabin2 -I "{}"'.format(self.path))
-        for info in output.split('\n'):
-            if not info.strip(): continue
-            attr, value = info.strip().split()
-            attr = attr.strip()
-            value = value.strip()
-            if attr == 'endian':
-                self._endian = value
-            elif attr == 'arch':
-                self._arch = value
-            elif attr == 'bits':
-                self._bits = int(value)
-            elif attr == 'machine':
-                self._machine = value
+        return self.elf_info
 
     @property
     def endian(self):
-        return self._endian
+        return self.elf_info.get('endian', '')
 
     @property
     def arch(self):
-        return self._arch
+        return self.elf_info.get('arch', '')
     
     @property
     def machine(self):
-        return self._machine
+        return self.elf_info.get('machine', '')
 
     @property
     def bits(self):
-        return self._bits
+        return self.elf_info.get('bits', 0)
 
     @property
-    def md5(self):
-        if self._crypto['md5']: return self._crypto['md5']
-        self._crypto['md5'] = md5(self._file.read_bytes()).hexdigest()
-        return self._crypto['md5']
+    def digests(self):
+        """md5, sha1, sha256 and crc32 from a single read of the file."""
+        if self._digests is None: self._digests = file_digests(self._file)
+        return self._digests
 
     @property
-    def sha256(self):
-        if self._crypto['sha256']: return self._crypto['sha256']
-        self._crypto['sha256'] = sha256(self._file.read_bytes()).hexdigest()
-        return self._crypto['sha256']
+    def md5(self): return self.digests['md5']
 
     @property
-    def sha1(self):
-        if self._crypto['sha1']: return self._crypto['sha1']
-        self._crypto['sha1'] = sha1(self._file.read_bytes()).hexdigest()
-        return self._crypto['sha1']
+    def sha256(self): return self.digests['sha256']
 
     @property
-    def crc32(self):
-        if self._crypto['crc32']: return self._crypto['crc32']
-        self._crypto['crc32'] = str(crc32(self._file.read_bytes()))
-        return self._crypto['crc32']
+    def sha1(self): return self.digests['sha1']
 
-    def get_strings(self):
+    @property
+    def crc32(self): return self.digests['crc32']
+
+    def get_strings(self, on_line=None):
+        """Return the strings of the file, or pass them to on_line one by one
+        so large binaries are never buffered."""
         if self.type == 'text': return self._file.read_bytes().decode('utf-8')
-        else: return execute('strings "{}"'.format(self.path))
+        else: return run(['strings', self.path], on_line=on_line).output
 
     def get_files(self):
-        output = execute('file "{}"'.format(self.path))
+        if self.elf_info: return self.elf_info['filecmd']
+        output = run(['file', self.path]).output
         return output.split(':', 1)[1].strip()
 
     def get_imports(self):
         if self.type not in ['elf', 'so']: return None
-
-        imports = execute('rabin2 -i "{}"'.format(self.abspath))
-        result = set()
-        for line in imports.split('\n')[3:]:
-            if not line: continue
-            result.add(' '.join(line.split()[4:]))
-        return result
+        return self.elf_info.get('imports', set())
     
     def get_exports(self):
         if self.type not in ['elf', 'so']: return None
-
-        exports = execute('rabin2 -E "{}"'.format(self.abspath))
-        result = set()
-        for line in exports.split('\n')[4:]:
-            if not line: continue
-            result.add(' '.join(line.split()[6:]))
-        return result
+        return self.elf_info.get('exports', set())
     
     def get_librarys(self):
         if self.type not in ['elf', 'so']: return None
-        
-        librarys = execute('rabin2 -l "{}"'.format(self.abspath))
-        result = set()
-        for line in librarys.split('\n')[1:-2]:
-            if not line: continue
-            result.add(line.strip())
-        return result
+        return self.elf_info.get('libraries', set())
 
     def fmt(self):
         return {
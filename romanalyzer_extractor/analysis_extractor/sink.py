@@ -0,0 +1,242 @@
+import os
+import shutil
+import logging
+from pathlib import Path
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from pymongo import ReplaceOne
+except ImportError:
+    ReplaceOne = None
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+from settings import SINK_FLUSH_SIZE, MONGO_UPSERT_KEYS, UPLOAD_THREAD_NUM, UPLOAD_BUCKET, UPLOAD_STORE_DIR
+
+log = logging.getLogger('analysis_static')
+
+class ManagerCollection(object):
+    """replace_one over a manager that only inserts, such as MongoManager
+    without a collection attribute. Upserts fall back to plain inserts."""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def replace_one(self, selector, document, upsert=True):
+        self.manager.insert(document)
+
+def mongo_collection(manager):
+    """The pymongo collection behind a MongoManager, or manager itself when
+    it already is a collection (pymongo, mongomock). Other managers are
+    written through their insert()."""
+    # a pymongo collection answers any attribute with a subcollection
+    if hasattr(manager, 'bulk_write') or hasattr(manager, 'replace_one'): return manager
+    collection = getattr(manager, 'collection', None)
+    if collection is not None: return collection
+    return ManagerCollection(manager)
+
+class DocumentSink(object):
+    """Buffers analysis documents and writes them flush_size at a time as
+    one unordered bulk upsert keyed on keys, so analyzing a ROM again
+    replaces its documents instead of duplicating them.
+
+    Without pymongo's bulk operations every document is upserted on its own.
+    Documents that fail to write are logged and their keys kept until the
+    next flush() returns them, like ObjectUploader.flush does.
+    """
+
+    def __init__(self, collection, keys=MONGO_UPSERT_KEYS, flush_size=SINK_FLUSH_SIZE):
+        self.collection = collection
+        self.keys = tuple(keys)
+        self.flush_size = flush_size
+        self.pending = []
+        self.lock = Lock()
+        self.written = 0
+        self.failed = set()
+
+    def key(self, document):
+        """The values of the upsert keys of a document, what flush() reports."""
+        return tuple(document.get(key) for key in self.keys)
+
+    def add(self, document):
+        with self.lock:
+            self.pending.append(document)
+            if len(self.pending) < self.flush_size: return
+            batch, self.pending = self.pending, []
+        self.write(batch)
+
+    def flush(self):
+        """Write the buffered documents. Return the keys of the documents
+        that failed to write since the last flush."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch: self.write(batch)
+        with self.lock:
+            failed, self.failed = self.failed, set()
+        return failed
+
+    def write(self, batch):
+        filters = [{key: document.get(key) for key in self.keys} for document in batch]
+        if ReplaceOne is not None and hasattr(self.collection, 'bulk_write'):
+            requests = [ReplaceOne(selector, document, upsert=True) for selector, document in zip(filters, batch)]
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+                failed = []
+            except Exception as e:
+                # an unordered BulkWriteError lists the documents that failed, other errors lose the batch
+                errors = (getattr(e, 'details', None) or {}).get('writeErrors')
+                failed = [batch[error['index']] for error in errors] if errors else batch
+                log.warning("failed to write {} of {} documents: {}".format(len(failed), len(batch), e))
+        else:
+            failed = []
+            for selector, document in zip(filters, batch):
+                try:
+                    self.collection.replace_one(selector, document, upsert=True)
+                except Exception as e:
+                    failed.append(document)
+                    log.warning("failed to write {}: {}".format(selector, e))
+        with self.lock:
+            self.written += len(batch) - len(failed)
+            self.failed.update(self.key(document) for document in failed)
+        log.debug("wrote {} documents, {} failed".format(len(batch) - len(failed), len(failed)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+class FileObjectStore(object):
+    """Object store on a local directory, objects live at <root>/<key[:2]>/<key>.
+
+    A stand-in for S3 when testing or running without AWS.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, key):
+        return self.root / key[:2] / key
+
+    def exists(self, key):
+        return self.path(key).exists()
+
+    def upload(self, path, key):
+        target = self.path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + '.part')
+        shutil.copyfile(path, partial)
+        os.replace(partial, target)
+
+class S3ObjectStore(object):
+    """Objects in an S3 bucket through one client whose connection pool is
+    sized for the upload threads (boto3 clients are thread safe)."""
+
+    def __init__(self, bucket, prefix='', workers=UPLOAD_THREAD_NUM):
+        if boto3 is None:
+            raise RuntimeError("boto3 is required for S3ObjectStore")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', config=Config(max_pool_connections=workers))
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'): return False
+            raise
+
+    def upload(self, path, key):
+        self.client.upload_file(str(path), self.bucket, self.prefix + key)
+
+class ManagerObjectStore(object):
+    """Object store interface over an upload(path, key) manager such as
+    AWSManager. Existence is checked through its exists(key) when it has one."""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def exists(self, key):
+        exists = getattr(self.manager, 'exists', None)
+        return bool(exists and exists(key))
+
+    def upload(self, path, key):
+        self.manager.upload(path, key)
+
+class ObjectUploader(object):
+    """Uploads files to an object store from a thread pool, keyed by md5.
+
+    Keys the store already holds, or that were already submitted, are
+    skipped. At most 4 uploads per worker wait in the queue, so a fast
+    producer blocks instead of piling up work.
+    """
+
+    def __init__(self, store, workers=UPLOAD_THREAD_NUM):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+        self.slots = BoundedSemaphore(workers * 4)
+        self.lock = Lock()
+        self.seen = set()
+        self.futures = []
+        self.uploaded = 0
+        self.skipped = 0
+
+    def submit(self, path, key):
+        with self.lock:
+            if key in self.seen:
+                self.skipped += 1
+                return None
+            self.seen.add(key)
+
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.upload, str(path), key)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.futures.append((key, future))
+        return future
+
+    def upload(self, path, key):
+        if self.store.exists(key):
+            with self.lock: self.skipped += 1
+            return False
+        self.store.upload(path, key)
+        with self.lock: self.uploaded += 1
+        log.debug("uploaded {} as {}".format(path, key))
+        return True
+
+    def flush(self):
+        """Wait for the submitted uploads. Failed keys are forgotten so they
+        are tried again, and returned."""
+        with self.lock:
+            futures, self.futures = self.futures, []
+        failed = set()
+        for key, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed.add(key)
+                log.warning("upload of {} failed: {}".format(key, e))
+        with self.lock:
+            self.seen -= failed
+        return failed
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
+
+def object_store(manager):
+    """The store uploads go to: UPLOAD_STORE_DIR, then UPLOAD_BUCKET, then manager."""
+    if UPLOAD_STORE_DIR: return FileObjectStore(UPLOAD_STORE_DIR)
+    if UPLOAD_BUCKET: return S3ObjectStore(UPLOAD_BUCKET)
+    return ManagerObjectStore(manager)
@@ -5,50 +5,116 @@ from py2neo import Node
 from manager.aws import AWSManager
 from manager.mongo import MongoManager
 from manager.neo4j import NeoGraphManager
-from analysis_extractor.rom import AndroRomFile
-from analysis_extractor.esrom import SaveRomFileToES
+from analysis_extractor.rom import AndroRomFile, rom_path_of
+from analysis_extractor.esrom import SaveRomFileToES, es_indexer
+from analysis_extractor.sink import DocumentSink, ObjectUploader, mongo_collection, object_store
+from analysis_extractor.dedup import dedup_index, ANALYSIS_DOCUMENT, ANALYSIS_UPLOAD
 
 aws_manager = AWSManager()
 
 rom_mongo_manager = MongoManager(database='newrom')
 
+rom_sink = DocumentSink(mongo_collection(rom_mongo_manager))
+uploader = ObjectUploader(object_store(aws_manager))
+
 neo_graph = NeoGraphManager()
 
 log = logging.getLogger('analysis_static')
 
+# analyses a known content needs to be skipped
+FILE_ANALYSES = (ANALYSIS_DOCUMENT, ANALYSIS_UPLOAD)
+
 def analyze_extracted(meta):
     log.info("Analyze extracted: {}".format(meta))
 
-    for extracted_file in Path(meta['extracted']).rglob('*'):
-        if extracted_file.is_dir(): 
-            log.debug("Skip {}".format(extracted_file))
-            continue
-        if not extracted_file.exists(): 
-            log.warn("Not exists: {}".format(extracted_file))
-            continue
-
-        log.info(u"Start analysis: {}".format(extracted_file.name))
-
-        try:
-            android_rom_file = AndroRomFile(extracted_file, meta)
-            analyze_extracted_file(android_rom_file)            
-        except:
-            log.exception(u"Exception happened: {}".format(extracted_file))
-
+    analyzed = []
+    try:
+        for extracted_file in Path(meta['extracted']).rglob('*'):
+            if extracted_file.is_dir(): 
+                log.debug("Skip {}".format(extracted_file))
+                continue
+            if not extracted_file.exists(): 
+                log.warn("Not exists: {}".format(extracted_file))
+                continue
+
+            log.info(u"Start analysis: {}".format(extracted_file.name))
+
+            try:
+                known, size, prekey = known_content(extracted_file, meta)
+                if known:
+                    log.info(u"Known content, only added belongs: {}".format(extracted_file.name))
+                    continue
+
+                android_rom_file = AndroRomFile(extracted_file, meta)
+                document = analyze_extracted_file(android_rom_file)
+                analyzed.append((android_rom_file, size, prekey, document))
+            except:
+                log.exception(u"Exception happened: {}".format(extracted_file))
+    finally:
+        failed_uploads, failed_documents = flush_analyzed()
+    record_analyzed(analyzed, failed_uploads, failed_documents, meta)
     log.info("Success analysis: {}".format(meta['romName']))
 
+def known_content(extracted_file, meta):
+    """Look a file up in the dedup index, and record the belongs edge of
+    this ROM when all FILE_ANALYSES of its content are done already.
+    Return whether it is known, and its size and pre-key for recording."""
+    if dedup_index is None: return False, None, None
+
+    sha256, size, prekey = dedup_index.lookup(extracted_file)
+    if not dedup_index.done(sha256, FILE_ANALYSES): return False, size, prekey
+
+    dedup_index.add_belongs(sha256, meta['romMd5'], rom_path_of(extracted_file, meta['extracted']), meta['romName'])
+    return True, size, prekey
+
+def flush_analyzed():
+    """Write the buffered documents and wait for the uploads of a ROM,
+    before it is marked analyzed and its files are removed. Return the
+    keys that failed to upload, and those of the documents that failed
+    to write."""
+    failed_uploads = uploader.flush()
+    log.info(u"Upload AWS: {} uploaded, {} skipped, {} failed".format(uploader.uploaded, uploader.skipped, len(failed_uploads)))
+
+    failed_documents = rom_sink.flush()
+    log.info(u"Upload MongoDB: {} documents so far, {} failed".format(rom_sink.written, len(failed_documents)))
+
+    es_indexer.flush()
+    if es_indexer.indexed or es_indexer.failed:
+        log.info(u"Upload ES: {} indexed, {} failed so far".format(es_indexer.indexed, es_indexer.failed))
+    return failed_uploads, failed_documents
+
+def record_analyzed(analyzed, failed_uploads, failed_documents, meta):
+    """Record the flushed analyses of a ROM in the dedup index, each one
+    only for the files whose document or upload made it."""
+    if dedup_index is None or not analyzed: return
+
+    entries = []
+    for androRomFile, size, prekey, document in analyzed:
+        names = []
+        if document not in failed_documents: names.append(ANALYSIS_DOCUMENT)
+        if androRomFile.md5 not in failed_uploads: names.append(ANALYSIS_UPLOAD)
+        # nothing made it, the file is analyzed again next time
+        if not names: continue
+        entries.append((androRomFile.sha256, size, prekey, androRomFile.md5, names,
+                        meta['romMd5'], androRomFile.rom_path, meta['romName']))
+    dedup_index.record(entries)
+    log.info(u"Dedup index: recorded {} contents".format(len(entries)))
+
 def analyze_extracted_file(androRomFile):
+    """Queue the document and upload of a file, return the sink key of its document."""
 
     '''
     SaveRomFileToES(androRomFile)
-    log.info("\t=> uploaded {} to es".format(androRomFile.name))
+    log.info(u"Queued ES: {}".format(androRomFile.name))
     '''
 
-    rom_mongo_manager.insert(androRomFile.fmt())
-    log.info(u"Upload MongoDB: {}".format(androRomFile.name))
+    document = androRomFile.fmt()
+    rom_sink.add(document)
+    log.info(u"Queued MongoDB: {}".format(androRomFile.name))
     
-    aws_manager.upload(androRomFile.abspath, androRomFile.md5)
-    log.info(u"Upload AWS: {}".format(androRomFile.name))
+    uploader.submit(androRomFile.abspath, androRomFile.md5)
+    log.info(u"Queued AWS: {}".format(androRomFile.name))
+    return rom_sink.key(document)
 
     '''
     if androRomFile.type not in ('elf', 'so'): return
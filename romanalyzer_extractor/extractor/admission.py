@@ -0,0 +1,87 @@
+import shutil
+import logging
+import zipfile
+from pathlib import Path
+from threading import Condition
+
+from analysis_extractor.classifier import Classify, guess_by_name
+from settings import EXTRACT_DISK_BUDGET, EXTRACT_DISK_RESERVE, EXTRACT_FOOTPRINT_FACTORS
+
+DEFAULT_FOOTPRINT_FACTOR = 2.0
+# seconds a pending admission waits before it measures the free space again
+ADMISSION_WAIT_INTERVAL = 5.0
+
+def footprint_factor(guess):
+    return EXTRACT_FOOTPRINT_FACTORS.get(guess, DEFAULT_FOOTPRINT_FACTOR)
+
+def estimate_footprint(rom_path):
+    """Peak bytes a ROM takes on disk while it is extracted and analyzed.
+
+    The members of a zip are weighted by what their type unpacks to,
+    other containers by the factor of their own type.
+    """
+    rom_path = Path(rom_path)
+    size = rom_path.stat().st_size
+    guess = Classify(rom_path)
+    if guess == 'archive' and zipfile.is_zipfile(rom_path):
+        try:
+            with zipfile.ZipFile(rom_path) as zf:
+                return size + int(sum(info.file_size * footprint_factor(guess_by_name(info.filename))
+                                      for info in zf.infolist()))
+        except (zipfile.BadZipFile, OSError):
+            pass
+    return size + int(size * footprint_factor(guess))
+
+class AdmissionClosed(Exception):
+    pass
+
+class DiskAdmission(object):
+    """Only let ROMs start extracting while their estimated footprints fit.
+
+    Without a budget the free space of the scratch volume minus reserve is
+    measured on every check, as the extract cache, the dedup index and the
+    traces grow on the same disk. A ROM is always admitted when nothing
+    else is in flight, so an oversized one runs alone instead of never.
+    Pending admissions raise AdmissionClosed once the admission is closed.
+    """
+
+    log = logging.getLogger('extractor')
+
+    def __init__(self, budget=EXTRACT_DISK_BUDGET, reserve=EXTRACT_DISK_RESERVE):
+        self.budget = budget
+        self.reserve = reserve
+        self.reserved = {}
+        self.cond = Condition()
+        self.closed = False
+
+    def capacity(self, scratch):
+        if self.budget is None:
+            return max(0, shutil.disk_usage(scratch).free - self.reserve)
+        return self.budget
+
+    def acquire(self, meta):
+        """Block until the ROM of meta fits, return its estimated footprint."""
+        rom_path = Path(meta['romPath'])
+        footprint = estimate_footprint(rom_path)
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise AdmissionClosed("admission of {} closed".format(rom_path.name))
+                capacity = self.capacity(rom_path.parent)
+                if not self.reserved or sum(self.reserved.values()) + footprint <= capacity: break
+                self.log.debug("admission: {} needs {} bytes, {} of {} reserved".format(
+                    rom_path.name, footprint, sum(self.reserved.values()), capacity))
+                self.cond.wait(ADMISSION_WAIT_INTERVAL)
+            self.reserved[str(rom_path)] = footprint
+        return footprint
+
+    def release(self, meta):
+        with self.cond:
+            self.reserved.pop(str(meta['romPath']), None)
+            self.cond.notify_all()
+
+    def close(self):
+        """Wake up the pending admissions, which then raise AdmissionClosed."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
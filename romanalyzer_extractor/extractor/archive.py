@@ -1,5 +1,14 @@
-from utils import execute
+import tarfile
+import zipfile
+
+from utils import run, rmf
 from extractor.base import Extractor
+from analysis_extractor.classifier import guess_by_name
+from formats.sparse import SparseError
+from formats.archive import GzipArchive, ENTRY_FILE, open_archive, extract_entry
+
+# read in process, other archives (.7z, .ext4) go to external tools
+STREAMED_SUFFIXES = ('.zip', '.gz', '.tgz', '.tar', '.md5')
 
 class ArchiveExtractor(Extractor):
 
@@ -8,44 +17,64 @@ class ArchiveExtractor(Extractor):
         self.log.debug("Archive extract target: {}".format(self.target))
         self.log.debug("\tstart extract archive.")
 
-        extract_cmd = '' 
-        suffix = self.target.suffix
-        abspath = self.target.absolute()
-
         if self.target.stat().st_size == 0:
             self.log.warn("\tthis is a empty archive {}".format(self.target))
             return None
 
-        if suffix in ('.tar.gz', '.tgz'):
-            extract_cmd = 'mkdir "{}"'.format(self.extracted)
-            extract_cmd = extract_cmd+' && tar -zxf "{}" -C "{}"'.format(abspath, self.extracted)
-        elif suffix == '.gz':
-            extract_cmd = 'gunzip -f -d "{}"'.format(abspath)
-            self.extracted = self.target.with_suffix('')
-        elif suffix in ('.zip'):
-            extract_cmd = 'unzip -o "{}" -d "{}"'.format(abspath, self.extracted)
-        elif suffix == '.7z':
-            extract_cmd = '7za x {} -o{} -y'.format(abspath, self.extracted)
-        elif suffix == ".ext4":
-            extract_cmd = '7z x {} -o{} -y'.format(abspath, self.extracted)
-        elif suffix == '.md5':
-            extract_cmd = 'mkdir "{}"'.format(self.extracted)
-            extract_cmd = extract_cmd+' && tar -xf "{}" -C "{}"'.format(abspath, self.extracted)
-        elif suffix == '.APP' and str(abspath).find("UPDATE.APP")!=-1:
-            extract_cmd = 'perl romanalyzer_extractor/tools/huawei_erofs/split_updata.pl "{}" "{}"'.format(abspath,self.extracted)
+        archive = None
+        if self.target.suffix in STREAMED_SUFFIXES:
+            archive = open_archive(self.target)
+
+        if archive is not None:
+            try:
+                self.extract_members(archive)
+            except (OSError, EOFError, RuntimeError, zipfile.BadZipFile, tarfile.TarError, SparseError) as e:
+                self.log.warn("\tfailed to read {}: {}".format(self.target, e))
+                return None
         else:
-            return None
-        """
-        elif suffix == ".tar.md5":
-            extract_cmd = 'tar -xvf {}'.format(abspath)
-        """
-        
-        #print(extract_cmd)
-        execute(extract_cmd)
-
-        if not self.extracted.exists(): 
+            extract_cmd = self.extract_cmd()
+            if not extract_cmd: return None
+            run(extract_cmd)
+
+        if not self.extracted.exists():
             self.log.warn("\tfailed to extract {}".format(self.target))
             return None
         else:
             self.log.debug("\textracted path: {}".format(self.extracted))
             return self.extracted
+
+    def extract_cmd(self):
+        """Formats without a python reader are left to external tools."""
+        suffix = self.target.suffix
+        abspath = self.target.absolute()
+
+        if suffix == '.7z':
+            return ['7za', 'x', abspath, '-o{}'.format(self.extracted), '-y']
+        elif suffix == ".ext4":
+            return ['7z', 'x', abspath, '-o{}'.format(self.extracted), '-y']
+        return None
+
+    def wants_member(self, name):
+        if not self.manifest: return True
+        return self.manifest.wants_image(name, guess_by_name(name))
+
+    def extract_members(self, archive):
+        """Stream the wanted members out of a zip, tar or gzip file."""
+        if isinstance(archive, GzipArchive):
+            # like gunzip, the file replaces the archive. It may not be named
+            # after the archive, e.g. a sparse image is written as <name>.ext4
+            self.extracted = self.target.with_suffix('')
+            for entry in archive.entries():
+                self.extracted = extract_entry(entry, self.target.parent) or self.extracted
+            if self.extracted.exists(): rmf(self.target)
+            return
+
+        self.extracted.mkdir(exist_ok=True)
+        skipped = 0
+        for entry in archive.entries():
+            if entry.kind == ENTRY_FILE and not self.wants_member(entry.name):
+                skipped += 1
+                continue
+            extract_entry(entry, self.extracted)
+        if skipped:
+            self.log.debug("\tskipped {} member(s) not in manifest".format(skipped))
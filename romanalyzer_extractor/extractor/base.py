@@ -1,14 +1,19 @@
+import stat
 import logging
 from pathlib import Path
-from utils import execute
+
+from utils import rmf
+from extractor.trace import nested_extract
+from settings import EXTRACT_REMOVE_INTERMEDIATES
 
 class Extractor(object):
 
     tool = Path()
     log = logging.getLogger('extractor')
 
-    def __init__(self, target):
+    def __init__(self, target, manifest=None):
         self.target = Path(target)
+        self.manifest = manifest
 
         if self.target.suffix == '.ozip': 
             local_extract = self.target.with_suffix('.zip').name + '.extracted' 
@@ -19,11 +24,27 @@ class Extractor(object):
     def extract(self):
         raise NotImplementedError
 
+    def nested(self, extractor, call=None, *args):
+        """Run extractor.extract(), or call(*args) of it, as part of this
+        extraction. It is traced in a span of its own."""
+        return nested_extract(extractor, call or extractor.extract, *args)
+
+    def inputs(self):
+        """Files the output is made of, the extract cache keys on all of them."""
+        return [self.target]
+
+    def remove_intermediate(self, path):
+        """Free the disk space of a file that was fully extracted."""
+        if not EXTRACT_REMOVE_INTERMEDIATES: return
+        self.log.debug("\tremove intermediate {}".format(path))
+        rmf(path)
+
     def chmod(self):
         if not self.tool.exists():
             self.log.error("Failed to found {}".format(self.tool))
             return False
         
-        chmod_cmd = 'chmod +x "{tool}"'.format(tool=self.tool)
-        execute(chmod_cmd)
+        mode = self.tool.stat().st_mode
+        if not mode & stat.S_IXUSR:
+            self.tool.chmod(mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
         return True
\ No newline at end of file
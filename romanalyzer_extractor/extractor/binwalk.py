@@ -1,4 +1,4 @@
-from utils import execute
+from utils import run
 from extractor.base import Extractor
 class BinwalkExtractor(Extractor):
 
@@ -8,8 +8,7 @@ class BinwalkExtractor(Extractor):
         self.log.debug("binwalk target: {}".format(self.target))
         self.log.debug("\tstart extract target")
         dirname = self.target.parents[0]
-        cmd = 'binwalk --directory={} -Me "{}" '.format(dirname, self.target)
-        execute(cmd)
+        run(['binwalk', '--directory={}'.format(dirname), '-Me', self.target])
 
         extracted = '_' + self.target.name + '.extracted'
         self.extracted =  dirname / extracted
@@ -1,5 +1,5 @@
 from pathlib import Path
-from utils import execute
+from utils import run
 from extractor.base import Extractor
 class BootImgExtractor(Extractor):
     tool = Path('romanalyzer_extractor/tools/bootimg_tools/split_boot').absolute()
@@ -10,12 +10,7 @@ class BootImgExtractor(Extractor):
         self.log.debug("\tstart extract target")
 
         workdir = self.target.parents[0]
-        #extract_cmd = '{split_boot} "{boot_img}"'.format(
-        extract_cmd = 'cd {workdir} && {split_boot} "{boot_img}"'.format(
-                        workdir=workdir,
-                        split_boot=self.tool, 
-                        boot_img=self.target.absolute())
-        execute(extract_cmd)
+        run([self.tool, self.target.absolute()], cwd=workdir)
 
         self.extracted = workdir / 'boot'
         if not self.extracted.exists(): 
@@ -1,29 +1,30 @@
 from pathlib import Path
-from utils import execute
-from extractor.base import Extractor
+from contextlib import contextmanager
+
+from utils import open_run
+from formats.brotli_reader import brotli, BrotliReader
 from extractor.newdat import NewDatExtractor
 
-class BrotliExtractor(Extractor):
+class BrotliExtractor(NewDatExtractor):
+    """Stream the decompressed new.dat straight into the image writer,
+    so the multi-GB system.new.dat never touches the disk."""
+
     tool = Path('romanalyzer_extractor/tools/brotli/brotli').absolute()
 
-    def extract(self):
+    @contextmanager
+    def open_new_data(self):
         self.log.debug("Brotli extract: {}".format(self.target))
-        workdir = self.target.parents[0]
 
-        output_new_dat = workdir / self.target.stem
-        if not output_new_dat.exists():
-            convert_cmd = '{brotli} --decompress {new_dat_br} -o {new_dat}'.format(
-            #convert_cmd = 'cd {workdir} && {brotli} --decompress {new_dat_br} -o {new_dat}'.format(
-                workdir=workdir, brotli=self.tool,
-                new_dat_br=self.target, new_dat=output_new_dat
-            )
-            execute(convert_cmd)
+        if brotli is not None:
+            with BrotliReader(self.target) as reader:
+                yield reader
+            return
 
-        extractor = NewDatExtractor(output_new_dat)
-        self.extracted = extractor.extract()
-        if self.extracted and self.extracted.exists(): 
-            self.log.debug("\textracted path: {}".format(self.extracted))
-            return self.extracted
-        else:
-            self.log.warn("\tfailed to extract {}".format(self.target))
-            return None
+        if not self.chmod():
+            raise ChildProcessError("{} not found".format(self.tool))
+        decompress_cmd = [self.tool, '--decompress', '--stdout', self.target]
+        with open_run(decompress_cmd) as (stdout, result):
+            yield stdout
+        # a partial image is no image, e.g. the tool was killed after its timeout
+        if not result.ok:
+            raise ChildProcessError("{} returned {}".format(self.tool.name, result.returncode))
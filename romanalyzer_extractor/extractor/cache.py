@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from threading import Lock
+
+from settings import EXTRACT_CACHE_DIR, EXTRACT_CACHE_BUDGET, EXTRACT_CACHE_TYPES
+
+HASH_BUFSIZE = 1024 * 1024
+# linux/fs.h, share the extents of a file on btrfs/xfs
+FICLONE = 0x40049409
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_BUFSIZE)
+            if not data: break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+def clone_file(src, dst):
+    """Hard link src to dst, falling back to a reflink and then to a copy."""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+
+    with open(src, 'rb') as src_f, open(dst, 'wb') as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        except OSError:
+            shutil.copyfileobj(src_f, dst_f, HASH_BUFSIZE)
+    shutil.copystat(src, dst)
+
+def clone_tree(src, dst):
+    """Recreate src at dst with linked files, return the bytes it holds."""
+    if src.is_symlink():
+        os.symlink(os.readlink(src), dst)
+        return 0
+    if src.is_file():
+        clone_file(src, dst)
+        return src.stat().st_size
+
+    size = 0
+    dst.mkdir(parents=True, exist_ok=True)
+    for child in src.iterdir():
+        size += clone_tree(child, dst / child.name)
+    return size
+
+class ExtractCache(object):
+    """Content addressed store of extractor outputs.
+
+    An entry is keyed by the sha256 of the files the extractor reads (the
+    extracted file and its sparse chunks or transfer list), the classifier
+    type and the manifest, and holds links to the outputs the extractor
+    returned (which all live next to the file). Entries are evicted least
+    recently used first once the store grows past budget bytes. Files on
+    another filesystem than root are not cached, their outputs could only
+    be copied in and out.
+
+    <root>/<key[:2]>/<key>/meta.json
+    <root>/<key[:2]>/<key>/data/<output names>
+    """
+
+    log = logging.getLogger('extractor')
+
+    def __init__(self, root, budget, types=EXTRACT_CACHE_TYPES):
+        self.root = Path(root).absolute()
+        self.budget = budget
+        self.types = types
+        self.lock = Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.device = self.root.stat().st_dev
+
+    def key(self, inputs, guess, manifest):
+        key = hashlib.sha256()
+        for path in inputs:
+            key.update(file_sha256(path).encode())
+        key.update(guess.encode())
+        if manifest: key.update(manifest.digest().encode())
+        return key.hexdigest()
+
+    def entry(self, key):
+        return self.root / key[:2] / key
+
+    def extract(self, extractor, guess):
+        """Run extractor unless an entry for its target already exists."""
+        target = extractor.target
+        if guess not in self.types or not target.is_file() or target.stat().st_dev != self.device:
+            return extractor.extract()
+
+        key = self.key(extractor.inputs(), guess, extractor.manifest)
+        output = self.restore(key, target)
+        if output is not None:
+            self.log.debug("\tcache hit {}: {}".format(key[:16], target))
+            return output
+
+        output = extractor.extract()
+        if output is not None:
+            self.store(key, target, output)
+        return output
+
+    def restore(self, key, target):
+        entry = self.entry(key)
+        try:
+            with (entry / 'meta.json').open() as fp:
+                meta = json.load(fp)
+            # the entry mtime drives the LRU eviction
+            os.utime(entry / 'meta.json')
+        except (OSError, ValueError):
+            return None
+
+        outputs, restored = [], []
+        try:
+            for name in meta['outputs']:
+                # outputs are named after the file, which may differ from the cached one
+                local = name
+                if name.startswith(meta['target']):
+                    local = target.name + name[len(meta['target']):]
+                output = target.parent / local
+                if not output.exists():
+                    restored.append(output)
+                    clone_tree(entry / 'data' / name, output)
+                outputs.append(output)
+        except OSError as e:
+            # evicted while it was restored, extract instead
+            self.log.debug("\tcache entry {} gone: {}".format(key[:16], e))
+            for output in restored:
+                if output.is_dir() and not output.is_symlink():
+                    shutil.rmtree(output, ignore_errors=True)
+                elif os.path.lexists(output):
+                    os.unlink(output)
+            return None
+        return outputs if meta['list'] else outputs[0]
+
+    def store(self, key, target, output):
+        outputs = output if isinstance(output, list) else [output]
+        try:
+            names = [str(Path(o).relative_to(target.parent)) for o in outputs]
+        except ValueError:
+            self.log.debug("\tnot caching {}: outputs outside of {}".format(target, target.parent))
+            return
+        if not all(Path(o).exists() for o in outputs): return
+
+        entry = self.entry(key)
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            # private to this store, another extract thread may store the same key
+            tmp = Path(tempfile.mkdtemp(prefix='.{}.'.format(key), dir=entry.parent))
+        except OSError as e:
+            self.log.warn("\tfailed to cache {}: {}".format(target, e))
+            return
+
+        try:
+            size = 0
+            for o, name in zip(outputs, names):
+                data = tmp / 'data' / name
+                data.parent.mkdir(parents=True, exist_ok=True)
+                size += clone_tree(Path(o), data)
+            with (tmp / 'meta.json').open('w') as fp:
+                json.dump({'target': target.name, 'outputs': names, 'list': isinstance(output, list),
+                           'size': size, 'created': time.time()}, fp)
+            with self.lock:
+                if entry.exists():
+                    shutil.rmtree(tmp)
+                else:
+                    tmp.rename(entry)
+        except OSError as e:
+            self.log.warn("\tfailed to cache {}: {}".format(target, e))
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def entries(self):
+        """Return [(last use, size, entry)] of every complete entry."""
+        entries = []
+        for meta in self.root.glob('*/*/meta.json'):
+            try:
+                with meta.open() as fp:
+                    size = json.load(fp)['size']
+                entries.append((meta.stat().st_mtime, size, meta.parent))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.budget: break
+                self.log.debug("\tevict cache entry {}".format(entry.name[:16]))
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+extract_cache = ExtractCache(EXTRACT_CACHE_DIR, EXTRACT_CACHE_BUDGET) if EXTRACT_CACHE_DIR else None
@@ -2,7 +2,7 @@ from pathlib import Path
 
 class DirExtractor(object):
 
-    def __init__(self, target):
+    def __init__(self, target, manifest=None):
         self.target = Path(target)
     
     def extract(self):
@@ -0,0 +1,46 @@
+import os
+import posixpath
+from extractor.base import Extractor
+from formats.erofs import ErofsImage, ErofsError
+
+class ErofsImgExtractor(Extractor):
+    """Unpack an EROFS image in process, only the files the manifest asks
+    for when there is one."""
+
+    def extract(self):
+        self.log.debug("erofs image extract target: {}".format(self.target))
+
+        if not self.export(self.target):
+            self.log.warn("\tfailed to extract {}".format(self.target))
+            return None
+        self.log.debug("\textracted path: {}".format(self.extracted))
+        return self.extracted
+
+    def export(self, source):
+        """Copy the files of source, the image path or a view of it, to the
+        extracted dir. Symlinks are recreated when the whole image is unpacked."""
+        if not self.extracted.exists(): self.extracted.mkdir()
+        exported = 0
+        try:
+            with ErofsImage(source) as image:
+                for dirpath, _, files in image.walk():
+                    for name in files:
+                        path = posixpath.join(dirpath, name)
+                        if self.manifest and not self.manifest.wants_file(self.target, path): continue
+
+                        inode = image.lookup(path, follow=False)
+                        output = self.extracted / path.lstrip('/')
+                        if inode.is_file:
+                            image.extract(path, output)
+                        elif inode.is_symlink and not self.manifest:
+                            output.parent.mkdir(parents=True, exist_ok=True)
+                            if not os.path.lexists(output): os.symlink(inode.readlink(), output)
+                        else:
+                            continue
+                        exported += 1
+        except (ErofsError, OSError) as e:
+            self.log.warn("\tfailed to read {}: {}".format(self.target, e))
+            return False
+
+        self.log.debug("\texported {} files".format(exported))
+        return True
@@ -1,6 +1,9 @@
+import shutil
+import posixpath
 from pathlib import Path
-from utils import execute
+from utils import run
 from extractor.base import Extractor
+from formats.ext4 import Ext4Image, Ext4Error
 class ExtImgExtractor(Extractor):
 
     tool = Path('romanalyzer_extractor/tools/extfstools/ext2rd').absolute()
@@ -10,16 +13,40 @@ class ExtImgExtractor(Extractor):
         self.extracted = self.target.parents[0] / (self.target.name+'.extracted')
         if not self.extracted.exists(): self.extracted.mkdir()
 
-        extract_cmd = '{extfstool} "{extimg}" "./:{outdir}"'.format(
-            extfstool = self.tool,
-            extimg = self.target,
-            outdir = self.extracted)
+        if not self.manifest or not self.export_selected(self.target):
+            result = run([self.tool, self.target, './:{}'.format(self.extracted)])
+            if not result.ok:
+                # e.g. not an ext4 image, do not leave an empty tree that looks extracted
+                self.log.warn("\tfailed to extract {}: ext2rd returned {}".format(self.target, result.returncode))
+                shutil.rmtree(self.extracted, ignore_errors=True)
+                return None
 
-        execute(extract_cmd)
-
-        if self.extracted and self.extracted.exists(): 
+        if self.extracted and self.extracted.exists():
             self.log.debug("\textracted path: {}".format(self.extracted))
             return self.extracted
         else:
             self.log.warn("\tfailed to extract {}".format(self.target))
             return None
+
+    def export_selected(self, source):
+        """Only copy the regular files the manifest asks for out of source,
+        the image path or a view of it. Return False when the image can not
+        be read in-process."""
+        if not self.extracted.exists(): self.extracted.mkdir()
+        try:
+            with Ext4Image(source) as image:
+                exported = 0
+                for dirpath, _, files in image.walk():
+                    for name in files:
+                        path = posixpath.join(dirpath, name)
+                        if not self.manifest.wants_file(self.target, path): continue
+                        if not image.lookup(path, follow=False).is_file: continue
+
+                        image.extract(path, self.extracted / path.lstrip('/'))
+                        exported += 1
+        except (Ext4Error, OSError) as e:
+            self.log.warn("\tfailed to read {}: {}, extracting all files".format(self.target, e))
+            return False
+
+        self.log.debug("\texported {} selected files".format(exported))
+        return True
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+class ExtractNode(object):
+
+    def __init__(self, path, guess=None, parent=None):
+        self.path = Path(path)
+        self.guess = guess
+        self.parent = parent
+        self.children = []
+        self.output = None
+        self.span = None
+
+    def add(self, path, guess=None):
+        node = ExtractNode(path, guess, self)
+        self.children.append(node)
+        return node
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+class ExtractJob(object):
+    """Extraction state of one ROM: the tree of extracted containers."""
+
+    def __init__(self, target):
+        self.target = Path(target)
+        self.root = ExtractNode(self.target)
+
+    @property
+    def name(self):
+        return self.target.name
+
+    def nodes(self):
+        return self.root.walk()
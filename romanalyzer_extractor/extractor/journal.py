@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from threading import Lock
+
+from utils import rmf, rmdir
+
+JOURNAL_SUFFIX = '.journal'
+# head and tail bytes hashed to fingerprint a file
+PARTIAL_HASH_SIZE = 1024 * 1024
+# cheap to redo, their outputs are whole directory listings
+UNJOURNALED_TYPES = ('dir',)
+
+def fingerprint(path):
+    """Size and partial sha256 of a file, {relative path: size} of the files
+    of a directory."""
+    path = Path(path)
+    if path.is_dir():
+        files = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                file = os.path.join(root, name)
+                files[os.path.relpath(file, path)] = os.lstat(file).st_size
+        return {'files': files}
+
+    size = path.stat().st_size
+    sha256 = hashlib.sha256()
+    with path.open('rb') as f:
+        sha256.update(f.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            sha256.update(f.read(PARTIAL_HASH_SIZE))
+    return {'size': size, 'sha256': sha256.hexdigest()}
+
+class ExtractJournal(object):
+    """Append-only record of the finished nodes of one ROM job.
+
+    Lives next to the ROM as <rom>.journal, one JSON record per line, the
+    last record of a node wins. A restarted job reuses the outputs of done
+    nodes whose fingerprints still match and removes what nodes that
+    never finished left behind.
+    """
+
+    log = logging.getLogger('extractor')
+
+    def __init__(self, target):
+        self.target = Path(target)
+        self.root = self.target.parent
+        self.path = self.root / (self.target.name + JOURNAL_SUFFIX)
+        self.lock = Lock()
+        self.records = {}
+        self.load()
+
+    def load(self):
+        if not self.path.exists(): return
+        with self.path.open() as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write of the last record before a crash
+                    continue
+                self.records[record['key']] = record
+        self.log.debug("resume {}: {} journaled nodes".format(self.target.name, len(self.records)))
+
+    def append(self, record):
+        with self.lock:
+            self.records[record['key']] = record
+            with self.path.open('a') as fp:
+                fp.write(json.dumps(record) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def relative(self, path):
+        return str(Path(path).relative_to(self.root))
+
+    def key(self, node):
+        return '{}:{}'.format(node.guess, self.relative(node.path))
+
+    def tracks(self, node):
+        if node.guess in UNJOURNALED_TYPES: return False
+        try:
+            self.relative(node.path)
+            return True
+        except ValueError:
+            return False
+
+    def resume(self, node):
+        """Return the outputs of a node that already finished, None to run it."""
+        record = self.records.get(self.key(node))
+        if not record: return None
+
+        if record['status'] == 'done' and self.verify(node, record):
+            outputs = [self.root / name for name in record['outputs']]
+            self.log.debug("\tresume {}: done before".format(node.path))
+            return outputs if record['list'] else outputs[0]
+
+        for name in record.get('partial', []):
+            partial = self.root / name
+            # e.g. the chunks of a sparsechunk set share the output of the first one
+            if not partial.exists() or self.finished_output(name): continue
+            self.log.debug("\tremove stale output {}".format(partial))
+            if partial.is_dir(): rmdir(partial)
+            else: rmf(partial)
+        return None
+
+    def verify(self, node, record):
+        # extractors like gunzip consume their input, the outputs are what counts
+        if node.path.exists() and fingerprint(node.path) != record['input']:
+            return False
+        for name, expected in zip(record['outputs'], record['fingerprints']):
+            output = self.root / name
+            if not output.exists(): return False
+            if 'files' not in expected:
+                if fingerprint(output) != expected: return False
+                continue
+
+            # nested extraction adds files to the directory and may consume some
+            for relative, size in expected['files'].items():
+                file = output / relative
+                if file.exists() or file.is_symlink():
+                    if os.lstat(file).st_size != size: return False
+                elif not self.consumed(self.relative(file)):
+                    return False
+        return bool(record['outputs'])
+
+    def finished_output(self, name):
+        return any(r['status'] == 'done' and name in r['outputs'] for r in self.records.values())
+
+    def consumed(self, name):
+        """A file is allowed to go away once it was extracted as a node."""
+        return any(key.split(':', 1)[1] == name for key in self.records)
+
+    def start(self, node, extractor):
+        partial = getattr(extractor, 'extracted', None)
+        self.append({
+            'key': self.key(node),
+            'status': 'started',
+            'partial': [self.relative(partial)] if partial else [],
+        })
+
+    def done(self, node, output):
+        outputs = output if isinstance(output, list) else [output] if output else []
+        try:
+            names = [self.relative(o) for o in outputs]
+        except ValueError:
+            names = []
+        if not names or not all(Path(o).exists() for o in outputs):
+            self.append({'key': self.key(node), 'status': 'failed',
+                         'partial': self.records[self.key(node)].get('partial', [])})
+            return
+
+        self.append({
+            'key': self.key(node),
+            'status': 'done',
+            'input': fingerprint(node.path) if node.path.exists() else None,
+            'outputs': names,
+            'list': isinstance(output, list),
+            'fingerprints': [fingerprint(o) for o in outputs],
+        })
+
+    def remove(self):
+        if self.path.exists(): self.path.unlink()
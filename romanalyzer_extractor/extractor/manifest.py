@@ -0,0 +1,69 @@
+import re
+import hashlib
+from pathlib import Path, PurePosixPath
+from fnmatch import fnmatch
+
+from settings import EXTRACT_CHECKLIST, EXTRACT_PATTERNS, EXTRACT_PARTITIONS
+
+# classifier types of whole partition images
+IMAGE_TYPES = ('sparseimg', 'extimg', 'erofsimg', 'newdat', 'brotli', 'bootimg', 'dataimg')
+# images that hold other partitions rather than files
+CONTAINER_PARTITIONS = ('super',)
+
+def partition_name(path):
+    """system.img, system_a.img, SYSTEM.img, system.new.dat.br,
+    system.img_sparsechunk.0 and system.img.ext4 all name 'system'."""
+    name = Path(path).name.lower().split('.')[0]
+    return re.sub(r'_[ab]$', '', name)
+
+class ExtractManifest(object):
+    """Partitions and files the analyzers actually read.
+
+    paths are absolute ROM paths as listed in the checklist (/system/...),
+    patterns are matched against file names (*.apk).
+    """
+
+    def __init__(self, paths=(), patterns=(), partitions=()):
+        self.paths = set(paths)
+        self.patterns = tuple(patterns)
+        self.partitions = set(partitions)
+
+        for path in self.paths:
+            parts = PurePosixPath(path).parts
+            if len(parts) > 3 and parts[1] == 'system' and parts[2] in ('vendor', 'product', 'system_ext', 'odm'):
+                self.partitions.add(parts[2])
+            elif len(parts) > 2:
+                self.partitions.add(parts[1])
+
+    @classmethod
+    def from_checklist(cls, checklist=EXTRACT_CHECKLIST, patterns=EXTRACT_PATTERNS, partitions=EXTRACT_PARTITIONS):
+        with open(checklist) as fp:
+            paths = [line.strip() for line in fp if line.strip()]
+        return cls(paths, patterns, partitions)
+
+    def digest(self):
+        """Identify the selection, outputs extracted under another one differ."""
+        selection = '\n'.join(sorted(self.paths) + ['*'] + list(self.patterns) + ['/'] + sorted(self.partitions))
+        return hashlib.sha256(selection.encode()).hexdigest()
+
+    def wants_partition(self, name):
+        name = partition_name(name)
+        return name in self.partitions or name in CONTAINER_PARTITIONS
+
+    def wants_image(self, path, guess):
+        if guess not in IMAGE_TYPES: return True
+        return self.wants_partition(path)
+
+    def rom_paths(self, partition, path):
+        """Candidate ROM paths of a file found at path inside a partition image."""
+        path = '/' + str(path).lstrip('/')
+        partition = partition_name(partition)
+        if partition == 'system':
+            return (path, '/system' + path)
+        return ('/system/{}{}'.format(partition, path), '/{}{}'.format(partition, path))
+
+    def wants_file(self, partition, path):
+        name = PurePosixPath(path).name
+        if name == 'build.prop': return True
+        if any(fnmatch(name, pattern) for pattern in self.patterns): return True
+        return any(rom_path in self.paths for rom_path in self.rom_paths(partition, path))
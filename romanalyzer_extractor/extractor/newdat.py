@@ -1,33 +1,56 @@
-from pathlib import Path
-from utils import execute
+from contextlib import nullcontext
+
+from utils import rmf
+from formats.sdat import sdat2img, TransferListError
 from extractor.base import Extractor
 from extractor.extimg import ExtImgExtractor
+from extractor.erofsimg import ErofsImgExtractor
+from analysis_extractor.classifier import magic_type, read_header
 
 class NewDatExtractor(Extractor):
-    tool = Path('romanalyzer_extractor/tools/sdat2img/sdat2img.py').absolute()
+
+    def open_new_data(self):
+        return nullcontext(self.target)
+
+    def transfer_list(self):
+        partition = self.target.name.split('.new.dat')[0]
+        return self.target.parent / "{}.transfer.list".format(partition)
+
+    def inputs(self):
+        transfer_list = self.transfer_list()
+        return [self.target, transfer_list] if transfer_list.exists() else [self.target]
 
     def extract(self):
         self.log.debug("New.dat extract: {}".format(self.target))
         workdir = self.target.parents[0]
+        partition = self.target.name.split('.new.dat')[0]
 
-        transfer_list = workdir / "{}".format(self.target.name.replace('.new.dat', '.transfer.list'))
+        transfer_list = self.transfer_list()
 
         if not transfer_list.exists():
             self.log.warn("cannot unpack {} because lack of {}".format(self.target, transfer_list))
             return None
 
-        output_system_img = workdir / "{}".format(self.target.name.replace('.new.dat', '.img'))
-        
-        convert_cmd = 'python3 {sdat2img} "{transfer_list}" "{system_new_file}" "{system_img}"'.format(
-        #convert_cmd = 'cd {workdir} && python3 {sdat2img} {transfer_list} {system_new_file} {system_img}'.format(
-            workdir=workdir, sdat2img=self.tool,
-            transfer_list=transfer_list, system_new_file=self.target, system_img=output_system_img
-        )
-        execute(convert_cmd)
-
-        extractor = ExtImgExtractor(output_system_img)
-        self.extracted = extractor.extract()
-        if self.extracted and self.extracted.exists(): 
+        output_system_img = workdir / "{}.img".format(partition)
+
+        try:
+            with self.open_new_data() as new_data:
+                sdat2img(transfer_list, new_data, output_system_img)
+        except (OSError, TransferListError) as e:
+            self.log.warn("\tfailed to convert {}: {}".format(self.target, e))
+            if output_system_img.exists(): rmf(output_system_img)
+            return None
+
+        # Android 10+ system images may be EROFS
+        if magic_type(read_header(output_system_img)) == 'erofs':
+            extractor = ErofsImgExtractor(output_system_img, self.manifest)
+        else:
+            extractor = ExtImgExtractor(output_system_img, self.manifest)
+        self.extracted = self.nested(extractor)
+        if self.extracted and self.extracted.exists():
+            # the converted image and the new.dat are only dropped once their files are out
+            self.remove_intermediate(output_system_img)
+            self.remove_intermediate(self.target)
             self.log.debug("\textracted path: {}".format(self.extracted))
             return self.extracted
         else:
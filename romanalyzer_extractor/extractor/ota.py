@@ -1,26 +1,19 @@
-from pathlib import Path
-from utils import execute
+from formats.payload import extract_payload
 from extractor.base import Extractor
+from settings import EXTRACT_WORKER_NUM, PAYLOAD_PARTITIONS
 
 class AndrOtaPayloadExtractor(Extractor):
 
-    tool = Path('romanalyzer_extractor/tools/extract_android_ota_payload/extract_android_ota_payload.py').absolute()
-
     def extract(self):
         self.log.debug("Android OTA Payload extract target: {}".format(self.target))
         self.log.debug("\tstart extract payload.bin.")
 
-        convert_cmd = 'python3 {extract_script} "{payload}" "{extracted_dir}"'.format(
-                        extract_script=self.tool, 
-                        payload=self.target.absolute(), 
-                        extracted_dir=self.extracted
-                    )
-        execute(convert_cmd)
-
-        self.log.debug('\textracted ota payload.bin to: {}'.format(self.extracted))
+        partitions = self.manifest.partitions if self.manifest else PAYLOAD_PARTITIONS
+        extract_payload(self.target, self.extracted,
+                        partitions=partitions, workers=EXTRACT_WORKER_NUM)
 
         if not self.extracted.exists(): 
-            self.log.warn("\tfailed to extract {} using unzip".format(self.converted_zip))
+            self.log.warn("\tfailed to extract {}".format(self.target))
             return None
         else:
             self.log.debug("\textracted ota payload.bin to: {}".format(self.extracted))
@@ -1,29 +1,87 @@
+import os
+import zipfile
 from pathlib import Path
-from utils import rmf, execute
+from utils import rmf
 from extractor.base import Extractor
 from extractor.archive import ArchiveExtractor
+from formats.archive import ZipArchive
+from formats.ozip import (OZIP_MAGIC, OZIP_DATA_OFFSET, BLOCK_HEADER_SIZE, AES_BLOCK,
+                          OzipError, OzipDecryptor, ozip_keys, device_model)
+from settings import EXTRACT_WORKER_NUM
 
 class OZipExtractor(Extractor):
 
-    tool = Path('romanalyzer_extractor/tools/oppo_ozip_decrypt/ozipdecrypt.py').absolute()
     def extract(self):
         self.log.debug("OZip extract target: {}".format(self.target))
         self.log.debug("\tstart extract archive.")
 
-        converted_zip = self.target.with_suffix('.zip')
-        convert_cmd = 'python3 {decrypt_script} "{ozip}"'.format(
-            decrypt_script=self.tool, ozip=self.target.absolute()
-        )
-        execute(convert_cmd)
-
-        self.log.debug('\tconverted ozip to zip: {}'.format(converted_zip))
+        with self.target.open('rb') as f:
+            magic = f.read(len(OZIP_MAGIC))
+        try:
+            if magic == OZIP_MAGIC:
+                self.extract_encrypted()
+            elif magic[:2] == b'PK':
+                self.extract_members()
+            else:
+                self.log.warn("\tunknown ozip magic {}".format(magic))
+                return None
+        except (OzipError, OSError, ValueError, zipfile.BadZipFile) as e:
+            self.log.warn("\tfailed to decrypt {}: {}".format(self.target, e))
+            return None
 
-        extractor = ArchiveExtractor(converted_zip)
-        self.extracted = extractor.extract()
-        rmf(converted_zip)
-        if self.extracted and self.extracted.exists(): 
+        if self.extracted and self.extracted.exists():
             self.log.debug("\textracted path: {}".format(self.extracted))
             return self.extracted
         else:
-            self.log.warn("\tfailed to extract {} using unzip".format(converted_zip))
+            self.log.warn("\tfailed to extract {}".format(self.target))
             return None
+
+    def find_key(self, path, offset):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return ozip_keys.find(f.read(AES_BLOCK), device_model(self.target.name))
+
+    def extract_encrypted(self):
+        """The whole file is an encrypted zip."""
+        converted_zip = self.target.with_suffix('.zip')
+        key = self.find_key(self.target, OZIP_DATA_OFFSET)
+        OzipDecryptor(key, EXTRACT_WORKER_NUM).decrypt_file(self.target, converted_zip)
+        self.log.debug('\tconverted ozip to zip: {}'.format(converted_zip))
+
+        extractor = ArchiveExtractor(converted_zip, self.manifest)
+        self.extracted = self.nested(extractor)
+        rmf(converted_zip)
+
+    def extract_members(self):
+        """A plain zip some members of which are encrypted, they are decrypted
+        in place after extraction instead of being zipped up again."""
+        with zipfile.ZipFile(self.target) as zf:
+            metadata = zf.read('oppo_metadata').decode().splitlines() if 'oppo_metadata' in zf.namelist() else []
+
+        extractor = ArchiveExtractor(self.target, self.manifest)
+        extractor.extracted = self.extracted
+        self.nested(extractor, extractor.extract_members, ZipArchive(self.target))
+
+        if metadata:
+            # listed members have a 0x1050 byte header and are encrypted as a whole
+            encrypted = [self.extracted / name for name in metadata if name]
+            encrypted = [path for path in encrypted if path.is_file()]
+            decrypt, key_offset = OzipDecryptor.decrypt_member, OZIP_DATA_OFFSET
+        else:
+            encrypted = []
+            for root, _, names in os.walk(self.extracted):
+                for name in names:
+                    path = Path(root) / name
+                    with path.open('rb') as f:
+                        if f.read(len(OZIP_MAGIC)) == OZIP_MAGIC: encrypted.append(path)
+            decrypt, key_offset = OzipDecryptor.decrypt_blocks, BLOCK_HEADER_SIZE
+        if not encrypted: return
+
+        # vbmeta decrypts to a known magic, try it first
+        encrypted.sort(key=lambda path: path.name != 'vbmeta.img')
+        decryptor = OzipDecryptor(self.find_key(encrypted[0], key_offset), EXTRACT_WORKER_NUM)
+        for path in encrypted:
+            self.log.debug("\tdecrypt {}".format(path))
+            decrypted = path.with_name(path.name + '.dec')
+            decrypt(decryptor, path, decrypted)
+            os.replace(decrypted, path)
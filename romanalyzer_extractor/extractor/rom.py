@@ -1,65 +1,48 @@
 from pathlib import Path
-
-from analysis_extractor.classifier import Classify
-
 from extractor.base import Extractor
 from extractor.archive import ArchiveExtractor
 from extractor.binwalk import BinwalkExtractor
 from extractor.bootimg import BootImgExtractor
 from extractor.brotli import BrotliExtractor
 from extractor.extimg import ExtImgExtractor
+from extractor.erofsimg import ErofsImgExtractor
 from extractor.newdat import NewDatExtractor
 from extractor.ota import AndrOtaPayloadExtractor
 from extractor.ozip import OZipExtractor
 from extractor.sparse import SparseImgExtractor
+from extractor.updateapp import UpdateAppExtractor
+from extractor.superimg import SuperImgExtractor
 from extractor.dir import DirExtractor
+from extractor.job import ExtractJob
+from extractor.scheduler import ExtractScheduler
+from extractor.trace import write_jsonl, write_chrome_trace, write_tool_summary, tool_summary
+from extractor.journal import ExtractJournal
+from utils import tool_usage, tool_usage_lock
+from settings import EXTRACT_TRACE_DIR, EXTRACT_JOURNAL
 
 class ROMExtractor(Extractor):
 
-    process_queue = []
-
     extractor_map = {
         'ozip': OZipExtractor,
         'archive': ArchiveExtractor,
         'otapayload': AndrOtaPayloadExtractor,
+        'updateapp': UpdateAppExtractor,
         'bootimg': BootImgExtractor,
         'sparseimg': SparseImgExtractor,
+        'superimg': SuperImgExtractor,
         # 'dataimg': BinwalkExtractor,
         'extimg': ExtImgExtractor,
+        'erofsimg': ErofsImgExtractor,
         'brotli': BrotliExtractor,
         'newdat': NewDatExtractor,
         'dir': DirExtractor
     }
 
-    def enqueue(self, target):
-        if isinstance(target, list): 
-            self.process_queue.extend(target)
-        elif isinstance(target, Path): 
-            self.process_queue.append(target)
-
     def extract(self):
         self.log.debug('add {} to process queue'.format(self.target))
-        self.process_queue.append(self.target)
-        
-        while self.process_queue:
-            
-            process_item = self.process_queue.pop()
-            guess = Classify(process_item)
-            
-            #print(process_item,"   ",guess)
-            
-            self.log.debug("\t 000000 {}  {}".format(process_item,guess))
-            
-            if guess not in self.extractor_map.keys():
-                continue
-
-            try:
-                print(guess)
-                #print(process_item,"   ",guess)
-                self.enqueue(self.extractor_map[guess](process_item).extract())
-            except Exception as e:
-                self.log.exception("failed to extract {} ... skip it.".format(process_item))
-                self.log.exception(e)
+        journal = ExtractJournal(self.target) if EXTRACT_JOURNAL else None
+        self.job = ExtractScheduler(self.extractor_map, self.manifest, journal=journal).run(ExtractJob(self.target))
+        if EXTRACT_TRACE_DIR: self.write_trace(EXTRACT_TRACE_DIR)
 
         if not self.extracted.exists():
             self.log.debug("Failed to extract: {}".format(self.extracted))
@@ -67,3 +50,19 @@ class ROMExtractor(Extractor):
         else:
             self.log.debug("Extracted path: {}".format(self.extracted))
             return self.extracted
+
+    def write_trace(self, trace_dir):
+        """Dump the spans of the job as <rom>.spans.jsonl and <rom>.trace.json,
+        and the usage of the external tools as <rom>.tools.json."""
+        trace_dir = Path(trace_dir)
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        write_jsonl(self.job, trace_dir / (self.target.name+'.spans.jsonl'))
+        write_chrome_trace(self.job, trace_dir / (self.target.name+'.trace.json'))
+        with tool_usage_lock:
+            process_usage = {tool: list(usage) for tool, usage in tool_usage.items()}
+        write_tool_summary(self.job, trace_dir / (self.target.name+'.tools.json'), process_usage)
+        self.log.debug("Extract trace: {}".format(trace_dir / (self.target.name+'.trace.json')))
+
+        for tool, usage in sorted(tool_summary(self.job).items()):
+            self.log.info("\t{}: {runs} runs, {failures} failed, {timeouts} timed out, {wall:.1f}s wall, "
+                          "{cpu:.1f}s cpu, {maxrss} KiB peak rss".format(tool, **usage))
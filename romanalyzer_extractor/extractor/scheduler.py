@@ -0,0 +1,146 @@
+import logging
+from pathlib import Path
+from threading import Condition
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from analysis_extractor.classifier import Classify
+from utils import collect_runs
+from extractor.cache import extract_cache
+from extractor.trace import ExtractSpan, active_span
+from settings import EXTRACT_WORKER_NUM, EXTRACT_TOOL_LIMITS
+
+class ToolSlots(object):
+    """Per-type concurrency limits shared by every running ROM job."""
+
+    def __init__(self, limits, default):
+        self.limits = limits
+        self.default = default
+        self.count = defaultdict(int)
+        self.cond = Condition()
+
+    def acquire(self, guess):
+        with self.cond:
+            if self.count[guess] >= self.limits.get(guess, self.default):
+                return False
+            self.count[guess] += 1
+            return True
+
+    def release(self, guess):
+        with self.cond:
+            self.count[guess] -= 1
+            self.cond.notify_all()
+
+    def wait(self, timeout=None):
+        with self.cond:
+            self.cond.wait(timeout)
+
+extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKER_NUM)
+tool_slots = ToolSlots(EXTRACT_TOOL_LIMITS, EXTRACT_WORKER_NUM)
+
+class ExtractScheduler(object):
+    """Run the extractors of one ROM job on the shared extract pool.
+
+    An item's outputs are only enqueued after its extractor returned, so a
+    child is never classified or extracted before its parent finished.
+    Everything a scheduler touches besides the pool and the tool slots
+    belongs to its own job, so several ROMs can be extracted at once.
+    """
+
+    log = logging.getLogger('extractor')
+
+    def __init__(self, extractor_map, manifest=None, pool=extract_pool, slots=tool_slots,
+                 workers=EXTRACT_WORKER_NUM, cache=extract_cache, journal=None):
+        self.extractor_map = extractor_map
+        self.manifest = manifest
+        self.pool = pool
+        self.slots = slots
+        self.workers = workers
+        self.cache = cache
+        self.journal = journal
+
+        self.pending = deque()
+        self.ready = deque()
+        self.running = {}
+
+    def enqueue(self, target, parent):
+        if isinstance(target, list):
+            self.pending.extend((item, parent) for item in target)
+        elif isinstance(target, Path):
+            self.pending.append((target, parent))
+
+    def run(self, job):
+        self.job = job
+        self.enqueue(job.target, None)
+
+        while self.pending or self.ready or self.running:
+            self.classify()
+            self.dispatch()
+            if not self.running:
+                # every ready item waits for a tool slot held by another job
+                if self.ready: self.slots.wait(timeout=1)
+                continue
+
+            done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = self.running.pop(future)
+                self.slots.release(node.guess)
+                node.output = future.result()
+                self.enqueue(node.output, node)
+
+        return job
+
+    def classify(self):
+        while self.pending:
+            process_item, parent = self.pending.popleft()
+            guess = Classify(process_item)
+
+            self.log.debug("\t{}  {}".format(process_item, guess))
+
+            if guess not in self.extractor_map.keys():
+                continue
+            if parent and self.manifest and not self.manifest.wants_image(process_item, guess):
+                self.log.debug("\tskip {}: partition not in manifest".format(process_item))
+                continue
+
+            if parent is None:
+                node = self.job.root
+                node.guess = guess
+            else:
+                node = parent.add(process_item, guess)
+            self.ready.append(node)
+
+    def dispatch(self):
+        waiting = deque()
+        while self.ready and len(self.running) < self.workers:
+            node = self.ready.popleft()
+            if not self.slots.acquire(node.guess):
+                waiting.append(node)
+                continue
+
+            future = self.pool.submit(self.extract_node, node)
+            self.running[future] = node
+        self.ready.extendleft(reversed(waiting))
+
+    def extract_node(self, node):
+        extractor_cls = self.extractor_map[node.guess]
+        node.span = ExtractSpan(node, extractor_cls.__name__)
+        output = None
+        with collect_runs() as runs, active_span(node.span):
+            try:
+                journaled = self.journal and self.journal.tracks(node)
+                output = self.journal.resume(node) if journaled else None
+                if output is None:
+                    extractor = extractor_cls(node.path, self.manifest)
+                    if journaled: self.journal.start(node, extractor)
+                    # hashing the ROM itself would cost a full extra read of every ROM
+                    if self.cache and node.parent is not None:
+                        output = self.cache.extract(extractor, node.guess)
+                    else:
+                        output = extractor.extract()
+                    if journaled: self.journal.done(node, output)
+            except Exception as e:
+                self.log.exception("{}: failed to extract {} ... skip it.".format(self.job.name, node.path))
+                self.log.exception(e)
+        node.span.finish(output, runs)
+        return output
@@ -1,35 +1,110 @@
-from pathlib import Path
-from utils import execute
+import re
 from extractor.base import Extractor
 from extractor.extimg import ExtImgExtractor
 from extractor.archive import ArchiveExtractor
+from extractor.superimg import SuperImgExtractor
+from extractor.erofsimg import ErofsImgExtractor
+from analysis_extractor.classifier import HEADER_SIZE, magic_type, read_header
+from formats.sparse import SparseImage, SparseError
+from formats.lp import SuperImage, LpError, is_super
+
+# Samsung/Motorola split one sparse image into system.img_sparsechunk.0, .1, ...
+SPARSECHUNK = re.compile(r'^(.+)_sparsechunk\.(\d+)$')
 
 class SparseImgExtractor(Extractor):
-    
-    tool = Path('romanalyzer_extractor/tools/android-simg2img/simg2img').absolute()
 
-    def extract(self):
-        if not self.chmod(): return None
+    def __init__(self, target, manifest=None):
+        super().__init__(target, manifest)
+        # where the files of the converted image end up
+        self.extracted = self.target.parent / (SPARSECHUNK.sub(r'\1', self.target.name)+'.ext4.extracted')
+
+    def chunk_set(self):
+        """Return (image name, sparse files) of the image the target belongs
+        to, or None when another chunk of the set converts it."""
+        match = SPARSECHUNK.match(self.target.name)
+        if not match: return self.target.name, [self.target]
+
+        chunks = []
+        for path in self.target.parent.iterdir():
+            sibling = SPARSECHUNK.match(path.name)
+            if sibling and sibling.group(1) == match.group(1):
+                chunks.append((int(sibling.group(2)), path))
+        chunks.sort()
 
+        if chunks[0][1] != self.target: return None
+        return match.group(1), [path for _, path in chunks]
+
+    def inputs(self):
+        chunk_set = self.chunk_set()
+        return chunk_set[1] if chunk_set else [self.target]
+
+    def extract(self):
         self.log.debug("sparse image: {}".format(self.target))
-        self.log.debug("\tstart convert sparse img to ext4 img")
-        
-        ext4img = self.target.parents[0] / (self.target.name+'.ext4')
-        convert_cmd = '{simg2img} "{sparse_img}" "{output}"'.format(
-                    simg2img=self.tool, 
-                    sparse_img=self.target.absolute(), 
-                    output=ext4img)
-        execute(convert_cmd)
 
+        chunk_set = self.chunk_set()
+        if not chunk_set:
+            self.log.debug("\tconverted with the first chunk of its set")
+            return None
+        name, paths = chunk_set
+
+        try:
+            sparse = SparseImage(paths)
+        except (SparseError, OSError) as e:
+            self.log.warn("\tfailed to parse {}: {}".format(self.target, e))
+            return None
+
+        ext4img = self.target.parents[0] / (name+'.ext4')
+        view = sparse.view()
+        try:
+            if is_super(view):
+                # split the logical partitions out of the sparse image, it is never expanded
+                with SuperImage(view) as image:
+                    extractor = SuperImgExtractor(ext4img, self.manifest)
+                    self.extracted = self.nested(extractor, extractor.extract_from, image)
+                return self.extracted
+
+            if magic_type(view[:HEADER_SIZE]) == 'erofs':
+                # EROFS is read through the sparse view as well, with or without a manifest
+                extractor = ErofsImgExtractor(ext4img, self.manifest)
+                if not self.nested(extractor, extractor.export, view):
+                    self.log.warn("\tfailed to extract {}".format(self.target))
+                    return None
+                self.extracted = extractor.extracted
+                self.log.debug("\textracted path: {}".format(self.extracted))
+                return self.extracted
+        except LpError as e:
+            self.log.warn("\tfailed to read super image {}: {}".format(self.target, e))
+            return None
+        finally:
+            view.close()
+
+        if self.manifest:
+            # read the selected files through the sparse view, the image is never expanded
+            extractor = ExtImgExtractor(ext4img, self.manifest)
+            view = sparse.view()
+            try:
+                exported = self.nested(extractor, extractor.export_selected, view)
+            finally:
+                view.close()
+            if exported:
+                self.extracted = extractor.extracted
+                self.log.debug("\textracted path: {}".format(self.extracted))
+                return self.extracted
+
+        self.log.debug("\tstart convert {} sparse file(s) to ext4 img".format(len(paths)))
+        sparse.unsparse(ext4img)
         self.log.debug("\tconverted ext4 image: {}".format(ext4img))
 
-        #extractor = ExtImgExtractor(ext4img)
-        extractor = ArchiveExtractor(ext4img)
-        self.extracted =  extractor.extract()
+        if self.manifest or magic_type(read_header(ext4img)) == 'ext4':
+            extractor = ExtImgExtractor(ext4img, self.manifest)
+        else:
+            extractor = ArchiveExtractor(ext4img)
+        self.extracted = self.nested(extractor)
 
-        if not self.extracted.exists(): 
+        if not self.extracted or not self.extracted.exists():
             self.log.warn("\tfailed to extract {}".format(self.target))
             return None
         else:
+            self.remove_intermediate(ext4img)
             self.log.debug("\textracted path: {}".format(self.extracted))
             return self.extracted
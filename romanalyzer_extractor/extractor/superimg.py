@@ -0,0 +1,69 @@
+import struct
+from extractor.base import Extractor
+from extractor.extimg import ExtImgExtractor
+from extractor.erofsimg import ErofsImgExtractor
+from extractor.manifest import partition_name
+from formats.lp import SuperImage, LpError
+from formats.ext4 import EXT4_MAGIC
+from formats.erofs import EROFS_MAGIC, EROFS_SUPER_OFFSET
+from settings import SUPER_PARTITIONS
+
+class SuperImgExtractor(Extractor):
+    """Split the logical partitions out of a dynamic partitions super image.
+
+    With a manifest the selected files of ext4 and erofs partitions are read straight
+    through views of the super image, other partitions are copied out as
+    <name>.img for the next extractors.
+    """
+
+    def wants(self, partition):
+        name = partition_name(partition.name)
+        if self.manifest: return self.manifest.wants_partition(name)
+        return SUPER_PARTITIONS is None or name in SUPER_PARTITIONS
+
+    def selected(self, image):
+        """The wanted partitions with data, one slot of A/B pairs."""
+        names = {partition.name for partition in image.partitions if partition.extents}
+        for partition in image.partitions:
+            if not partition.extents or not self.wants(partition): continue
+            if partition.name.endswith('_b') and partition.name[:-2] + '_a' in names: continue
+            yield partition
+
+    def extract(self):
+        self.log.debug("super image extract target: {}".format(self.target))
+        try:
+            with SuperImage(self.target) as image:
+                return self.extract_from(image)
+        except (LpError, OSError) as e:
+            self.log.warn("\tfailed to read {}: {}".format(self.target, e))
+            return None
+
+    def extract_from(self, image):
+        """Extract the partitions of an opened SuperImage, e.g. one over a sparse view."""
+        self.extracted.mkdir(exist_ok=True)
+        for partition in self.selected(image):
+            output = self.extracted / (partition.name + '.img')
+            if self.manifest and self.export_selected(image, partition, output): continue
+
+            self.log.debug("\tcopy {} ({} bytes)".format(partition.name, partition.size))
+            image.extract(partition, output)
+
+        if not any(self.extracted.iterdir()):
+            self.log.warn("\tno partition of {} extracted".format(self.target))
+            return None
+        self.log.debug("\textracted path: {}".format(self.extracted))
+        return self.extracted
+
+    def export_selected(self, image, partition, output):
+        view = image.view(partition)
+        # only ext4 and erofs partitions are read in place
+        if view[0x438:0x43a] == struct.pack('<H', EXT4_MAGIC):
+            extractor = ExtImgExtractor(output, self.manifest)
+            if not self.nested(extractor, extractor.export_selected, view): return False
+        elif view[EROFS_SUPER_OFFSET:EROFS_SUPER_OFFSET+4] == struct.pack('<I', EROFS_MAGIC):
+            extractor = ErofsImgExtractor(output, self.manifest)
+            if not self.nested(extractor, extractor.export, view): return False
+        else:
+            return False
+        self.log.debug("\texported selected files of {} to {}".format(partition.name, extractor.extracted))
+        return True
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import threading
+from itertools import count
+from pathlib import Path
+from contextlib import contextmanager
+
+from utils import collect_runs
+
+_span_ids = count(1)
+# span of the extraction the current thread runs
+_active = threading.local()
+
+def tree_size(path):
+    """Bytes held by a file or by all files below a directory."""
+    path = Path(path)
+    if path.is_symlink() or not path.exists(): return 0
+    if not path.is_dir(): return path.stat().st_size
+
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            size += tree_size(entry.path)
+        elif entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+class ExtractSpan(object):
+    """Timing of one extractor invocation, its parent is the span of the
+    container the extracted file came out of, or of the extractor that
+    called it (sparse or new.dat conversion handing over to ExtImg, ...)."""
+
+    def __init__(self, node, extractor, path=None, parent=None):
+        self.id = next(_span_ids)
+        if node is not None:
+            self.parent = node.parent.span.id if node.parent and node.parent.span else None
+            path, self.guess = node.path, node.guess
+        else:
+            self.parent, self.guess = parent.id, None
+        self.path = str(path)
+        self.extractor = extractor
+        self.thread = threading.get_ident()
+        # directories were already counted as the output of their parent
+        path = Path(path)
+        self.input_size = path.stat().st_size if path.is_file() else 0
+        self.output_size = 0
+        self.tools = []
+        self.tool_cpu = 0.0
+        self.children = []
+
+        self.start = time.time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._clock = time.monotonic()
+        self._thread_time = time.thread_time()
+
+    def child(self, extractor, path):
+        span = ExtractSpan(None, extractor, path, self)
+        self.children.append(span)
+        return span
+
+    def finish(self, output, runs):
+        """Close the span, runs are the tool invocations made meanwhile
+        outside of its child spans.
+
+        cpu is the time of the worker thread plus the tools it and its
+        children waited for, process pools (payload.bin) are not accounted."""
+        self.wall = time.monotonic() - self._clock
+        self.tool_cpu = sum(r.cpu for r in runs) + sum(child.tool_cpu for child in self.children)
+        self.cpu = time.thread_time() - self._thread_time + self.tool_cpu
+        self.tools = [{'tool': r.tool, 'returncode': r.returncode, 'timed_out': r.timed_out,
+                       'wall': r.wall, 'cpu': r.cpu, 'maxrss': r.maxrss} for r in runs]
+
+        outputs = output if isinstance(output, list) else [output] if output else []
+        self.output_size = sum(tree_size(o) for o in outputs if isinstance(o, (str, os.PathLike)))
+
+    def fmt(self):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'path': self.path,
+            'guess': self.guess,
+            'extractor': self.extractor,
+            'start': self.start,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'input_size': self.input_size,
+            'output_size': self.output_size,
+            'tools': self.tools,
+        }
+
+@contextmanager
+def active_span(span):
+    """Make span the parent of the nested extractions of the current thread."""
+    previous = getattr(_active, 'span', None)
+    _active.span = span
+    try:
+        yield span
+    finally:
+        _active.span = previous
+
+def nested_extract(extractor, call, *args):
+    """call(*args) of an extractor run by another one, in a child span of
+    the span of the current thread (when there is one)."""
+    parent = getattr(_active, 'span', None)
+    if parent is None: return call(*args)
+
+    span = parent.child(type(extractor).__name__, extractor.target)
+    output = None
+    with collect_runs() as runs, active_span(span):
+        try:
+            output = call(*args)
+        finally:
+            # export_selected() and the like only report success
+            span.finish(extractor.extracted if output is True else output, runs)
+    return output
+
+def span_tree(span):
+    yield span
+    for child in span.children:
+        yield from span_tree(child)
+
+def job_spans(job):
+    return [span for node in job.nodes() if node.span for span in span_tree(node.span)]
+
+def write_jsonl(job, path):
+    """One span per line."""
+    with open(path, 'w') as fp:
+        for span in job_spans(job):
+            fp.write(json.dumps(span.fmt()) + '\n')
+    return path
+
+def tool_summary(job):
+    """Per tool runs, failures, timeouts, wall and cpu seconds and peak RSS
+    (KiB) of the tool invocations of a job."""
+    summary = {}
+    for span in job_spans(job):
+        for run in span.tools:
+            usage = summary.setdefault(run['tool'], {'runs': 0, 'failures': 0, 'timeouts': 0,
+                                                     'wall': 0.0, 'cpu': 0.0, 'maxrss': 0})
+            usage['runs'] += 1
+            usage['failures'] += 0 if run['returncode'] == 0 else 1
+            usage['timeouts'] += 1 if run.get('timed_out') else 0
+            usage['wall'] += run['wall']
+            usage['cpu'] += run['cpu']
+            usage['maxrss'] = max(usage['maxrss'], run['maxrss'])
+    return summary
+
+def write_tool_summary(job, path, process_usage=None):
+    """tool_summary() of the job, next to the totals of the whole process."""
+    process = {}
+    for tool, (runs, failures, wall, cpu, maxrss) in (process_usage or {}).items():
+        process[tool] = {'runs': runs, 'failures': failures, 'wall': wall, 'cpu': cpu, 'maxrss': maxrss}
+    with open(path, 'w') as fp:
+        json.dump({'job': tool_summary(job), 'process': process}, fp, indent=1)
+    return path
+
+def write_chrome_trace(job, path):
+    """Complete events for chrome://tracing or Perfetto, one track per worker thread."""
+    pid = os.getpid()
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': job.name}}]
+    for span in job_spans(job):
+        args = span.fmt()
+        events.append({
+            'name': '{} {}'.format(span.guess or span.extractor, Path(span.path).name),
+            'cat': span.guess or 'nested',
+            'ph': 'X',
+            'ts': int(span.start * 1e6),
+            'dur': int(span.wall * 1e6),
+            'pid': pid,
+            'tid': span.thread,
+            'args': args,
+        })
+    with open(path, 'w') as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+    return path
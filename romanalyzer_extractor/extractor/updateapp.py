@@ -0,0 +1,56 @@
+from extractor.base import Extractor
+from extractor.superimg import SuperImgExtractor
+from formats.updateapp import UpdateApp, UpdateAppError
+from formats.sparse import SparseError
+from formats.lp import SuperImage, LpError, is_super
+from settings import UPDATEAPP_PARTITIONS
+
+class UpdateAppExtractor(Extractor):
+    """Split a Huawei UPDATE.APP, only writing out the partitions that are analyzed."""
+
+    def wants(self, entry):
+        if self.manifest: return self.manifest.wants_partition(entry.name)
+        return UPDATEAPP_PARTITIONS is None or entry.name.lower() in UPDATEAPP_PARTITIONS
+
+    def split_super(self, update, entry):
+        """Split the logical partitions out of a super partition through a
+        view of it, a sparse one is never expanded. Return False when the
+        partition is no super image."""
+        view = update.sparse(entry).view() if update.is_sparse(entry) else update.view(entry)
+        try:
+            if not is_super(view): return False
+            with SuperImage(view) as image:
+                extractor = SuperImgExtractor(self.extracted / entry.filename, self.manifest)
+                output = self.nested(extractor, extractor.extract_from, image)
+        finally:
+            view.close()
+        self.log.debug("\t{} ({} bytes) -> {}".format(entry.name, entry.size, output))
+        return True
+
+    def extract(self):
+        self.log.debug("UPDATE.APP extract target: {}".format(self.target))
+
+        try:
+            update = UpdateApp(self.target)
+        except (UpdateAppError, OSError) as e:
+            self.log.warn("\tfailed to index {}: {}".format(self.target, e))
+            return None
+
+        self.extracted.mkdir(exist_ok=True)
+        for entry in update.entries:
+            if not self.wants(entry):
+                self.log.debug("\tskip {} ({} bytes)".format(entry.name, entry.size))
+                continue
+            try:
+                if self.split_super(update, entry): continue
+                output = update.extract(entry, self.extracted / entry.filename)
+            except (UpdateAppError, SparseError, LpError, OSError) as e:
+                self.log.warn("\tfailed to extract {} of {}: {}".format(entry.name, self.target, e))
+                continue
+            self.log.debug("\t{} ({} bytes) -> {}".format(entry.name, entry.size, output))
+
+        if not any(self.extracted.iterdir()):
+            self.log.warn("\tno partition of {} extracted".format(self.target))
+            return None
+        self.log.debug("\textracted path: {}".format(self.extracted))
+        return self.extracted
@@ -0,0 +1,170 @@
+import os
+import stat
+import gzip
+import shutil
+import logging
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from formats.sdat import COPY_BUFSIZE
+from formats.sparse import SPARSE_HEADER, is_sparse, unsparse_stream
+
+ENTRY_FILE = 'file'
+ENTRY_DIR = 'dir'
+ENTRY_SYMLINK = 'symlink'
+ENTRY_HARDLINK = 'hardlink'
+
+log = logging.getLogger('extractor')
+
+class ArchiveEntry(object):
+    """One member of an archive.
+
+    open() returns a readable stream of a file member. Members of a tar
+    are read front to back, so it is only valid until the next entry.
+    """
+
+    def __init__(self, name, kind, size=0, linkname=None, mode=None, opener=None):
+        self.name = name
+        self.kind = kind
+        self.size = size
+        self.linkname = linkname
+        self.mode = mode
+        self.opener = opener
+
+    def open(self):
+        return self.opener()
+
+class ZipArchive(object):
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def entries(self):
+        with zipfile.ZipFile(self.path) as zf:
+            for info in zf.infolist():
+                mode = info.external_attr >> 16
+                if info.is_dir():
+                    yield ArchiveEntry(info.filename, ENTRY_DIR)
+                elif stat.S_ISLNK(mode):
+                    yield ArchiveEntry(info.filename, ENTRY_SYMLINK, linkname=zf.read(info).decode())
+                else:
+                    yield ArchiveEntry(info.filename, ENTRY_FILE, info.file_size, mode=stat.S_IMODE(mode) or None,
+                                       opener=lambda info=info: zf.open(info))
+
+class TarArchive(object):
+    """Any tar tarfile reads, compressed or not (.tar, .tar.md5, .tgz),
+    streamed in a single pass."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def entries(self):
+        with tarfile.open(self.path, 'r|*') as tar:
+            for member in tar:
+                if member.isdir():
+                    yield ArchiveEntry(member.name, ENTRY_DIR)
+                elif member.issym():
+                    yield ArchiveEntry(member.name, ENTRY_SYMLINK, linkname=member.linkname)
+                elif member.islnk():
+                    yield ArchiveEntry(member.name, ENTRY_HARDLINK, linkname=member.linkname)
+                elif member.isfile():
+                    yield ArchiveEntry(member.name, ENTRY_FILE, member.size, mode=member.mode,
+                                       opener=lambda member=member: tar.extractfile(member))
+
+class GzipArchive(object):
+    """A single gzip compressed file, its only entry is the name without .gz."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def entries(self):
+        yield ArchiveEntry(self.path.with_suffix('').name, ENTRY_FILE, -1,
+                           opener=lambda: gzip.open(self.path))
+
+def open_archive(path):
+    """Return the reader of a zip, tar or gzip file, None for other formats."""
+    path = Path(path)
+    with path.open('rb') as f:
+        magic = f.read(2)
+    if zipfile.is_zipfile(path): return ZipArchive(path)
+    try:
+        if tarfile.is_tarfile(path): return TarArchive(path)
+    except (OSError, EOFError, tarfile.TarError):
+        pass
+    if magic == b'\x1f\x8b': return GzipArchive(path)
+    return None
+
+def entry_path(root, name):
+    """Where a member named name goes below root, None for names that would
+    end up outside of it."""
+    parts = [part for part in PurePosixPath(name).parts if part not in ('/', '.')]
+    if not parts or '..' in parts: return None
+    return Path(root).joinpath(*parts)
+
+def inside(root, path):
+    """Whether path stays below root once the symlinks already on disk,
+    e.g. written by earlier members, are followed."""
+    root = os.path.realpath(root)
+    real = os.path.realpath(path)
+    return real == root or real.startswith(root + os.sep)
+
+def write_stream(fp, path):
+    """Write the content of fp to path and return the path written.
+
+    lz4 frames are decompressed and sparse images expanded on the way, so
+    the next extractor gets the image instead of a copy of its container.
+    Sparse images are written as <name>.ext4 like SparseImgExtractor does,
+    sparsechunk files only make sense as a set and are written as they are.
+    """
+    path = Path(path)
+    if path.suffix == '.lz4' and lz4 is not None:
+        with lz4.frame.LZ4FrameFile(fp) as frame:
+            return write_stream(frame, path.with_suffix(''))
+
+    head = fp.read(SPARSE_HEADER.size)
+    if is_sparse(head) and '_sparsechunk.' not in path.name:
+        output = path if path.suffix == '.ext4' else path.with_name(path.name + '.ext4')
+        return Path(unsparse_stream(fp, output, head))
+
+    with path.open('wb') as out:
+        out.write(head)
+        shutil.copyfileobj(fp, out, COPY_BUFSIZE)
+    return path
+
+def extract_entry(entry, root):
+    """Write an entry below root, return its path or None when skipped."""
+    path = entry_path(root, entry.name)
+    if path is None: return None
+
+    # a symlink member must not redirect the members after it out of root
+    if not inside(root, path if entry.kind == ENTRY_DIR else path.parent):
+        log.warn("\tskip {}: leads out of {} through a symlink".format(entry.name, root))
+        return None
+
+    if entry.kind == ENTRY_DIR:
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.is_symlink() or path.exists(): path.unlink()
+
+    if entry.kind == ENTRY_SYMLINK:
+        os.symlink(entry.linkname, path)
+    elif entry.kind == ENTRY_HARDLINK:
+        source = entry_path(root, entry.linkname)
+        if source is None or not source.exists(): return None
+        if not inside(root, source):
+            log.warn("\tskip {}: its link source leads out of {}".format(entry.name, root))
+            return None
+        os.link(source, path)
+    else:
+        with entry.open() as fp:
+            path = write_stream(fp, path)
+        if entry.mode: os.chmod(path, entry.mode | stat.S_IRUSR | stat.S_IWUSR)
+    return path
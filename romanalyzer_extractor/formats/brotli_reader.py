@@ -0,0 +1,38 @@
+import io
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+READ_SIZE = 1024 * 1024
+
+class BrotliReader(io.RawIOBase):
+    """Readable stream of the decompressed content of a brotli file."""
+
+    def __init__(self, path):
+        if brotli is None:
+            raise RuntimeError("brotli module is not installed")
+        self._file = open(path, 'rb')
+        self._decompressor = brotli.Decompressor()
+        self._buffer = memoryview(b'')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos == len(self._buffer):
+            data = self._file.read(READ_SIZE)
+            if not data: return 0
+            self._buffer = memoryview(self._decompressor.process(data))
+            self._pos = 0
+
+        count = min(len(b), len(self._buffer) - self._pos)
+        b[:count] = self._buffer[self._pos:self._pos+count]
+        self._pos += count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
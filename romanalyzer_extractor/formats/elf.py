@@ -0,0 +1,341 @@
+import mmap
+import struct
+from collections import namedtuple
+
+from formats.ext4 import open_source
+
+ELF_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+ET_CORE = 4
+
+EM_ARM = 40
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_NOBITS = 8
+SHT_DYNAMIC = 6
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+STB_GLOBAL = 1
+STB_WEAK = 2
+STT_FUNC = 2
+STT_SECTION = 3
+STT_FILE = 4
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_FLAGS_1 = 0x6ffffffb
+DF_1_PIE = 0x08000000
+NT_GNU_ABI_TAG = 1
+NT_GNU_BUILD_ID = 3
+
+# e_machine: (rabin2 arch, rabin2 machine, file(1) name)
+MACHINES = {
+    3: ('x86', 'Intel 80386', 'Intel 80386'),
+    8: ('mips', 'MIPS R3000', 'MIPS'),
+    20: ('ppc', 'PowerPC', 'PowerPC or cisco 4500'),
+    21: ('ppc', 'PowerPC 64', '64-bit PowerPC or cisco 7500'),
+    40: ('arm', 'ARM', 'ARM'),
+    62: ('x86', 'AMD x86-64 architecture', 'x86-64'),
+    183: ('arm', 'ARM aarch64', 'ARM aarch64'),
+    243: ('riscv', 'RISC-V', 'UCB RISC-V'),
+}
+OSABIS = {0: 'SYSV', 3: 'GNU/Linux'}
+TYPES = {ET_REL: 'relocatable', ET_EXEC: 'executable', ET_DYN: 'shared object', ET_CORE: 'core file'}
+
+# (header, section header, program header, symbol, dynamic entry) per class
+LAYOUTS = {
+    ELFCLASS32: ('HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIIIIII', 'IIIBBH', 'iI'),
+    ELFCLASS64: ('HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IIQQQQQQ', 'IBBHQQ', 'qQ'),
+}
+
+ElfSection = namedtuple('ElfSection', ['name', 'type', 'flags', 'addr', 'offset', 'size', 'link', 'info', 'entsize'])
+ElfSegment = namedtuple('ElfSegment', ['type', 'offset', 'vaddr', 'filesz', 'memsz'])
+ElfSymbol = namedtuple('ElfSymbol', ['name', 'value', 'size', 'type', 'bind', 'shndx', 'section'])
+
+class ElfError(Exception):
+    pass
+
+def is_elf(header):
+    return header[:4] == ELF_MAGIC
+
+def cstr(data, offset):
+    end = data.find(b'\0', offset)
+    return data[offset:end if end >= 0 else len(data)].decode('utf-8', 'replace')
+
+class ElfFile(object):
+    """Read-only ELF reader over an mmap, the section and symbol tables are
+    only decoded when asked for.
+
+    Symbol values of ARM Thumb functions have the Thumb bit cleared, like
+    objdump shows them.
+    """
+
+    def __init__(self, source):
+        self.source = open_source(source)
+        ident = self.source[:16]
+        if len(ident) < 16 or not is_elf(ident):
+            raise ElfError("not an ELF file")
+        self.elfclass, self.data, self.version, self.osabi = ident[4], ident[5], ident[6], ident[7]
+        if self.elfclass not in LAYOUTS or self.data not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ElfError("unknown ELF class {} or data encoding {}".format(self.elfclass, self.data))
+
+        order = '<' if self.data == ELFDATA2LSB else '>'
+        header, section, segment, symbol, dynamic = LAYOUTS[self.elfclass]
+        self.header_struct = struct.Struct(order + header)
+        self.section_struct = struct.Struct(order + section)
+        self.segment_struct = struct.Struct(order + segment)
+        self.symbol_struct = struct.Struct(order + symbol)
+        self.dynamic_struct = struct.Struct(order + dynamic)
+        self.order = order
+
+        raw = self.source[16:16+self.header_struct.size]
+        if len(raw) < self.header_struct.size:
+            raise ElfError("truncated ELF header")
+        (self.type, self.machine_id, _, self.entry, self.phoff, self.shoff, self.flags, _,
+            self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = self.header_struct.unpack(raw)
+
+        self._sections = None
+        self._segments = None
+        self._symbols = {}
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def bits(self):
+        return 64 if self.elfclass == ELFCLASS64 else 32
+
+    @property
+    def endian(self):
+        return 'little' if self.data == ELFDATA2LSB else 'big'
+
+    @property
+    def arch(self):
+        return MACHINES.get(self.machine_id, ('', '', ''))[0]
+
+    @property
+    def machine(self):
+        return MACHINES.get(self.machine_id, ('', 'unknown', ''))[1]
+
+    @property
+    def sections(self):
+        if self._sections is None:
+            self._sections = []
+            if self.shoff and self.shnum:
+                size = self.shnum * self.shentsize
+                table = self.source[self.shoff:self.shoff+size]
+                if len(table) < size or self.shentsize < self.section_struct.size:
+                    raise ElfError("truncated section header table")
+                headers = [self.section_struct.unpack_from(table, i * self.shentsize) for i in range(self.shnum)]
+                names = b''
+                if self.shstrndx < len(headers):
+                    _, _, _, _, offset, size, _, _, _, _ = headers[self.shstrndx]
+                    names = self.source[offset:offset+size]
+                for (name, sh_type, flags, addr, offset, size, link, info, _, entsize) in headers:
+                    self._sections.append(ElfSection(cstr(names, name), sh_type, flags, addr, offset, size, link, info, entsize))
+        return self._sections
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            self._segments = []
+            size = self.phnum * self.phentsize
+            table = self.source[self.phoff:self.phoff+size] if self.phoff else b''
+            for i in range(len(table) // self.phentsize if self.phentsize >= self.segment_struct.size else 0):
+                fields = self.segment_struct.unpack_from(table, i * self.phentsize)
+                if self.elfclass == ELFCLASS64:
+                    p_type, _, offset, vaddr, _, filesz, memsz, _ = fields
+                else:
+                    p_type, offset, vaddr, _, filesz, memsz, _, _ = fields
+                self._segments.append(ElfSegment(p_type, offset, vaddr, filesz, memsz))
+        return self._segments
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name: return section
+        return None
+
+    def section_data(self, section):
+        if section.type == SHT_NOBITS: return b''
+        return self.source[section.offset:section.offset+section.size]
+
+    def code_sections(self):
+        """Executable sections, like the CODE ones of objdump -h."""
+        return [section for section in self.sections if section.flags & SHF_EXECINSTR and section.type != SHT_NOBITS]
+
+    def offset_of(self, vaddr):
+        """File offset of a virtual address through the PT_LOAD segments."""
+        for segment in self.segments:
+            if segment.type == PT_LOAD and segment.vaddr <= vaddr < segment.vaddr + segment.filesz:
+                return segment.offset + vaddr - segment.vaddr
+        return None
+
+    def symbols(self, dynamic=False):
+        """Symbols of .symtab, or of .dynsym with dynamic."""
+        kind = SHT_DYNSYM if dynamic else SHT_SYMTAB
+        if kind not in self._symbols:
+            self._symbols[kind] = []
+            for table in self.sections:
+                if table.type == kind: self._symbols[kind].extend(self.read_symbols(table))
+        return self._symbols[kind]
+
+    def read_symbols(self, table):
+        data = self.section_data(table)
+        strings = self.section_data(self.sections[table.link]) if table.link < len(self.sections) else b''
+        entsize = table.entsize or self.symbol_struct.size
+        symbols = []
+        for pos in range(entsize, len(data) - self.symbol_struct.size + 1, entsize):
+            fields = self.symbol_struct.unpack_from(data, pos)
+            if self.elfclass == ELFCLASS64:
+                name, info, _, shndx, value, size = fields
+            else:
+                name, value, size, info, _, shndx = fields
+            sym_type, bind = info & 0xf, info >> 4
+            if self.machine_id == EM_ARM and sym_type == STT_FUNC: value &= ~1
+
+            section = ''
+            if shndx != SHN_UNDEF and shndx < SHN_LORESERVE and shndx < len(self.sections):
+                section = self.sections[shndx].name
+            symbols.append(ElfSymbol(cstr(strings, name), value, size, sym_type, bind, shndx, section))
+        return symbols
+
+    def find_symbol(self, name):
+        """The first defined symbol of that name, .symtab before .dynsym."""
+        for symbol in self.symbols() + self.symbols(dynamic=True):
+            if symbol.name == name and symbol.shndx != SHN_UNDEF: return symbol
+        return None
+
+    def dynamic(self):
+        """(tag, value) of the dynamic section, or of PT_DYNAMIC without section headers."""
+        section = next((s for s in self.sections if s.type == SHT_DYNAMIC), None)
+        if section:
+            data = self.section_data(section)
+        else:
+            segment = next((s for s in self.segments if s.type == PT_DYNAMIC), None)
+            if not segment: return []
+            data = self.source[segment.offset:segment.offset+segment.filesz]
+
+        entries = []
+        for pos in range(0, len(data) - self.dynamic_struct.size + 1, self.dynamic_struct.size):
+            tag, value = self.dynamic_struct.unpack_from(data, pos)
+            if tag == DT_NULL: break
+            entries.append((tag, value))
+        return entries
+
+    def libraries(self):
+        """DT_NEEDED entries in order."""
+        entries = self.dynamic()
+        tags = dict(entries)
+        if DT_STRTAB not in tags: return []
+
+        section = self.section('.dynstr')
+        if section:
+            strings = self.section_data(section)
+        else:
+            offset = self.offset_of(tags[DT_STRTAB])
+            if offset is None: return []
+            strings = self.source[offset:offset+tags.get(DT_STRSZ, 0)]
+        return [cstr(strings, value) for tag, value in entries if tag == DT_NEEDED]
+
+    def imports(self):
+        return {symbol.name for symbol in self.symbols(dynamic=True) if symbol.shndx == SHN_UNDEF and symbol.name}
+
+    def exports(self):
+        return {symbol.name for symbol in self.symbols(dynamic=True)
+                if symbol.shndx != SHN_UNDEF and symbol.name and symbol.bind in (STB_GLOBAL, STB_WEAK)
+                and symbol.type not in (STT_SECTION, STT_FILE)}
+
+    def interpreter(self):
+        for segment in self.segments:
+            if segment.type == PT_INTERP:
+                return cstr(self.source[segment.offset:segment.offset+segment.filesz], 0)
+        return None
+
+    def notes(self):
+        """(name, type, desc) of the note sections."""
+        for section in self.sections:
+            if section.type != SHT_NOTE: continue
+            data = self.section_data(section)
+            pos = 0
+            while pos + 12 <= len(data):
+                namesz, descsz, note_type = struct.unpack_from(self.order + 'III', data, pos)
+                desc = pos + 12 + (namesz + 3) // 4 * 4
+                yield data[pos+12:pos+12+namesz].rstrip(b'\0'), note_type, data[desc:desc+descsz]
+                pos = desc + (descsz + 3) // 4 * 4
+
+    def build_id(self):
+        for name, note_type, desc in self.notes():
+            if name == b'GNU' and note_type == NT_GNU_BUILD_ID: return desc.hex()
+        return None
+
+    def abi_tag(self):
+        """'GNU/Linux 3.2.0' or 'Android 29' from the ABI notes."""
+        for name, note_type, desc in self.notes():
+            if name == b'GNU' and note_type == NT_GNU_ABI_TAG and len(desc) >= 16:
+                os_id, major, minor, patch = struct.unpack_from(self.order + 'IIII', desc)
+                if os_id == 0: return 'GNU/Linux {}.{}.{}'.format(major, minor, patch)
+            if name == b'Android' and note_type == NT_GNU_ABI_TAG and len(desc) >= 4:
+                return 'Android {}'.format(struct.unpack_from(self.order + 'I', desc)[0])
+        return None
+
+    def describe(self):
+        """A file(1) style summary, e.g. 'ELF 32-bit LSB shared object, ARM, EABI5
+        version 1 (SYSV), dynamically linked, stripped'."""
+        kind = TYPES.get(self.type, 'unknown type')
+        interpreter = self.interpreter()
+        dynamic = self.dynamic()
+        if self.type == ET_DYN and dict(dynamic).get(DT_FLAGS_1, 0) & DF_1_PIE: kind = 'pie executable'
+        parts = ['ELF {}-bit {} {}'.format(self.bits, 'LSB' if self.data == ELFDATA2LSB else 'MSB', kind)]
+        parts.append(MACHINES.get(self.machine_id, ('', '', 'unknown arch 0x{:x}'.format(self.machine_id)))[2])
+
+        eabi = 'EABI{} '.format(self.flags >> 24) if self.machine_id == EM_ARM and self.flags >> 24 else ''
+        parts.append('{}version {} ({})'.format(eabi, self.version, OSABIS.get(self.osabi, 'unknown')))
+        if self.type in (ET_EXEC, ET_DYN):
+            parts.append('dynamically linked' if dynamic else 'statically linked')
+        if interpreter: parts.append('interpreter {}'.format(interpreter))
+        build_id = self.build_id()
+        if build_id:
+            parts.append('BuildID[{}]={}'.format({20: 'sha1', 16: 'md5/uuid'}.get(len(build_id) // 2, 'xxHash'), build_id))
+        abi_tag = self.abi_tag()
+        if abi_tag: parts.append('for {}'.format(abi_tag))
+        if self.sections:
+            parts.append('not stripped' if any(s.type == SHT_SYMTAB for s in self.sections) else 'stripped')
+        return ', '.join(parts)
+
+    def info(self):
+        """arch, bits, endian, machine, imports, exports and libraries together."""
+        return {
+            'arch': self.arch,
+            'bits': self.bits,
+            'endian': self.endian,
+            'machine': self.machine,
+            'imports': self.imports(),
+            'exports': self.exports(),
+            'libraries': set(self.libraries()),
+            'filecmd': self.describe(),
+        }
@@ -0,0 +1,580 @@
+import io
+import os
+import mmap
+import stat
+import zlib
+import struct
+from bisect import bisect_right
+from pathlib import Path, PurePosixPath
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+from formats.ext4 import open_source
+
+# from fs/erofs/erofs_fs.h of the linux kernel
+EROFS_MAGIC = 0xE0F5E1E2
+EROFS_SUPER_OFFSET = 1024
+EROFS_NULL_ADDR = 0xFFFFFFFF
+EROFS_SLOT_SIZE = 32
+
+FEATURE_INCOMPAT_ZERO_PADDING = 0x1
+FEATURE_INCOMPAT_DEVICE_TABLE = 0x8
+FEATURE_INCOMPAT_FRAGMENTS = 0x20
+
+LAYOUT_FLAT_PLAIN = 0
+LAYOUT_COMPRESSED_FULL = 1
+LAYOUT_FLAT_INLINE = 2
+LAYOUT_COMPRESSED_COMPACT = 3
+LAYOUT_CHUNK_BASED = 4
+
+CHUNK_FORMAT_BLKBITS_MASK = 0x1F
+CHUNK_FORMAT_INDEXES = 0x20
+
+# logical cluster types of the compression indexes
+LCLUSTER_PLAIN = 0
+LCLUSTER_HEAD1 = 1
+LCLUSTER_NONHEAD = 2
+LCLUSTER_HEAD2 = 3
+LI_D0_CBLKCNT = 1 << 11
+
+ADVISE_COMPACTED_2B = 0x1
+ADVISE_BIG_PCLUSTER_1 = 0x2
+ADVISE_BIG_PCLUSTER_2 = 0x4
+ADVISE_INLINE_PCLUSTER = 0x8
+ADVISE_INTERLACED_PCLUSTER = 0x10
+ADVISE_FRAGMENT_PCLUSTER = 0x20
+FRAGMENT_INODE_BIT = 0x80
+
+ALGORITHMS = {0: 'lz4', 1: 'lzma', 2: 'deflate', 3: 'zstd'}
+
+# magic, checksum, feature_compat, blkszbits, sb_extslots, root_nid, inos, build_time,
+# build_time_nsec, blocks, meta_blkaddr, xattr_blkaddr, uuid, volume_name, feature_incompat
+SUPER_BLOCK = struct.Struct('<IIIBBHQQIIII16s16sI')
+PACKED_NID_OFFSET = 96
+# h_fragmentoff (or h_reserved1, h_idata_size), h_advise, h_algorithmtype, h_clusterbits
+MAP_HEADER = struct.Struct('<IHBB')
+DIRENT = struct.Struct('<QHBx')
+
+MAX_SYMLINKS = 40
+
+class ErofsError(Exception):
+    pass
+
+def lz4_decompress(src, size):
+    """Decode an lz4 block up to size bytes of output.
+
+    lz4 streams of erofs may decode past the end of the extent (deduplicated
+    extents only reference a prefix), and images without zero padding have
+    garbage after the stream, so the decoder has to stop on its own.
+    """
+    if lz4 is not None:
+        try:
+            out = lz4.block.decompress(src, uncompressed_size=size)
+            if len(out) == size: return out
+        except lz4.block.LZ4BlockError:
+            pass
+
+    dst = bytearray()
+    i, end = 0, len(src)
+    while i < end and len(dst) < size:
+        token = src[i]
+        i += 1
+        literals = token >> 4
+        if literals == 15:
+            while True:
+                extra = src[i]
+                i += 1
+                literals += extra
+                if extra != 255: break
+        dst += src[i:i+literals]
+        i += literals
+        if i + 2 > end or len(dst) >= size: break
+
+        offset = src[i] | src[i+1] << 8
+        i += 2
+        if not offset or offset > len(dst):
+            raise ErofsError("corrupted lz4 stream")
+        match = token & 15
+        if match == 15:
+            while True:
+                extra = src[i]
+                i += 1
+                match += extra
+                if extra != 255: break
+        match += 4
+
+        start = len(dst) - offset
+        if match <= offset:
+            dst += dst[start:start+match]
+        else:
+            pattern = bytes(dst[start:])
+            dst += (pattern * (match // offset + 1))[:match]
+    return bytes(dst[:size])
+
+class ErofsInode(object):
+
+    def __init__(self, fs, nid):
+        self.fs = fs
+        self.nid = nid
+        self.loc = fs.meta_base + nid * EROFS_SLOT_SIZE
+        raw = fs.source[self.loc:self.loc+64]
+        i_format, xattr_icount, self.mode = struct.unpack_from('<HHH', raw, 0)
+        self.layout = (i_format >> 1) & 0x7
+        if i_format & 1:
+            self.size, self.i_u = struct.unpack_from('<QI', raw, 8)
+            self.inode_isize = 64
+        else:
+            self.size, _, self.i_u = struct.unpack_from('<III', raw, 8)
+            self.inode_isize = 32
+        self.xattr_isize = 12 + 4 * (xattr_icount - 1) if xattr_icount else 0
+        self.data_pos = self.loc + self.inode_isize + self.xattr_isize
+        self._extents = None
+
+    @property
+    def is_dir(self): return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self): return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self): return stat.S_ISLNK(self.mode)
+
+    def extents(self):
+        """Return [(logical offset, length, physical offset, physical length, kind)],
+        kind is 'plain', 'hole', 'shifted', 'interlaced', 'fragment' or an
+        algorithm name for compressed extents."""
+        if self._extents is None:
+            if self.size == 0:
+                self._extents = []
+            elif self.layout in (LAYOUT_FLAT_PLAIN, LAYOUT_FLAT_INLINE):
+                self._extents = self.flat_extents()
+            elif self.layout == LAYOUT_CHUNK_BASED:
+                self._extents = self.chunk_extents()
+            elif self.layout in (LAYOUT_COMPRESSED_FULL, LAYOUT_COMPRESSED_COMPACT):
+                self._extents = ZMap(self).extents()
+            else:
+                raise ErofsError("unknown data layout {} of nid {}".format(self.layout, self.nid))
+        return self._extents
+
+    def flat_extents(self):
+        bs = self.fs.block_size
+        if self.layout == LAYOUT_FLAT_PLAIN:
+            return [(0, self.size, self.i_u * bs, self.size, 'plain')]
+
+        # the last block is stored right after the inode
+        blocks = (self.size + bs - 1) // bs * bs - bs
+        extents = [(0, blocks, self.i_u * bs, blocks, 'plain')] if blocks else []
+        return extents + [(blocks, self.size - blocks, self.data_pos, self.size - blocks, 'plain')]
+
+    def chunk_extents(self):
+        bs = self.fs.block_size
+        chunk_format = self.i_u & 0xFFFF
+        chunk_size = bs << (chunk_format & CHUNK_FORMAT_BLKBITS_MASK)
+        unit = 8 if chunk_format & CHUNK_FORMAT_INDEXES else 4
+        base = -(-self.data_pos // unit) * unit
+
+        count = -(-self.size // chunk_size)
+        table = self.fs.source[base:base+count*unit]
+        extents = []
+        for i in range(count):
+            if unit == 8:
+                _, device, blkaddr = struct.unpack_from('<HHI', table, i * 8)
+                if device and blkaddr != EROFS_NULL_ADDR:
+                    raise ErofsError("nid {} has data on extra device {}".format(self.nid, device))
+            else:
+                blkaddr, = struct.unpack_from('<I', table, i * 4)
+            length = min(chunk_size, self.size - i * chunk_size)
+            if blkaddr == EROFS_NULL_ADDR:
+                extents.append((i * chunk_size, length, 0, 0, 'hole'))
+            else:
+                extents.append((i * chunk_size, length, blkaddr * bs, length, 'plain'))
+        return extents
+
+    def read(self):
+        with ErofsFile(self) as f:
+            return f.read()
+
+    def readlink(self):
+        return self.read().decode('utf-8', 'surrogateescape')
+
+class ZMap(object):
+    """Decodes the compression indexes of an inode (fs/erofs/zmap.c)."""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.fs = fs = inode.fs
+        self.source = fs.source
+        header_pos = -(-inode.data_pos // 8) * 8
+        self.base = header_pos + MAP_HEADER.size
+        (self.fragmentoff, self.advise, algorithms,
+            clusterbits) = MAP_HEADER.unpack(self.source[header_pos:header_pos+MAP_HEADER.size])
+        self.idata_size = self.fragmentoff >> 16
+        self.algorithms = (ALGORITHMS.get(algorithms & 0xF), ALGORITHMS.get(algorithms >> 4))
+        self.whole_fragment = bool(clusterbits & FRAGMENT_INODE_BIT)
+        self.lclusterbits = fs.blkszbits + (clusterbits & 0x7)
+        self.compact = inode.layout == LAYOUT_COMPRESSED_COMPACT
+        self.blocks = -(-inode.size // fs.block_size)
+        self.lclusters = -(-inode.size // (1 << self.lclusterbits))
+
+    def extents(self):
+        size = self.inode.size
+        if self.whole_fragment:
+            return [(0, size, self.fragmentoff, size, 'fragment')]
+
+        lclusters = [self.load(lcn) for lcn in range(self.lclusters)]
+        heads = []
+        for lcn, (kind, clusterofs, pblk, _, _, _) in enumerate(lclusters):
+            la = (lcn << self.lclusterbits) + clusterofs
+            if kind != LCLUSTER_NONHEAD and la < size:
+                heads.append((la, lcn, kind, pblk))
+        if not heads or heads[0][0] != 0:
+            raise ErofsError("nid {} does not start with a head lcluster".format(self.inode.nid))
+
+        tail_lcn = heads[-1][1]
+        extents = []
+        for i, (la, lcn, kind, pblk) in enumerate(heads):
+            end = heads[i+1][0] if i + 1 < len(heads) else size
+            if lcn == tail_lcn and self.advise & ADVISE_INLINE_PCLUSTER:
+                # the tail pcluster follows the indexes of the last lcluster
+                pa, plen = lclusters[-1][5], self.idata_size
+            elif lcn == tail_lcn and self.advise & ADVISE_FRAGMENT_PCLUSTER:
+                fragmentoff = self.fragmentoff if self.compact else self.fragmentoff | pblk << 32
+                extents.append((la, end - la, fragmentoff, end - la, 'fragment'))
+                continue
+            else:
+                pa, plen = pblk * self.fs.block_size, self.compressed_length(lcn, kind, lclusters)
+
+            if kind == LCLUSTER_PLAIN:
+                fmt = 'interlaced' if self.advise & ADVISE_INTERLACED_PCLUSTER else 'shifted'
+            else:
+                fmt = self.algorithms[0 if kind == LCLUSTER_HEAD1 else 1]
+            extents.append((la, end - la, pa, plen, fmt))
+        return extents
+
+    def compressed_length(self, lcn, kind, lclusters):
+        lcluster_size = 1 << self.lclusterbits
+        big = ADVISE_BIG_PCLUSTER_1 if kind == LCLUSTER_HEAD1 else ADVISE_BIG_PCLUSTER_2
+        if kind == LCLUSTER_PLAIN or not self.advise & big or lcn + 1 >= len(lclusters):
+            return lcluster_size
+
+        kind, _, _, delta0, cblks, _ = lclusters[lcn+1]
+        if kind != LCLUSTER_NONHEAD:
+            return lcluster_size
+        if delta0 != 1 or not cblks:
+            raise ErofsError("nid {}: bad compressed block count of lcluster {}".format(self.inode.nid, lcn))
+        return cblks * self.fs.block_size
+
+    def load(self, lcn):
+        """Return (type, clusterofs, pblk, delta0, compressed blocks, next index offset)."""
+        if self.compact:
+            return self.load_compact(lcn)
+
+        pos = self.base + lcn * 8
+        advise, clusterofs, blkaddr = struct.unpack('<HHI', self.source[pos:pos+8])
+        kind = advise & 0x3
+        if kind != LCLUSTER_NONHEAD:
+            return kind, clusterofs, blkaddr, 0, 0, pos + 8
+
+        delta0 = blkaddr & 0xFFFF
+        if delta0 & LI_D0_CBLKCNT:
+            return kind, 1 << self.lclusterbits, 0, 1, delta0 & ~LI_D0_CBLKCNT, pos + 8
+        return kind, 1 << self.lclusterbits, 0, delta0, 0, pos + 8
+
+    def load_compact(self, lcn):
+        total = self.blocks
+        initial_4b = ((32 - self.base % 32) // 4) & 7
+        compacted_2b = 0
+        if self.advise & ADVISE_COMPACTED_2B and initial_4b < total:
+            compacted_2b = (total - initial_4b) // 16 * 16
+
+        pos, shift = self.base, 2
+        if lcn >= initial_4b:
+            pos += initial_4b * 4
+            lcn -= initial_4b
+            if lcn < compacted_2b:
+                shift = 1
+            else:
+                pos += compacted_2b * 2
+                lcn -= compacted_2b
+        pos += lcn << shift
+        return self.unpack_compact(shift, pos)
+
+    def unpack_compact(self, shift, pos):
+        if shift == 2 and self.lclusterbits <= 14:
+            vcnt = 2
+        elif shift == 1 and self.lclusterbits == 12:
+            vcnt = 16
+        else:
+            raise ErofsError("unsupported compacted index of nid {}".format(self.inode.nid))
+
+        pack_size = vcnt << shift
+        base = pos - pos % pack_size
+        pack = self.source[base:base+pack_size] + b'\0\0\0'
+        next_pack = base + pack_size
+        big = self.advise & ADVISE_BIG_PCLUSTER_1
+        lobits = max(self.lclusterbits, 12)
+        encodebits = (pack_size - 4) * 8 // vcnt
+        i = (pos - base) >> shift
+
+        def decode(index):
+            bit = encodebits * index
+            v = int.from_bytes(pack[bit//8:bit//8+4], 'little') >> (bit & 7)
+            return v & ((1 << lobits) - 1), (v >> lobits) & 3
+
+        lo, kind = decode(i)
+        if kind == LCLUSTER_NONHEAD:
+            clusterofs = 1 << self.lclusterbits
+            if lo & LI_D0_CBLKCNT:
+                return kind, clusterofs, 0, 1, lo & ~LI_D0_CBLKCNT, next_pack
+            if i + 1 != vcnt:
+                return kind, clusterofs, 0, lo, 0, next_pack
+            # the last lcluster of a pack keeps delta[1], delta[0] follows from the one before
+            lo, prev = decode(i - 1)
+            if prev != LCLUSTER_NONHEAD: lo = 0
+            elif lo & LI_D0_CBLKCNT: lo = 1
+            return kind, clusterofs, 0, lo + 1, 0, next_pack
+
+        clusterofs = lo
+        if not big:
+            nblk = 1
+            while i > 0:
+                i -= 1
+                lo, prev = decode(i)
+                if prev == LCLUSTER_NONHEAD: i -= lo
+                if i >= 0: nblk += 1
+        else:
+            nblk = 0
+            while i > 0:
+                i -= 1
+                lo, prev = decode(i)
+                if prev == LCLUSTER_NONHEAD:
+                    if lo & LI_D0_CBLKCNT:
+                        i -= 1
+                        nblk += lo & ~LI_D0_CBLKCNT
+                        continue
+                    if lo <= 1:
+                        raise ErofsError("corrupted compacted index of nid {}".format(self.inode.nid))
+                    i -= lo - 2
+                    continue
+                nblk += 1
+        pblk, = struct.unpack_from('<I', pack, pack_size - 4)
+        return kind, clusterofs, pblk + nblk, 0, 0, next_pack
+
+class ErofsFile(io.RawIOBase):
+    """Seekable read-only stream of a file inside the image, compressed
+    extents are decoded one at a time."""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.fs = inode.fs
+        self.size = inode.size
+        self.pos = 0
+        self.extents = inode.extents()
+        self.starts = [extent[0] for extent in self.extents]
+        self._cached = (None, b'')
+
+    def readable(self): return True
+
+    def seekable(self): return True
+
+    def tell(self): return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR: offset += self.pos
+        elif whence == io.SEEK_END: offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def readinto(self, b):
+        data = self.read_range(self.pos, min(len(b), max(0, self.size - self.pos)))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def readall(self):
+        data = self.read_range(self.pos, max(0, self.size - self.pos))
+        self.pos += len(data)
+        return data
+
+    def decoded(self, index):
+        if self._cached[0] != index:
+            self._cached = (index, self.fs.decode(self.extents[index]))
+        return self._cached[1]
+
+    def read_range(self, offset, length):
+        end = min(offset + length, self.size)
+        if offset >= end: return b''
+        out = bytearray(end - offset)
+        i = max(0, bisect_right(self.starts, offset) - 1)
+        while i < len(self.extents) and self.extents[i][0] < end:
+            la, llen, pa, _, kind = self.extents[i]
+            lo, hi = max(offset, la), min(end, la + llen)
+            if lo < hi:
+                if kind == 'plain':
+                    out[lo-offset:hi-offset] = self.fs.source[pa+lo-la:pa+hi-la]
+                elif kind != 'hole':
+                    out[lo-offset:hi-offset] = self.decoded(i)[lo-la:hi-la]
+            i += 1
+        return bytes(out)
+
+class ErofsImage(object):
+    """Read-only EROFS filesystem reader with the interface of Ext4Image.
+
+    Uncompressed, chunk based and lz4 (or deflate) compressed files are
+    supported; lzma and zstd pclusters raise ErofsError.
+    """
+
+    def __init__(self, source):
+        self.source = open_source(source)
+
+        sb = self.source[EROFS_SUPER_OFFSET:EROFS_SUPER_OFFSET+128]
+        if len(sb) < 128 or struct.unpack_from('<I', sb, 0)[0] != EROFS_MAGIC:
+            raise ErofsError("not an erofs image")
+
+        (_, _, _, self.blkszbits, _, self.root_nid, _, _, _, _,
+            meta_blkaddr, _, _, _, self.feature_incompat) = SUPER_BLOCK.unpack_from(sb)
+        self.block_size = 1 << self.blkszbits
+        self.meta_base = meta_blkaddr * self.block_size
+        self.zero_padding = bool(self.feature_incompat & FEATURE_INCOMPAT_ZERO_PADDING)
+        self.packed_nid, = struct.unpack_from('<Q', sb, PACKED_NID_OFFSET)
+        self._dirs = {}
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def inode(self, nid):
+        return ErofsInode(self, nid)
+
+    def decode(self, extent):
+        """Decompressed bytes of a compressed, shifted or fragment extent."""
+        la, llen, pa, plen, kind = extent
+        if kind == 'fragment':
+            if not self.feature_incompat & FEATURE_INCOMPAT_FRAGMENTS:
+                raise ErofsError("fragment extent without a packed inode")
+            with ErofsFile(self.inode(self.packed_nid)) as packed:
+                return packed.read_range(pa, llen)
+
+        raw = self.source[pa:pa+plen]
+        if kind == 'shifted':
+            return raw[:llen]
+        if kind == 'interlaced':
+            skew = la % self.block_size
+            return (raw[skew:] + raw[:skew])[:llen]
+
+        if self.zero_padding:
+            # the compressed data is aligned to the end of the pcluster
+            raw = raw.lstrip(b'\0')
+        if kind == 'lz4':
+            return lz4_decompress(raw, llen)
+        if kind == 'deflate':
+            return zlib.decompressobj(-15).decompress(raw, llen)
+        raise ErofsError("unsupported compression {}".format(kind))
+
+    def entries(self, inode):
+        """Yield (name, nid, file type) of a directory inode."""
+        data = inode.read()
+        bs = self.block_size
+        for start in range(0, len(data), bs):
+            block = data[start:start+bs]
+            if len(block) < DIRENT.size: break
+            count = struct.unpack_from('<H', block, 8)[0] // DIRENT.size
+            dirents = [DIRENT.unpack_from(block, i * DIRENT.size) for i in range(count)]
+            for i, (nid, nameoff, file_type) in enumerate(dirents):
+                if i + 1 < count:
+                    name = block[nameoff:dirents[i+1][1]]
+                else:
+                    name = block[nameoff:].split(b'\0', 1)[0]
+                name = name.decode('utf-8', 'surrogateescape')
+                if name not in ('.', '..'):
+                    yield name, nid, file_type
+
+    def directory(self, inode):
+        """Return the {name: nid} map of a directory, cached."""
+        if inode.nid not in self._dirs:
+            self._dirs[inode.nid] = {name: nid for name, nid, _ in self.entries(inode)}
+        return self._dirs[inode.nid]
+
+    def lookup(self, path, follow=True, depth=0):
+        """Resolve an absolute path inside the image to its inode."""
+        if depth > MAX_SYMLINKS:
+            raise ErofsError("too many levels of symbolic links: {}".format(path))
+
+        parts = PurePosixPath('/' + str(path).lstrip('/')).parts[1:]
+        inode, current = self.inode(self.root_nid), PurePosixPath('/')
+        for i, part in enumerate(parts):
+            if not inode.is_dir: return None
+            nid = self.directory(inode).get(part)
+            if nid is None: return None
+
+            inode = self.inode(nid)
+            if inode.is_symlink and (follow or i < len(parts) - 1):
+                target = PurePosixPath(inode.readlink())
+                rest = PurePosixPath(*parts[i+1:]) if i + 1 < len(parts) else PurePosixPath()
+                resolved = (target if target.is_absolute() else current / target) / rest
+                return self.lookup(os.path.normpath(str(resolved)), follow, depth + 1)
+            current = current / part
+        return inode
+
+    def stat(self, path, follow=True):
+        inode = self.lookup(path, follow)
+        if inode is None:
+            raise FileNotFoundError(path)
+        return inode
+
+    def exists(self, path):
+        try:
+            return self.lookup(path) is not None
+        except ErofsError:
+            return False
+
+    def is_dir(self, path):
+        inode = self.lookup(path)
+        return bool(inode and inode.is_dir)
+
+    def is_file(self, path):
+        inode = self.lookup(path)
+        return bool(inode and inode.is_file)
+
+    def listdir(self, path='/'):
+        return list(self.directory(self.stat(path)))
+
+    def open(self, path):
+        inode = self.stat(path)
+        if not inode.is_file:
+            raise IsADirectoryError(path) if inode.is_dir else ErofsError("not a regular file: {}".format(path))
+        return io.BufferedReader(ErofsFile(inode))
+
+    def read(self, path):
+        with self.open(path) as f:
+            return f.read()
+
+    def walk(self, top='/'):
+        """Like os.walk, symlinks are reported as files and never followed."""
+        top = '/' + str(top).strip('/')
+        dirs, files = [], []
+        for name, nid in self.directory(self.stat(top)).items():
+            (dirs if self.inode(nid).is_dir else files).append(name)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(str(PurePosixPath(top) / name))
+
+    def extract(self, path, output):
+        """Write a regular file of the image to output."""
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with self.open(path) as src, output.open('wb') as dst:
+            while True:
+                data = src.read(1024 * 1024)
+                if not data: break
+                dst.write(data)
+        return output
@@ -0,0 +1,345 @@
+import io
+import os
+import mmap
+import stat
+import struct
+from pathlib import Path, PurePosixPath
+
+EXT4_MAGIC = 0xEF53
+EXT4_EXTENT_MAGIC = 0xF30A
+ROOT_INODE = 2
+
+INCOMPAT_64BIT = 0x80
+
+EXT4_INDEX_FL = 0x1000
+EXT4_EXTENTS_FL = 0x80000
+EXT4_INLINE_DATA_FL = 0x10000000
+
+XATTR_MAGIC = 0xEA020000
+XATTR_SYSTEM_INDEX = 7
+
+MAX_SYMLINKS = 40
+
+class Ext4Error(Exception):
+    pass
+
+def open_source(source):
+    """Map an image path read-only, other sources are used as they are.
+
+    A source is anything that supports len() and slicing into bytes, such
+    as mmap, bytes or the sparse and super partition views.
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        return source
+    with open(source, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class Ext4Inode(object):
+
+    def __init__(self, fs, ino, raw):
+        self.fs = fs
+        self.ino = ino
+        self.raw = raw
+        self.mode, = struct.unpack_from('<H', raw, 0x0)
+        size_lo, = struct.unpack_from('<I', raw, 0x4)
+        size_hi, = struct.unpack_from('<I', raw, 0x6c)
+        self.size = size_lo | size_hi << 32
+        self.flags, = struct.unpack_from('<I', raw, 0x20)
+        self.block = raw[0x28:0x28+60]
+
+    @property
+    def is_dir(self): return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self): return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self): return stat.S_ISLNK(self.mode)
+
+    def runs(self):
+        """Return [(logical block, physical block, count, initialized)]."""
+        if self.flags & EXT4_EXTENTS_FL:
+            return sorted(self.fs.extent_runs(self.block))
+        return self.fs.blockmap_runs(self.block, self.size)
+
+    def inline_data(self):
+        data = self.block
+        if self.size > len(data):
+            data += self.fs.inode_xattr(self.raw, XATTR_SYSTEM_INDEX, b'data') or b''
+        return data[:self.size]
+
+    def read(self):
+        if self.flags & EXT4_INLINE_DATA_FL:
+            return self.inline_data()
+        if self.is_symlink and self.size < 60 and not self.flags & EXT4_EXTENTS_FL:
+            return self.block[:self.size]
+        with Ext4File(self) as f:
+            return f.read()
+
+    def readlink(self):
+        return self.read().decode('utf-8', 'surrogateescape')
+
+class Ext4File(io.RawIOBase):
+    """Seekable read-only stream of a regular file inside the image."""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.fs = inode.fs
+        self.size = inode.size
+        self.pos = 0
+        self.inline = inode.read() if inode.flags & EXT4_INLINE_DATA_FL else None
+        self.runs = [] if self.inline is not None else inode.runs()
+
+    def readable(self): return True
+
+    def seekable(self): return True
+
+    def tell(self): return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR: offset += self.pos
+        elif whence == io.SEEK_END: offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def readinto(self, b):
+        data = self.read_range(self.pos, min(len(b), max(0, self.size - self.pos)))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def readall(self):
+        data = self.read_range(self.pos, max(0, self.size - self.pos))
+        self.pos += len(data)
+        return data
+
+    def read_range(self, offset, length):
+        if self.inline is not None:
+            return self.inline[offset:offset+length]
+
+        bs = self.fs.block_size
+        out = bytearray(length)
+        end = offset + length
+        for logical, physical, count, initialized in self.runs:
+            run_start, run_end = logical * bs, (logical + count) * bs
+            if run_end <= offset or run_start >= end or not initialized: continue
+            start, stop = max(offset, run_start), min(end, run_end)
+            src = physical * bs + (start - run_start)
+            out[start-offset:stop-offset] = self.fs.source[src:src+(stop-start)]
+        return bytes(out)
+
+class Ext4Image(object):
+    """Read-only ext2/3/4 filesystem reader.
+
+    Files are resolved through extent trees (or legacy block maps) and
+    directory blocks. htree directories keep their entries in ordinary
+    directory blocks, so they are scanned the same way.
+    """
+
+    def __init__(self, source):
+        self.source = open_source(source)
+
+        sb = self.source[1024:2048]
+        if len(sb) < 1024 or struct.unpack_from('<H', sb, 56)[0] != EXT4_MAGIC:
+            raise Ext4Error("not an ext2/3/4 image")
+
+        (self.inodes_count, _, _, _, _, self.first_data_block, log_block_size,
+            _, self.blocks_per_group, _, self.inodes_per_group) = struct.unpack_from('<11I', sb, 0)
+        self.block_size = 1024 << log_block_size
+        rev_level, = struct.unpack_from('<I', sb, 76)
+        self.inode_size = struct.unpack_from('<H', sb, 88)[0] if rev_level >= 1 else 128
+        self.feature_incompat, = struct.unpack_from('<I', sb, 96)
+        self.desc_size = 32
+        if self.feature_incompat & INCOMPAT_64BIT:
+            self.desc_size = struct.unpack_from('<H', sb, 254)[0] or 32
+
+        self._inode_tables = {}
+        self._dirs = {}
+        self._gdt = (self.first_data_block + 1) * self.block_size
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def block(self, nr, count=1):
+        start = nr * self.block_size
+        return self.source[start:start+count*self.block_size]
+
+    def inode_table(self, group):
+        if group not in self._inode_tables:
+            desc = self._gdt + group * self.desc_size
+            table, = struct.unpack_from('<I', self.source[desc+8:desc+12])
+            if self.desc_size >= 64:
+                table |= struct.unpack_from('<I', self.source[desc+0x28:desc+0x2c])[0] << 32
+            self._inode_tables[group] = table
+        return self._inode_tables[group]
+
+    def inode(self, ino):
+        group, index = divmod(ino - 1, self.inodes_per_group)
+        start = self.inode_table(group) * self.block_size + index * self.inode_size
+        return Ext4Inode(self, ino, self.source[start:start+self.inode_size])
+
+    def inode_xattr(self, raw, index, name):
+        """Look up an extended attribute stored in the inode body."""
+        if len(raw) <= 128: return None
+        extra_isize, = struct.unpack_from('<H', raw, 128)
+        start = 128 + extra_isize
+        if start + 4 > len(raw) or struct.unpack_from('<I', raw, start)[0] != XATTR_MAGIC:
+            return None
+        base = pos = start + 4
+        while pos + 16 <= len(raw):
+            name_len, name_index, value_offs, _, value_size = struct.unpack_from('<BBHII', raw, pos)
+            if name_len == 0 and name_index == 0: break
+            if name_index == index and raw[pos+16:pos+16+name_len] == name:
+                return raw[base+value_offs:base+value_offs+value_size]
+            pos += (16 + name_len + 3) & ~3
+        return None
+
+    def extent_runs(self, node):
+        magic, entries, _, depth = struct.unpack_from('<HHHH', node, 0)
+        if magic != EXT4_EXTENT_MAGIC:
+            raise Ext4Error("bad extent header")
+
+        for i in range(entries):
+            entry = 12 + i * 12
+            if depth == 0:
+                logical, length, start_hi, start_lo = struct.unpack_from('<IHHI', node, entry)
+                initialized = length <= 32768
+                if not initialized: length -= 32768
+                yield logical, start_hi << 32 | start_lo, length, initialized
+            else:
+                _, leaf_lo, leaf_hi = struct.unpack_from('<IIH', node, entry)
+                yield from self.extent_runs(self.block(leaf_hi << 32 | leaf_lo))
+
+    def blockmap_runs(self, block, size):
+        bs = self.block_size
+        nblocks = (size + bs - 1) // bs
+        per_block = bs // 4
+        pointers = struct.unpack_from('<15I', block)
+        runs = []
+
+        def walk(nr, level, logical):
+            """Map the blocks below pointer nr, the first of them at logical.
+            Return the logical block after them."""
+            # a hole is skipped as a whole, nothing past the file size is read
+            if not nr or logical >= nblocks: return logical + per_block ** level
+            if level == 0:
+                if runs and runs[-1][0] + runs[-1][2] == logical and runs[-1][1] + runs[-1][2] == nr:
+                    runs[-1][2] += 1
+                else:
+                    runs.append([logical, nr, 1, True])
+                return logical + 1
+            for child in struct.unpack('<{}I'.format(per_block), self.block(nr)):
+                if logical >= nblocks: break
+                logical = walk(child, level - 1, logical)
+            return logical
+
+        logical = 0
+        # 12 direct pointers, then a single, double and triple indirect one
+        for level, nr in zip((0,) * 12 + (1, 2, 3), pointers):
+            if logical >= nblocks: break
+            logical = walk(nr, level, logical)
+        return [tuple(run) for run in runs]
+
+    def entries(self, inode):
+        """Yield (name, inode number, file type) of a directory inode."""
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            data, pos = inode.inline_data(), 4
+        else:
+            data, pos = inode.read(), 0
+
+        while pos + 8 <= len(data):
+            ino, rec_len, name_len, file_type = struct.unpack_from('<IHBB', data, pos)
+            if rec_len < 8: break
+            if ino:
+                name = data[pos+8:pos+8+name_len].decode('utf-8', 'surrogateescape')
+                if name not in ('.', '..'):
+                    yield name, ino, file_type
+            pos += rec_len
+
+    def directory(self, inode):
+        """Return the {name: inode number} map of a directory, cached."""
+        if inode.ino not in self._dirs:
+            self._dirs[inode.ino] = {name: ino for name, ino, _ in self.entries(inode)}
+        return self._dirs[inode.ino]
+
+    def lookup(self, path, follow=True, depth=0):
+        """Resolve an absolute path inside the image to its inode."""
+        if depth > MAX_SYMLINKS:
+            raise Ext4Error("too many levels of symbolic links: {}".format(path))
+
+        parts = PurePosixPath('/' + str(path).lstrip('/')).parts[1:]
+        inode, current = self.inode(ROOT_INODE), PurePosixPath('/')
+        for i, part in enumerate(parts):
+            if not inode.is_dir: return None
+            ino = self.directory(inode).get(part)
+            if ino is None: return None
+
+            inode = self.inode(ino)
+            if inode.is_symlink and (follow or i < len(parts) - 1):
+                target = PurePosixPath(inode.readlink())
+                rest = PurePosixPath(*parts[i+1:]) if i + 1 < len(parts) else PurePosixPath()
+                resolved = (target if target.is_absolute() else current / target) / rest
+                return self.lookup(os.path.normpath(str(resolved)), follow, depth + 1)
+            current = current / part
+        return inode
+
+    def stat(self, path, follow=True):
+        inode = self.lookup(path, follow)
+        if inode is None:
+            raise FileNotFoundError(path)
+        return inode
+
+    def exists(self, path):
+        try:
+            return self.lookup(path) is not None
+        except Ext4Error:
+            return False
+
+    def is_dir(self, path):
+        inode = self.lookup(path)
+        return bool(inode and inode.is_dir)
+
+    def is_file(self, path):
+        inode = self.lookup(path)
+        return bool(inode and inode.is_file)
+
+    def listdir(self, path='/'):
+        return list(self.directory(self.stat(path)))
+
+    def open(self, path):
+        inode = self.stat(path)
+        if not inode.is_file:
+            raise IsADirectoryError(path) if inode.is_dir else Ext4Error("not a regular file: {}".format(path))
+        return io.BufferedReader(Ext4File(inode))
+
+    def read(self, path):
+        with self.open(path) as f:
+            return f.read()
+
+    def walk(self, top='/'):
+        """Like os.walk, symlinks are reported as files and never followed."""
+        top = '/' + str(top).strip('/')
+        dirs, files = [], []
+        for name, ino in self.directory(self.stat(top)).items():
+            (dirs if self.inode(ino).is_dir else files).append(name)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(str(PurePosixPath(top) / name))
+
+    def extract(self, path, output):
+        """Write a regular file of the image to output."""
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with self.open(path) as src, output.open('wb') as dst:
+            while True:
+                data = src.read(1024 * 1024)
+                if not data: break
+                dst.write(data)
+        return output
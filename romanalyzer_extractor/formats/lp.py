@@ -0,0 +1,194 @@
+import os
+import mmap
+import struct
+import logging
+from bisect import bisect_right
+from pathlib import Path
+
+from formats.ext4 import open_source
+from formats.sdat import COPY_BUFSIZE, copy_fd_range
+
+# from system/core/fs_mgr/liblp/include/liblp/metadata_format.h
+LP_PARTITION_RESERVED_BYTES = 4096
+LP_METADATA_GEOMETRY_SIZE = 4096
+LP_METADATA_GEOMETRY_MAGIC = 0x616c4467
+LP_METADATA_HEADER_MAGIC = 0x414C5030
+LP_METADATA_MAJOR_VERSION = 10
+LP_SECTOR_SIZE = 512
+
+LP_TARGET_TYPE_LINEAR = 0
+LP_TARGET_TYPE_ZERO = 1
+
+# magic, struct size, checksum, metadata max size, metadata slot count, logical block size
+GEOMETRY = struct.Struct('<II32sIII')
+# magic, major, minor, header size, header checksum, tables size, tables checksum,
+# then (offset, num entries, entry size) of the partition, extent, group and block device tables
+METADATA_HEADER = struct.Struct('<IHHI32sI32s12I')
+PARTITION = struct.Struct('<36sIIII')
+EXTENT = struct.Struct('<QIQI')
+GROUP = struct.Struct('<36sIQ')
+BLOCK_DEVICE = struct.Struct('<QIIQ36sI')
+
+log = logging.getLogger('extractor')
+
+class LpError(Exception):
+    pass
+
+def is_super(source):
+    """Whether a path or view starts like a dynamic partitions super image."""
+    source = open_source(source)
+    try:
+        magic = source[LP_PARTITION_RESERVED_BYTES:LP_PARTITION_RESERVED_BYTES+4]
+        return len(magic) == 4 and struct.unpack('<I', magic)[0] == LP_METADATA_GEOMETRY_MAGIC
+    finally:
+        if isinstance(source, mmap.mmap): source.close()
+
+def cstr(data):
+    return data.split(b'\x00', 1)[0].decode('ascii', 'replace')
+
+class LpPartition(object):
+    """A logical partition, extents are (logical offset, physical offset or
+    None for zeros, length) in bytes."""
+
+    def __init__(self, name, attributes, group, extents):
+        self.name = name
+        self.attributes = attributes
+        self.group = group
+        self.extents = extents
+
+    @property
+    def size(self):
+        return sum(length for _, _, length in self.extents)
+
+class PartitionView(object):
+    """Slicing access to a logical partition inside the super image, so the
+    ext4 reader can read it where it lies."""
+
+    def __init__(self, source, partition):
+        self.source = source
+        self.extents = partition.extents
+        self.starts = [extent[0] for extent in self.extents]
+        self.size = partition.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key+1][0]
+
+        start, stop, _ = key.indices(self.size)
+        if start >= stop: return b''
+        i = max(0, bisect_right(self.starts, start) - 1)
+        # most reads stay within one extent
+        offset, physical, length = self.extents[i]
+        if stop <= offset + length and physical is not None:
+            return self.source[physical+start-offset:physical+stop-offset]
+
+        out = bytearray(stop - start)
+        while i < len(self.extents) and self.extents[i][0] < stop:
+            offset, physical, length = self.extents[i]
+            i += 1
+            lo, hi = max(start, offset), min(stop, offset + length)
+            if lo < hi and physical is not None:
+                out[lo-start:hi-start] = self.source[physical+lo-offset:physical+hi-offset]
+        return bytes(out)
+
+    def close(self):
+        pass
+
+class SuperImage(object):
+    """The LP metadata of a super image (primary geometry, metadata slot 0).
+
+    source is a path or anything open_source accepts, e.g. the sparse view
+    of a super image that was never expanded.
+    """
+
+    def __init__(self, source):
+        self.path = Path(source) if isinstance(source, (str, os.PathLike)) else None
+        self.source = open_source(source)
+
+        (magic, _, _, self.metadata_max_size, self.metadata_slot_count,
+            self.logical_block_size) = GEOMETRY.unpack(
+                self.source[LP_PARTITION_RESERVED_BYTES:LP_PARTITION_RESERVED_BYTES+GEOMETRY.size])
+        if magic != LP_METADATA_GEOMETRY_MAGIC:
+            raise LpError("not a super image")
+
+        base = LP_PARTITION_RESERVED_BYTES + 2 * LP_METADATA_GEOMETRY_SIZE
+        header = self.source[base:base+METADATA_HEADER.size]
+        (magic, major, _, header_size, _, _, _, *tables) = METADATA_HEADER.unpack(header)
+        if magic != LP_METADATA_HEADER_MAGIC:
+            raise LpError("bad LP metadata header magic 0x{:08X}".format(magic))
+        if major != LP_METADATA_MAJOR_VERSION:
+            raise LpError("unsupported LP metadata version {}".format(major))
+
+        tables_base = base + header_size
+        partitions, extents, groups, devices = (
+            self.table(tables_base, *tables[i:i+3]) for i in range(0, 12, 3))
+
+        self.groups = [cstr(GROUP.unpack_from(entry)[0]) for entry in groups]
+        self.devices = [cstr(BLOCK_DEVICE.unpack_from(entry)[4]) for entry in devices]
+        extents = [EXTENT.unpack_from(entry) for entry in extents]
+
+        self.partitions = []
+        for entry in partitions:
+            name, attributes, first_extent, num_extents, group = PARTITION.unpack_from(entry)
+            runs, offset = [], 0
+            for num_sectors, target_type, target_data, target_source in extents[first_extent:first_extent+num_extents]:
+                length = num_sectors * LP_SECTOR_SIZE
+                if target_type == LP_TARGET_TYPE_LINEAR:
+                    if target_source != 0:
+                        raise LpError("{} lies on block device {}, only the super device is read".format(
+                            cstr(name), self.devices[target_source]))
+                    runs.append((offset, target_data * LP_SECTOR_SIZE, length))
+                elif target_type == LP_TARGET_TYPE_ZERO:
+                    runs.append((offset, None, length))
+                else:
+                    raise LpError("unknown extent type {}".format(target_type))
+                offset += length
+            self.partitions.append(LpPartition(cstr(name), attributes, self.groups[group], runs))
+
+    def table(self, base, offset, num_entries, entry_size):
+        data = self.source[base+offset:base+offset+num_entries*entry_size]
+        if len(data) < num_entries * entry_size:
+            raise LpError("LP metadata table is truncated")
+        return [data[i*entry_size:(i+1)*entry_size] for i in range(num_entries)]
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, name):
+        for partition in self.partitions:
+            if partition.name == name: return partition
+        return None
+
+    def view(self, partition):
+        return PartitionView(self.source, partition)
+
+    def extract(self, partition, output):
+        """Copy a logical partition out, zero extents stay holes."""
+        src_fd = os.open(self.path, os.O_RDONLY) if self.path else None
+        dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(dst_fd, partition.size)
+            for offset, physical, length in partition.extents:
+                if physical is None: continue
+                if src_fd is not None:
+                    os.lseek(src_fd, physical, os.SEEK_SET)
+                    if copy_fd_range(src_fd, dst_fd, offset, length) < length:
+                        raise LpError("{} ends inside {}".format(self.path, partition.name))
+                    continue
+                for pos in range(0, length, COPY_BUFSIZE):
+                    chunk = min(COPY_BUFSIZE, length - pos)
+                    os.pwrite(dst_fd, self.source[physical+pos:physical+pos+chunk], offset + pos)
+        finally:
+            os.close(dst_fd)
+            if src_fd is not None: os.close(src_fd)
+        return output
@@ -0,0 +1,197 @@
+import os
+import re
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+# layouts and keys from tools/oppo_ozip_decrypt/ozipdecrypt.py (c) B. Kerler, MIT license
+OZIP_MAGIC = b'OPPOENCRYPT!'
+# whole file ozip and members listed in oppo_metadata: data starts after a 0x1050 byte header
+OZIP_DATA_OFFSET = 0x1050
+# whole file ozip: each 0x4010 byte stride starts with one encrypted AES block
+OZIP_STRIDE = 0x4010
+# zip members without oppo_metadata: 0x40050 byte blocks of a 0x50 byte header and 0x40000
+# bytes of data, every 0x4000 bytes of data start with one encrypted AES block
+BLOCK_HEADER_SIZE = 0x50
+BLOCK_DATA_SIZE = 0x40000
+BLOCK_STRIDE = 0x4000
+AES_BLOCK = 16
+
+OZIP_KEYS = (
+    "D6EECF0AE5ACD4E0E9FE522DE7CE381E",  # mnkey
+    "D6ECCF0AE5ACD4E0E92E522DE7C1381E",  # mkey
+    "D6DCCF0AD5ACD4E0292E522DB7C1381E",  # realkey, R9s CPH1607 MSM8953, Plus, R11, RMX1921 Realme XT, RMX1851EX Realme Android 10, RMX1992EX_11_OTA_1050
+    "D7DCCE1AD4AFDCE2393E5161CBDC4321",  # testkey
+    "D7DBCE2AD4ADDCE1393E5521CBDC4321",  # utilkey
+    "D7DBCE1AD4AFDCE1393E5121CBDC4321",  # R11s CPH1719 MSM8976, Plus
+    "D4D2CD61D4AFDCE13B5E01221BD14D20",  # FindX CPH1871 SDM845
+    "261CC7131D7C1481294E532DB752381E",  # FindX
+    "1CA21E12271335AE33AB81B2A7B14622",  # Realme 2 pro SDM660/MSM8976
+    "D4D2CE11D4AFDCE13B3E0121CBD14D20",  # K1 SDM660/MSM8976
+    "1C4C1EA3A12531AE491B21BB31613C11",  # Realme 3 Pro SDM710, X, 5 Pro, Q, RMX1921 Realme XT
+    "1C4C1EA3A12531AE4A1B21BB31C13C21",  # Reno 10x zoom PCCM00 SDM855, CPH1921EX Reno 5G
+    "1C4A11A3A12513AE441B23BB31513121",  # Reno 2 PCKM00 SDM730G
+    "1C4A11A3A12589AE441A23BB31517733",  # Realme X2 SDM730G
+    "1C4A11A3A22513AE541B53BB31513121",  # Realme 5 SDM665
+    "2442CE821A4F352E33AE81B22BC1462E",  # R17 Pro SDM710
+    "14C2CD6214CFDC2733AE81B22BC1462C",  # CPH1803 OppoA3s SDM450/MSM8953
+    "1E38C1B72D522E29E0D4ACD50ACFDCD6",
+    "12341EAAC4C123CE193556A1BBCC232D",
+    "2143DCCB21513E39E1DCAFD41ACEDBD7",
+    "2D23CCBBA1563519CE23C1C4AA1E3412",  # A77 CPH1715 MT6750T
+    "172B3E14E46F3CE13E2B5121CBDC4321",  # Realme 1 MTK P60
+    "ACAA1E12A71431CE4A1B21BBA1C1C6A2",  # Realme U1 RMX1831 MTK P70
+    "ACAC1E13A72531AE4A1B22BB31C1CC22",  # Realme 3 RMX1825EX P70
+    "1C4411A3A12533AE441B21BB31613C11",  # A1k CPH1923 MTK P22
+    "1C4416A8A42717AE441523B336513121",  # Reno 3 PCRM00 MTK 1000L, CPH2059 OPPO A92, CPH2067 OPPO A72
+    "55EEAA33112133AE441B23BB31513121",  # RenoAce SDM855Plus
+    "ACAC1E13A12531AE4A1B21BB31C13C21",  # Reno, K3
+    "ACAC1E13A72431AE4A1B22BBA1C1C6A2",  # A9
+    "12CAC11211AAC3AEA2658690122C1E81",  # A1,A83t
+    "1CA21E12271435AE331B81BBA7C14612",  # CPH1909 OppoA5s MT6765
+    "D1DACF24351CE428A9CE32ED87323216",  # Realme1(reserved)
+    "A1CC75115CAECB890E4A563CA1AC67C8",  # A73(reserved)
+    "2132321EA2CA86621A11241ABA512722",  # Realme3(reserved)
+    "22A21E821743E5EE33AE81B227B1462E",  # F3 Plus CPH1613 - MSM8976
+)
+# zip, AVB0 (vbmeta), ANDROID! (boot), sparse image
+PLAIN_MAGICS = (b'PK\x03\x04', b'AVB0', b'ANDR', b'\x3a\xff\x26\xed')
+
+# bytes decrypted per worker task, a multiple of every stride
+DECRYPT_WINDOW = 1024 * OZIP_STRIDE
+
+log = logging.getLogger('extractor')
+
+class OzipError(Exception):
+    pass
+
+def aes_ecb(key):
+    if AES is None: raise OzipError('pycryptodome is required to decrypt ozips')
+    return AES.new(key, AES.MODE_ECB)
+
+def device_model(name):
+    """CPH1909EX_11_A.41_... and RMX1921_11_... are keyed by CPH1909 and RMX1921."""
+    match = re.match(r'[A-Za-z]+\d+', name)
+    return match.group(0).upper() if match else None
+
+class OzipKeys(object):
+    """Finds the AES key of an ozip, remembering the key of each device model."""
+
+    def __init__(self, keys=OZIP_KEYS):
+        self.keys = [bytes.fromhex(key) for key in keys]
+        self.models = {}
+        self.lock = Lock()
+
+    def find(self, block, model=None):
+        """Return the key that decrypts the AES block to a known magic."""
+        with self.lock:
+            cached = self.models.get(model)
+        candidates = ([cached] if cached else []) + [key for key in self.keys if key != cached]
+        for key in candidates:
+            if aes_ecb(key).decrypt(block)[:4] in PLAIN_MAGICS:
+                if model:
+                    with self.lock: self.models[model] = key
+                return key
+        raise OzipError('unknown AES key, reverse it from the recovery first')
+
+ozip_keys = OzipKeys()
+
+def read_header_size(fd, offset):
+    """The decimal data size stored at offset 0x10 of an ozip header."""
+    return int(os.pread(fd, 0x10, offset + 0x10).replace(b'\x00', b'').decode(), 10)
+
+def decrypt_heads(cipher, data, stride):
+    """Decrypt the AES block at the start of every stride of data in one call."""
+    starts = range(0, len(data) - AES_BLOCK + 1, stride)
+    plain = cipher.decrypt(b''.join(data[i:i+AES_BLOCK] for i in starts))
+    for n, i in enumerate(starts):
+        data[i:i+AES_BLOCK] = plain[n*AES_BLOCK:(n+1)*AES_BLOCK]
+    return data
+
+def run_windows(task, windows, workers):
+    # pycryptodome drops the GIL while it decrypts, threads are enough
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda window: task(*window), windows): pass
+
+class OzipDecryptor(object):
+    """Decrypt the three ozip layouts with windows of the file spread over
+    workers, AES-ECB blocks do not depend on each other."""
+
+    def __init__(self, key, workers=os.cpu_count() or 4):
+        self.key = key
+        self.workers = workers
+
+    def decrypt_file(self, path, output):
+        """Whole file ozip: the stride heads from 0x1050 on are encrypted."""
+        src_fd = os.open(path, os.O_RDONLY)
+        dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            size = os.fstat(src_fd).st_size - OZIP_DATA_OFFSET
+            os.ftruncate(dst_fd, size)
+
+            def task(offset, length):
+                cipher = aes_ecb(self.key)
+                data = bytearray(os.pread(src_fd, length, OZIP_DATA_OFFSET + offset))
+                os.pwrite(dst_fd, decrypt_heads(cipher, data, OZIP_STRIDE), offset)
+
+            run_windows(task, [(offset, min(DECRYPT_WINDOW, size - offset))
+                               for offset in range(0, size, DECRYPT_WINDOW)], self.workers)
+        finally:
+            os.close(dst_fd)
+            os.close(src_fd)
+        return output
+
+    def decrypt_member(self, path, output):
+        """Member listed in oppo_metadata: everything after 0x1050 is encrypted."""
+        src_fd = os.open(path, os.O_RDONLY)
+        dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            size = min(read_header_size(src_fd, 0), os.fstat(src_fd).st_size - OZIP_DATA_OFFSET)
+            os.ftruncate(dst_fd, size)
+
+            def task(offset, length):
+                cipher = aes_ecb(self.key)
+                # a trailing partial AES block is padding
+                data = os.pread(src_fd, -(-length // AES_BLOCK) * AES_BLOCK, OZIP_DATA_OFFSET + offset)
+                data = data[:len(data) - len(data) % AES_BLOCK]
+                os.pwrite(dst_fd, cipher.decrypt(data)[:length], offset)
+
+            run_windows(task, [(offset, min(DECRYPT_WINDOW, size - offset))
+                               for offset in range(0, size, DECRYPT_WINDOW)], self.workers)
+        finally:
+            os.close(dst_fd)
+            os.close(src_fd)
+        return output
+
+    def decrypt_blocks(self, path, output):
+        """Member of a zip without oppo_metadata: a chain of headed blocks."""
+        src_fd = os.open(path, os.O_RDONLY)
+        dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            blocks, start, size = [], 0, 0
+            while True:
+                if os.pread(src_fd, len(OZIP_MAGIC), start) != OZIP_MAGIC:
+                    if not blocks: raise OzipError('{} is not an encrypted block chain'.format(path))
+                    break
+                length = read_header_size(src_fd, start)
+                blocks.append((start + BLOCK_HEADER_SIZE, len(blocks) * BLOCK_DATA_SIZE, length))
+                size = len(blocks) * BLOCK_DATA_SIZE - BLOCK_DATA_SIZE + length
+                if length < BLOCK_DATA_SIZE: break
+                start += BLOCK_HEADER_SIZE + BLOCK_DATA_SIZE
+            os.ftruncate(dst_fd, size)
+
+            def task(src, dst, length):
+                cipher = aes_ecb(self.key)
+                data = bytearray(os.pread(src_fd, min(length, BLOCK_DATA_SIZE), src))
+                os.pwrite(dst_fd, decrypt_heads(cipher, data, BLOCK_STRIDE), dst)
+
+            run_windows(task, blocks, self.workers)
+        finally:
+            os.close(dst_fd)
+            os.close(src_fd)
+        return output
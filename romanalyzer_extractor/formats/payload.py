@@ -0,0 +1,163 @@
+import os
+import sys
+import bz2
+import lzma
+import mmap
+import struct
+import hashlib
+import logging
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# from https://android.googlesource.com/platform/system/update_engine/+/refs/heads/master/scripts/update_payload/
+sys.path.append(str(Path(__file__).absolute().parents[1] / 'tools' / 'extract_android_ota_payload'))
+import update_metadata_pb2
+
+InstallOperation = update_metadata_pb2.InstallOperation
+
+BRILLO_MAJOR_PAYLOAD_VERSION = 2
+PAYLOAD_MAGIC = b'CrAU'
+
+# max payload bytes / operations handed to a worker at once
+TASK_DATA_SIZE = 32 * 1024 * 1024
+TASK_OPERATIONS = 256
+
+log = logging.getLogger('extractor')
+
+class PayloadError(Exception):
+    pass
+
+class Payload(object):
+    """Header and manifest of an A/B OTA payload.bin."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+        with self.path.open('rb') as payload_file:
+            magic = payload_file.read(4)
+            if magic != PAYLOAD_MAGIC:
+                raise PayloadError('Invalid payload magic: {}'.format(magic))
+
+            version, manifest_len, metadata_signature_len = struct.unpack('>QQI', payload_file.read(20))
+            if version != BRILLO_MAJOR_PAYLOAD_VERSION:
+                raise PayloadError('Unsupported payload version ({})'.format(version))
+
+            self.manifest = update_metadata_pb2.DeltaArchiveManifest()
+            self.manifest.ParseFromString(payload_file.read(manifest_len))
+
+        self.block_size = self.manifest.block_size
+        self.data_offset = 24 + manifest_len + metadata_signature_len
+
+    @property
+    def partitions(self):
+        return self.manifest.partitions
+
+def partition_size(partition, block_size):
+    if partition.new_partition_info.size:
+        return partition.new_partition_info.size
+    return max((e.start_block + e.num_blocks for op in partition.operations for e in op.dst_extents), default=0) * block_size
+
+def partition_tasks(partition):
+    """Split the operations of a partition into worker sized batches."""
+    task, task_size = [], 0
+    for op in partition.operations:
+        task.append((
+            op.type, op.data_offset, op.data_length,
+            tuple((e.start_block, e.num_blocks) for e in op.dst_extents),
+            op.data_sha256_hash
+        ))
+        task_size += op.data_length
+        if task_size >= TASK_DATA_SIZE or len(task) >= TASK_OPERATIONS:
+            yield task
+            task, task_size = [], 0
+    if task: yield task
+
+_payload_maps = {}
+
+def _payload_map(path):
+    if path not in _payload_maps:
+        with open(path, 'rb') as payload_file:
+            _payload_maps[path] = mmap.mmap(payload_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return _payload_maps[path]
+
+def apply_operations(payload_path, data_offset, block_size, output, operations):
+    """Apply a batch of install operations to output. Runs in a worker
+    process, raises PayloadError when the data of an operation does not
+    match its sha256."""
+    payload_map = _payload_map(payload_path)
+
+    out_fd = os.open(output, os.O_WRONLY)
+    try:
+        for op_type, offset, length, extents, sha256 in operations:
+            if op_type in (InstallOperation.ZERO, InstallOperation.DISCARD):
+                # the output was truncated to size, the blocks already are holes
+                continue
+
+            data = payload_map[data_offset+offset:data_offset+offset+length]
+            if sha256 and hashlib.sha256(data).digest() != sha256:
+                raise PayloadError('Hash mismatch of operation data at {}'.format(offset))
+
+            if op_type == InstallOperation.REPLACE_XZ:
+                data = lzma.decompress(data)
+            elif op_type == InstallOperation.REPLACE_BZ:
+                data = bz2.decompress(data)
+            elif op_type != InstallOperation.REPLACE:
+                raise PayloadError('Unhandled operation type ({} - {})'.format(
+                    op_type, InstallOperation.Type.Name(op_type)))
+
+            view, pos = memoryview(data), 0
+            for start_block, num_blocks in extents:
+                size = num_blocks * block_size
+                os.pwrite(out_fd, view[pos:pos+size], start_block * block_size)
+                pos += size
+    finally:
+        os.close(out_fd)
+
+def extract_payload(payload_path, output_dir, partitions=None, workers=None):
+    """Extract the partitions of payload.bin into output_dir/<name>.img.
+
+    Operations of all selected partitions run across a process pool, each
+    worker maps payload.bin and decompresses in-process. partitions is an
+    allow-list of partition names, None extracts everything. A partition
+    with a failed or corrupt operation is dropped.
+    """
+    payload = Payload(payload_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    outputs = {}
+    for partition in payload.partitions:
+        name = partition.partition_name
+        if partitions is not None and name not in partitions:
+            log.debug("\tskip partition {}".format(name))
+            continue
+
+        output = output_dir / '{}.img'.format(name)
+        with output.open('wb') as out_f:
+            out_f.truncate(partition_size(partition, payload.block_size))
+        outputs[name] = (partition, output)
+
+    failed = set()
+    # the caller runs extract threads, forking it could deadlock on their locks
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {}
+        for name, (partition, output) in outputs.items():
+            log.debug("\textracting partition {}".format(name))
+            for task in partition_tasks(partition):
+                future = pool.submit(apply_operations, str(payload.path), payload.data_offset,
+                                     payload.block_size, str(output), task)
+                futures[future] = name
+
+        for future, name in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                log.warn("\tfailed to extract partition {}: {}".format(name, e))
+                failed.add(name)
+
+    for name in failed:
+        outputs.pop(name)[1].unlink()
+
+    return [output for _, output in outputs.values()]
@@ -0,0 +1,116 @@
+import os
+import errno
+import logging
+
+BLOCK_SIZE = 4096
+COPY_BUFSIZE = 16 * 1024 * 1024
+
+log = logging.getLogger('extractor')
+
+class TransferListError(Exception):
+    pass
+
+def rangeset(src):
+    num_set = [int(item) for item in src.split(',')]
+    if len(num_set) != num_set[0] + 1:
+        raise TransferListError('Error on parsing following data to rangeset: {}'.format(src))
+
+    return tuple((num_set[i], num_set[i+1]) for i in range(1, len(num_set), 2))
+
+def parse_transfer_list(path):
+    """Return (version, new_blocks, commands) of a block based OTA transfer list."""
+    with open(path, 'r') as trans_list:
+        # First line in transfer list is the version number
+        version = int(trans_list.readline())
+        # Second line in transfer list is the total number of blocks we expect to write
+        new_blocks = int(trans_list.readline())
+
+        if version >= 2:
+            # Third line is how many stash entries are needed simultaneously
+            trans_list.readline()
+            # Fourth line is the maximum number of blocks that will be stashed simultaneously
+            trans_list.readline()
+
+        commands = []
+        for line in trans_list:
+            line = line.strip().split(' ')
+            cmd = line[0]
+            if not cmd: continue
+            if cmd in ('erase', 'new', 'zero'):
+                commands.append((cmd, rangeset(line[1])))
+            elif not cmd[0].isdigit():
+                # Skip lines starting with numbers, they are not commands anyway
+                raise TransferListError('Command "{}" is not valid.'.format(cmd))
+
+    return version, new_blocks, commands
+
+def copy_fd_range(src_fd, dst_fd, offset, length):
+    """Copy length bytes from the file position of src_fd to offset of dst_fd.
+
+    Uses copy_file_range so the data stays in the kernel, falling back to
+    large buffered reads where the filesystems do not support it.
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < length:
+                count = os.copy_file_range(src_fd, dst_fd, length - copied, offset_dst=offset + copied)
+                if count == 0: return copied
+                copied += count
+            return copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+
+    while copied < length:
+        data = os.read(src_fd, min(COPY_BUFSIZE, length - copied))
+        if not data: break
+        os.pwrite(dst_fd, data, offset + copied)
+        copied += len(data)
+    return copied
+
+def copy_stream_range(src, dst_fd, offset, length, buf=None):
+    """Copy length bytes read from the file object src to offset of dst_fd."""
+    buf = buf or bytearray(COPY_BUFSIZE)
+    view = memoryview(buf)
+    copied = 0
+    while copied < length:
+        count = src.readinto(view[:min(len(buf), length - copied)])
+        if not count: break
+        os.pwrite(dst_fd, view[:count], offset + copied)
+        copied += count
+    return copied
+
+def sdat2img(transfer_list, new_data, output):
+    """Convert a sparse data image (new.dat) into a raw filesystem image.
+
+    new_data is a path or a readable binary stream. Every contiguous 'new'
+    range is copied in one bulk operation. 'zero' and 'erase' ranges are
+    never written and end up as holes of the sparse output file.
+    """
+    version, new_blocks, commands = parse_transfer_list(transfer_list)
+    max_file_size = max(end for _, ranges in commands for _, end in ranges) * BLOCK_SIZE
+    log.debug("\ttransfer list version {}, {} new blocks".format(version, new_blocks))
+
+    stream = not isinstance(new_data, (str, os.PathLike))
+    src_fd = None if stream else os.open(new_data, os.O_RDONLY)
+    dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    buf = bytearray(COPY_BUFSIZE) if stream else None
+    try:
+        os.ftruncate(dst_fd, max_file_size)
+        for cmd, ranges in commands:
+            if cmd != 'new': continue
+            for begin, end in ranges:
+                offset, length = begin * BLOCK_SIZE, (end - begin) * BLOCK_SIZE
+                if stream:
+                    copied = copy_stream_range(new_data, dst_fd, offset, length, buf)
+                else:
+                    copied = copy_fd_range(src_fd, dst_fd, offset, length)
+                if copied < length:
+                    log.warn("\tnew data ended early at block {} of {}".format(begin, output))
+                    return output
+    finally:
+        os.close(dst_fd)
+        if src_fd is not None: os.close(src_fd)
+
+    return output
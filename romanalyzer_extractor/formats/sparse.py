@@ -0,0 +1,205 @@
+import os
+import mmap
+import struct
+import logging
+from bisect import bisect_right
+from pathlib import Path
+
+from formats.sdat import COPY_BUFSIZE, copy_fd_range
+
+# from system/core/libsparse/sparse_format.h, see tools/android-simg2img/simg_dump.py
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_HEADER = struct.Struct('<I4H4I')
+CHUNK_HEADER = struct.Struct('<2H2I')
+
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+log = logging.getLogger('extractor')
+
+class SparseError(Exception):
+    pass
+
+def parse_header(header, name):
+    """Return (file header size, chunk header size, block size, total blocks,
+    total chunks) of a sparse image header."""
+    if len(header) < SPARSE_HEADER.size:
+        raise SparseError('{} is too short for a sparse image'.format(name))
+
+    (magic, major_version, _, file_hdr_sz, chunk_hdr_sz,
+        blk_sz, total_blks, total_chunks, _) = SPARSE_HEADER.unpack(header[:SPARSE_HEADER.size])
+    if magic != SPARSE_HEADER_MAGIC:
+        raise SparseError('Magic should be 0xED26FF3A but is 0x{:08X}'.format(magic))
+    if major_version != 1:
+        raise SparseError('Unsupported sparse image version {}'.format(major_version))
+    return file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks
+
+def is_sparse(header):
+    return len(header) >= 4 and struct.unpack('<I', header[:4])[0] == SPARSE_HEADER_MAGIC
+
+def sparse_chunks(path, base=0):
+    """Return (output size, [(output offset, length, chunk type, input offset, fill)])
+    of the data chunks of an android sparse image that starts at base of path."""
+    chunks = []
+    with open(path, 'rb') as f:
+        f.seek(base)
+        file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks = \
+            parse_header(f.read(SPARSE_HEADER.size), path)
+
+        offset, pos = 0, base + file_hdr_sz
+        for _ in range(total_chunks):
+            f.seek(pos)
+            chunk_type, _, chunk_sz, total_sz = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+            data_pos, length = pos + chunk_hdr_sz, chunk_sz * blk_sz
+
+            if chunk_type == CHUNK_TYPE_RAW:
+                if total_sz - chunk_hdr_sz != length:
+                    raise SparseError('Raw chunk input size does not match output size')
+                chunks.append((offset, length, CHUNK_TYPE_RAW, data_pos, None))
+            elif chunk_type == CHUNK_TYPE_FILL:
+                f.seek(data_pos)
+                fill = f.read(4)
+                if fill != b'\0\0\0\0':
+                    chunks.append((offset, length, CHUNK_TYPE_FILL, data_pos, fill))
+            elif chunk_type not in (CHUNK_TYPE_DONT_CARE, CHUNK_TYPE_CRC32):
+                raise SparseError('Unknown chunk type 0x{:04X}'.format(chunk_type))
+
+            offset += 0 if chunk_type == CHUNK_TYPE_CRC32 else length
+            pos += total_sz
+
+    return total_blks * blk_sz, chunks
+
+def read_exact(fp, size, name):
+    data = fp.read(size)
+    if len(data) < size:
+        raise SparseError('{} ended early'.format(name))
+    return data
+
+def unsparse_stream(fp, output, head=b''):
+    """Expand a sparse image read front to back from fp, e.g. a member of
+    a tar, into output. head are bytes already read from fp."""
+    name = getattr(fp, 'name', output)
+    head += read_exact(fp, SPARSE_HEADER.size - len(head), name)
+    file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks = parse_header(head, name)
+    read_exact(fp, file_hdr_sz - SPARSE_HEADER.size, name)
+
+    dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(dst_fd, total_blks * blk_sz)
+        offset = 0
+        for _ in range(total_chunks):
+            chunk_type, _, chunk_sz, total_sz = CHUNK_HEADER.unpack(read_exact(fp, CHUNK_HEADER.size, name))
+            read_exact(fp, chunk_hdr_sz - CHUNK_HEADER.size, name)
+            length, data_sz = chunk_sz * blk_sz, total_sz - chunk_hdr_sz
+
+            if chunk_type == CHUNK_TYPE_RAW:
+                if data_sz != length:
+                    raise SparseError('Raw chunk input size does not match output size')
+                for pos in range(0, length, COPY_BUFSIZE):
+                    os.pwrite(dst_fd, read_exact(fp, min(COPY_BUFSIZE, length - pos), name), offset + pos)
+            elif chunk_type == CHUNK_TYPE_FILL:
+                fill = read_exact(fp, data_sz, name)[:4]
+                if fill != b'\0\0\0\0':
+                    pattern = fill * (min(length, COPY_BUFSIZE) // 4)
+                    for pos in range(0, length, len(pattern)):
+                        os.pwrite(dst_fd, pattern[:length-pos], offset + pos)
+            elif chunk_type in (CHUNK_TYPE_DONT_CARE, CHUNK_TYPE_CRC32):
+                read_exact(fp, data_sz, name)
+            else:
+                raise SparseError('Unknown chunk type 0x{:04X}'.format(chunk_type))
+
+            offset += 0 if chunk_type == CHUNK_TYPE_CRC32 else length
+    finally:
+        os.close(dst_fd)
+
+    return output
+
+class SparseImage(object):
+    """A sparse image, or a set of sparsechunk files that all describe
+    parts of the same output image (system.img_sparsechunk.0, .1, ...).
+
+    Only RAW and non-zero FILL chunks carry data, zero fills and
+    DONT_CARE chunks stay holes of the output. offsets are where the
+    images start in their files, e.g. for one embedded in an UPDATE.APP.
+    """
+
+    def __init__(self, paths, offsets=None):
+        self.paths = [Path(path) for path in paths]
+        self.size = 0
+        self.chunks = []
+        for index, path in enumerate(self.paths):
+            size, chunks = sparse_chunks(path, offsets[index] if offsets else 0)
+            self.size = max(self.size, size)
+            self.chunks += [(offset, length, chunk_type, index, data_pos, fill)
+                            for offset, length, chunk_type, data_pos, fill in chunks]
+        self.chunks.sort()
+
+    def unsparse(self, output):
+        """Expand into output, RAW chunks are copied in bulk."""
+        fds = [os.open(path, os.O_RDONLY) for path in self.paths]
+        dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(dst_fd, self.size)
+            for offset, length, chunk_type, index, data_pos, fill in self.chunks:
+                if chunk_type == CHUNK_TYPE_RAW:
+                    os.lseek(fds[index], data_pos, os.SEEK_SET)
+                    copied = copy_fd_range(fds[index], dst_fd, offset, length)
+                    if copied < length:
+                        raise SparseError('{} ended early'.format(self.paths[index]))
+                else:
+                    pattern = fill * (min(length, COPY_BUFSIZE) // 4)
+                    for pos in range(0, length, len(pattern)):
+                        os.pwrite(dst_fd, pattern[:length-pos], offset + pos)
+        finally:
+            os.close(dst_fd)
+            for fd in fds: os.close(fd)
+
+        return output
+
+    def view(self):
+        return SparseView(self)
+
+class SparseView(object):
+    """Random access to the expanded image without writing it out.
+
+    Slicing returns the bytes the unsparsed image would hold, so the view
+    can stand in for an mmap of it (e.g. as an Ext4Image source).
+    """
+
+    def __init__(self, image):
+        self.size = image.size
+        self.chunks = image.chunks
+        self.starts = [chunk[0] for chunk in self.chunks]
+        self.maps = []
+        for path in image.paths:
+            with open(path, 'rb') as f:
+                self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key+1][0]
+
+        start, stop, _ = key.indices(self.size)
+        out = bytearray(max(0, stop - start))
+        i = max(0, bisect_right(self.starts, start) - 1)
+        while i < len(self.chunks) and self.chunks[i][0] < stop:
+            offset, length, chunk_type, index, data_pos, fill = self.chunks[i]
+            i += 1
+            lo, hi = max(start, offset), min(stop, offset + length)
+            if lo >= hi: continue
+
+            if chunk_type == CHUNK_TYPE_RAW:
+                src = data_pos + lo - offset
+                out[lo-start:hi-start] = self.maps[index][src:src+hi-lo]
+            else:
+                skew = (lo - offset) % 4
+                out[lo-start:hi-start] = (fill * ((hi - lo + skew) // 4 + 1))[skew:skew+hi-lo]
+        return bytes(out)
+
+    def close(self):
+        for m in self.maps: m.close()
@@ -0,0 +1,158 @@
+import io
+import os
+import mmap
+import struct
+import logging
+from pathlib import Path
+
+from formats.sdat import copy_fd_range
+from formats.sparse import SPARSE_HEADER, SparseImage, is_sparse, unsparse_stream
+
+# layout from tools/huawei_erofs/split_updata.pl
+UPDATE_MAGIC = b'\x55\xaa\x5a\xa5'
+# magic, header length, unknown, hardware id, sequence, data length, date, time, type, blank,
+# header checksum, block size, blank; the header length includes the CRC table that follows
+ENTRY_HEADER = struct.Struct('<4sII8s4sI16s16s16s16sHHH')
+SCAN_SIZE = 1024 * 1024
+
+log = logging.getLogger('extractor')
+
+class UpdateAppError(Exception):
+    pass
+
+class UpdateAppEntry(object):
+
+    def __init__(self, name, hardware, sequence, offset, size, date, time):
+        self.name = name
+        self.hardware = hardware
+        self.sequence = sequence
+        self.offset = offset
+        self.size = size
+        self.date = date
+        self.time = time
+
+    @property
+    def filename(self):
+        return self.name + '.img'
+
+def cstr(data):
+    return data.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+
+def find_magic(f, pos):
+    """Offset of the next 4 byte aligned entry magic from pos on, None at the end."""
+    while True:
+        f.seek(pos)
+        data = f.read(SCAN_SIZE)
+        if len(data) < len(UPDATE_MAGIC): return None
+        for i in range(0, len(data) - len(UPDATE_MAGIC) + 1, 4):
+            if data[i:i+4] == UPDATE_MAGIC: return pos + i
+        pos += len(data) - len(data) % 4
+
+def read_index(path):
+    """Headers of every partition of an UPDATE.APP, the data is only skipped."""
+    entries = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        pos = find_magic(f, 0)
+        while pos is not None and pos + ENTRY_HEADER.size <= size:
+            f.seek(pos)
+            (_, header_length, _, hardware, sequence, data_length,
+                date, time, name, _, _, _, _) = ENTRY_HEADER.unpack(f.read(ENTRY_HEADER.size))
+            offset = pos + header_length
+            if header_length < ENTRY_HEADER.size or offset + data_length > size:
+                raise UpdateAppError('truncated entry at 0x{:x} of {}'.format(pos, path))
+
+            entries.append(UpdateAppEntry(cstr(name), cstr(hardware), sequence.hex().upper(),
+                                          offset, data_length, cstr(date), cstr(time)))
+            # entries start 4 byte aligned
+            pos = find_magic(f, -(-(offset + data_length) // 4) * 4)
+
+    if not entries:
+        raise UpdateAppError('no partition headers in {}'.format(path))
+    return entries
+
+class EntryReader(io.RawIOBase):
+    """Readable stream of the data of one entry."""
+
+    def __init__(self, fd, entry):
+        self.fd = fd
+        self.start = entry.offset
+        self.end = entry.offset + entry.size
+        self.pos = self.start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        count = min(len(b), self.end - self.pos)
+        if count <= 0: return 0
+        data = os.pread(self.fd, count, self.pos)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+class EntryView(object):
+    """Slicing access to the data of one entry, e.g. as an Ext4Image source."""
+
+    def __init__(self, path, entry):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = entry.offset
+        self.size = entry.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key+1][0]
+        start, stop, _ = key.indices(self.size)
+        return self.map[self.offset+start:self.offset+max(start, stop)]
+
+    def close(self):
+        self.map.close()
+
+class UpdateApp(object):
+    """A Huawei UPDATE.APP. The index of its partitions is read up front,
+    partitions are only read when they are extracted or viewed."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = read_index(self.path)
+
+    def find(self, name):
+        """The last entry of a partition name, case insensitive."""
+        matches = [entry for entry in self.entries if entry.name.lower() == name.lower()]
+        return matches[-1] if matches else None
+
+    def view(self, entry):
+        return EntryView(self.path, entry)
+
+    def is_sparse(self, entry):
+        with open(self.path, 'rb') as f:
+            return is_sparse(os.pread(f.fileno(), SPARSE_HEADER.size, entry.offset))
+
+    def sparse(self, entry):
+        """The SparseImage of a sparse partition, read in place."""
+        return SparseImage([self.path], [entry.offset])
+
+    def extract(self, entry, output):
+        """Copy one partition to output, a sparse one is expanded to
+        <output>.ext4 on the way. Return the path written."""
+        output = Path(output)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if is_sparse(os.pread(fd, SPARSE_HEADER.size, entry.offset)):
+                output = output.with_name(output.name + '.ext4')
+                return Path(unsparse_stream(io.BufferedReader(EntryReader(fd, entry)), output))
+
+            dst_fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.lseek(fd, entry.offset, os.SEEK_SET)
+                if copy_fd_range(fd, dst_fd, 0, entry.size) < entry.size:
+                    raise UpdateAppError('{} ended early'.format(self.path))
+            finally:
+                os.close(dst_fd)
+            return output
+        finally:
+            os.close(fd)
@@ -1,9 +1,121 @@
+import os
+
 DOWNLOAD_THREAD_NUM = 1
 EXTRACT_THREAD_NUM = 4
 ANALYZE_THREAD_NUM = 32
 
 DOWNLOAD_SLEEP_TIMEOUT = 60
-EXTRACT_SLEEP_TIMEOUT = 2
-ANALYZE_SLEEP_TIMEOUT = 2
 
-ES_ANDROID_ROM_INDEX = 'androrom'
\ No newline at end of file
+# processes the asyncio pipeline analyzes extracted ROMs with
+ANALYZE_PROCESS_NUM = os.cpu_count() or 4
+# extracted ROMs allowed to wait for analysis before extraction pauses
+PIPELINE_QUEUE_SIZE = 2
+
+# read size of the single pass md5/sha1/sha256/crc32 of analyzed files
+DIGEST_BUFSIZE = 4 * 1024 * 1024
+# digests of files kept by (device, inode, mtime, size)
+DIGEST_CACHE_SIZE = 100000
+
+# workers shared by the extractor jobs of all ROMs in flight
+EXTRACT_WORKER_NUM = os.cpu_count() or 4
+# max concurrent jobs per classifier type across all ROMs, types not listed are only bound by EXTRACT_WORKER_NUM
+EXTRACT_TOOL_LIMITS = {
+    'sparseimg': 2,
+    'extimg': 4,
+    'erofsimg': 2,
+    'newdat': 2,
+    'brotli': 2,
+    'otapayload': 1,
+    'ozip': 1,
+    'bootimg': 1,
+    'updateapp': 1,
+    'superimg': 1,
+}
+
+# partitions extracted from A/B OTA payload.bin, None extracts all of them
+PAYLOAD_PARTITIONS = ('system', 'vendor', 'product')
+# lower case partitions split out of a Huawei UPDATE.APP, None extracts all of them
+UPDATEAPP_PARTITIONS = ('super', 'system', 'vendor', 'product', 'odm', 'cust', 'version', 'preload')
+# logical partitions split out of a super image without a manifest, slot suffixes stripped, None extracts all of them
+SUPER_PARTITIONS = ('system', 'vendor', 'product', 'system_ext', 'odm')
+
+# targeted extraction only unpacks the partitions and files the analyzers read
+EXTRACT_TARGETED = False
+EXTRACT_CHECKLIST = 'romanalyzer_patch/assets/checklist.txt'
+EXTRACT_PATTERNS = ('*.apk',)
+EXTRACT_PARTITIONS = ('system', 'vendor', 'product', 'system_ext')
+
+# wall clock limit in seconds of an external tool run, per tool name
+TOOL_TIMEOUT = 2 * 60 * 60
+TOOL_TIMEOUTS = {
+    'binwalk': 30 * 60,
+    'file': 60,
+    'strings': 5 * 60,
+    'rabin2': 5 * 60,
+    'split_boot': 10 * 60,
+}
+# address space limit in bytes of an external tool run, per tool name
+TOOL_MEMORY_LIMIT = 8 * 1024 ** 3
+TOOL_MEMORY_LIMITS = {
+    '7z': 16 * 1024 ** 3,
+    'binwalk': 4 * 1024 ** 3,
+    'file': 1024 ** 3,
+    'strings': 1024 ** 3,
+    'split_boot': 2 * 1024 ** 3,
+}
+
+# journal finished extractor nodes next to the ROM so a restarted job resumes
+EXTRACT_JOURNAL = True
+
+# per extractor spans of every ROM are written here, None disables it
+EXTRACT_TRACE_DIR = 'romanalyzer_extractor/log/trace'
+
+# content addressed cache of extractor outputs, None disables it. Outputs are hard linked,
+# the cache is only used for files on the same filesystem
+EXTRACT_CACHE_DIR = None
+# least recently used entries are evicted past this many bytes
+EXTRACT_CACHE_BUDGET = 64 * 1024 ** 3
+EXTRACT_CACHE_TYPES = ('ozip', 'archive', 'otapayload', 'updateapp', 'superimg', 'bootimg', 'sparseimg', 'extimg', 'erofsimg', 'brotli', 'newdat')
+
+# bytes the ROMs in flight may take on disk, None uses the free space of the ROM volume minus EXTRACT_DISK_RESERVE
+EXTRACT_DISK_BUDGET = None
+EXTRACT_DISK_RESERVE = 20 * 1024 ** 3
+# estimated peak disk bytes per byte of a container of each classifier type, others count twice
+EXTRACT_FOOTPRINT_FACTORS = {
+    'brotli': 7,
+    'newdat': 3,
+    'sparseimg': 3,
+    'extimg': 2,
+    'erofsimg': 4,
+    'otapayload': 5,
+    'updateapp': 2,
+    'superimg': 2,
+    'ozip': 3,
+    'bootimg': 2,
+}
+# delete converted images and consumed new.dat files once the files in them are extracted
+EXTRACT_REMOVE_INTERMEDIATES = True
+
+# analysis documents are written in bulk upserts of this many, keyed on MONGO_UPSERT_KEYS
+SINK_FLUSH_SIZE = 1000
+MONGO_UPSERT_KEYS = ('md5', 'belongsMd5', 'rompath')
+# concurrent uploads of analyzed files, keyed by md5
+UPLOAD_THREAD_NUM = 16
+# upload to this S3 bucket with a pooled client instead of through AWSManager
+UPLOAD_BUCKET = None
+# upload to this local directory instead, e.g. for testing without AWS
+UPLOAD_STORE_DIR = None
+
+# sha256 index of analyzed contents across ROMs, known files only get a belongs edge, None disables it
+DEDUP_INDEX = 'romanalyzer_extractor/dedup.sqlite'
+# bytes hashed from the head and from the tail of a file for the (size, partial hash) pre-key
+DEDUP_PARTIAL_SIZE = 64 * 1024
+
+ES_ANDROID_ROM_INDEX = 'androrom'
+# files are indexed in bulk requests of ES_BULK_CHUNK_SIZE documents from ES_BULK_THREAD_NUM threads, 1 streams them
+ES_BULK_CHUNK_SIZE = 500
+ES_BULK_THREAD_NUM = 4
+# documents buffered before a bulk flush
+ES_BULK_FLUSH_SIZE = 5000
+# refresh interval of the index while backfilling, restored afterwards
+ES_BACKFILL_REFRESH_INTERVAL = '-1'
@@ -1,58 +1,26 @@
 import logging
-from time import sleep
 from pathlib import Path
-from threading import Thread
 
-from analysis.static import analyze_extracted
+from analysis_extractor.static import analyze_extracted
 from manager.mongo import MongoManager
 from utils import rmf, rmdir
-from settings import ANALYZE_SLEEP_TIMEOUT
+from extractor.journal import JOURNAL_SUFFIX
 
 log = logging.getLogger('analyze_thread')
 mongo_manager = MongoManager()
 
-class AnalyzeThread(Thread):
+def analyze_rom(meta):
+    log.debug(u"Start analyzing {}".format(meta['romName']))
 
-    def __init__(self, task_queue, name='AnalyzeThread'):
-        super().__init__()
-        self._name = name
-        self._task_queue = task_queue
+    analyze_extracted(meta)
 
-    def run(self):
-        while True:
-            log.debug("{}: wait for task".format(self._name))
+    log.debug(u"Success analyzed {}".format(meta['romName']))
 
-            meta = self._task_queue.get()
+    mongo_manager.update_many({"filemd5": meta['romMd5']},{"analyzed": True})
 
-            log.debug("{}: task queue size: {}".format(
-                self._name, self._task_queue.qsize()
-            ))
-
-            try:
-                self.job(meta)
-            except Exception as e:
-                log.exception(e)
-            finally:
-                self.clean(meta)
-                self._task_queue.task_done()
-                sleep(ANALYZE_SLEEP_TIMEOUT)
-
-    def job(self, meta):
-        log.debug(u"{}: Start analyzing {}".format(
-            self.name, meta['romName']
-        ))
-        
-        analyze_extracted(meta)
-        
-        log.debug(u"{}: Success analyzed {}".format(
-            self.name, meta['romName']
-        ))
-
-        mongo_manager.update_many({"filemd5": meta['romMd5']},{"analyzed": True})
-    
-    @staticmethod
-    def clean(meta):
-        rmdir(meta['extracted'])
-        rmdir(meta['romPath']+'.extracted')
-        rmf(meta['romPath'])
-        rmf(Path(meta['romPath']).with_suffix('.zip'))
\ No newline at end of file
+def clean(meta):
+    rmdir(meta['extracted'])
+    rmdir(meta['romPath']+'.extracted')
+    rmf(meta['romPath'])
+    rmf(Path(meta['romPath']).with_suffix('.zip'))
+    rmf(meta['romPath']+JOURNAL_SUFFIX)
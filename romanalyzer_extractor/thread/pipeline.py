@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import multiprocessing
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from thread.extract import extract_rom
+from thread.analyze import analyze_rom, clean
+from extractor.manifest import ExtractManifest
+from extractor.admission import DiskAdmission
+from settings import EXTRACT_THREAD_NUM, ANALYZE_PROCESS_NUM, PIPELINE_QUEUE_SIZE, EXTRACT_TARGETED
+
+log = logging.getLogger('pipeline')
+
+class RomPipeline(object):
+    """Extract and analyze a stream of ROMs on one event loop.
+
+    Replaces a set of ExtractThread/AnalyzeThread loops. Extraction runs
+    on extract_num threads (the extractors share their own worker pool
+    and mostly wait for tools), analysis is CPU bound and runs on a pool
+    of analyze_num processes. The bounded queue in between pauses
+    extraction while analysis is behind, so extracted ROMs do not pile up
+    on disk. A ROM only starts extracting once admission has room for its
+    estimated disk footprint, which is given back after it was cleaned.
+    done is called with the meta of every ROM that left the pipeline.
+
+    The analyze processes are spawned: this process runs extract threads
+    and database clients, a forked child could deadlock on their locks.
+    """
+
+    def __init__(self, extract_num=EXTRACT_THREAD_NUM, analyze_num=ANALYZE_PROCESS_NUM,
+                 queue_size=PIPELINE_QUEUE_SIZE, admission=None, done=None):
+        # closed when the pipeline stops, so it is not shared between pipelines
+        self.admission = admission or DiskAdmission()
+        self.done = done
+        self.extract_num = extract_num
+        self.analyze_num = analyze_num
+        self.queue_size = queue_size
+        # created on the loop of run(), before 3.10 a queue binds to the loop of its thread
+        self.extract_queue = self.analyze_queue = None
+        self.extract_executor = ThreadPoolExecutor(max_workers=extract_num)
+        self.analyze_executor = ProcessPoolExecutor(max_workers=analyze_num,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        self.manifest = ExtractManifest.from_checklist() if EXTRACT_TARGETED else None
+
+    async def extract_worker(self, name):
+        loop = asyncio.get_running_loop()
+        while True:
+            meta = await self.extract_queue.get()
+            admitted = queued = False
+            try:
+                # not on extract_executor, clean runs there and gives the room back
+                await loop.run_in_executor(None, self.admission.acquire, meta)
+                admitted = True
+                extracted = await loop.run_in_executor(self.extract_executor, extract_rom, meta, self.manifest)
+                if extracted:
+                    meta['extracted'] = extracted
+                    # waits while analysis is behind
+                    await self.analyze_queue.put(meta)
+                    admitted, queued = False, True
+            except Exception as e:
+                log.exception("{}: failed to extract {}".format(name, meta['romName']))
+                log.exception(e)
+            finally:
+                # analysis releases the ROMs it got
+                if admitted: self.admission.release(meta)
+                if not queued and self.done: self.done(meta)
+                self.extract_queue.task_done()
+
+    async def analyze_worker(self, name):
+        loop = asyncio.get_running_loop()
+        while True:
+            meta = await self.analyze_queue.get()
+            try:
+                await loop.run_in_executor(self.analyze_executor, analyze_rom, meta)
+            except Exception as e:
+                log.exception("{}: failed to analyze {}".format(name, meta['romName']))
+                log.exception(e)
+            finally:
+                await loop.run_in_executor(self.extract_executor, clean, meta)
+                self.admission.release(meta)
+                if self.done: self.done(meta)
+                self.analyze_queue.task_done()
+
+    async def run(self, metas):
+        """Process every task of metas, an iterable or async iterable of
+        ROM metas, and return once all of them were analyzed."""
+        self.extract_queue = asyncio.Queue(maxsize=self.extract_num)
+        self.analyze_queue = asyncio.Queue(maxsize=self.queue_size)
+        workers = [asyncio.ensure_future(self.extract_worker('extract-{}'.format(i)))
+                   for i in range(self.extract_num)]
+        workers += [asyncio.ensure_future(self.analyze_worker('analyze-{}'.format(i)))
+                    for i in range(self.analyze_num)]
+        try:
+            if hasattr(metas, '__aiter__'):
+                async for meta in metas:
+                    await self.extract_queue.put(meta)
+            else:
+                for meta in metas:
+                    await self.extract_queue.put(meta)
+
+            await self.extract_queue.join()
+            await self.analyze_queue.join()
+        finally:
+            # a pending admission would keep the default executor, and asyncio.run, from finishing
+            self.admission.close()
+            for worker in workers: worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.extract_executor.shutdown()
+            self.analyze_executor.shutdown()
+
+def run_pipeline(metas, **kwargs):
+    return asyncio.run(RomPipeline(**kwargs).run(metas))
+
+async def queue_metas(task_queue):
+    """The metas put on a queue.Queue, until None is put."""
+    loop = asyncio.get_running_loop()
+    while True:
+        meta = await loop.run_in_executor(None, task_queue.get)
+        if meta is None:
+            task_queue.task_done()
+            return
+        yield meta
+
+class PipelineThread(Thread):
+    """Runs the pipeline over the ROM metas of a task queue, in place of the
+    ExtractThread and AnalyzeThread loops. task_done() is called once a
+    ROM was analyzed and cleaned, or failed; None stops the thread."""
+
+    def __init__(self, task_queue, name='PipelineThread', **kwargs):
+        super().__init__(name=name)
+        self._task_queue = task_queue
+        self._kwargs = kwargs
+
+    def run(self):
+        log.debug("{}: start".format(self.name))
+        run_pipeline(queue_metas(self._task_queue), done=lambda meta: self._task_queue.task_done(), **self._kwargs)
+        log.debug("{}: stop".format(self.name))
@@ -1,11 +1,21 @@
+import io
 import os
+import copy
+import time
 import shutil
+import signal
 import logging
+import threading
 import logging.config
 import subprocess
+import multiprocessing
 from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
 from configparser import ConfigParser
 
+from settings import TOOL_TIMEOUT, TOOL_TIMEOUTS, TOOL_MEMORY_LIMIT, TOOL_MEMORY_LIMITS
+
 LOGCFG = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -85,6 +95,13 @@ LOGCFG = {
             'filename': 'romanalyzer_extractor/log/neo4j.log',
             'mode': 'w',
         },
+        'pipelinelog': {
+            'level': 'DEBUG',
+            'formatter': 'default',
+            'class': 'logging.FileHandler',
+            'filename': 'romanalyzer_extractor/log/pipeline.log',
+            'mode': 'w',
+        },
         'extractorlog': {
             'level': 'DEBUG',
             'formatter': 'default',
@@ -133,11 +150,24 @@ LOGCFG = {
         'extractor': {
             'level': 'DEBUG',
             'handlers': ['extractorlog']
+        },
+        'pipeline': {
+            'level': 'DEBUG',
+            'handlers': ['pipelinelog']
         }
     }
 }
 
-logging.config.dictConfig(LOGCFG)
+def logging_config():
+    """LOGCFG of this process. Spawned worker processes import this module
+    again, they append to the logs of the main process."""
+    if multiprocessing.current_process().name == 'MainProcess': return LOGCFG
+    config = copy.deepcopy(LOGCFG)
+    for handler in config['handlers'].values():
+        if 'mode' in handler: handler['mode'] = 'a'
+    return config
+
+logging.config.dictConfig(logging_config())
 log = logging.getLogger('debug')
 
 def readcfg(filepath, section='', field=''):
@@ -174,12 +204,196 @@ def rmdir(d):
     except Exception as e:
         log.exception(e)
 
-def execute(cmd, showlog=True):
-    output = ''
+class ProcessResult(object):
+    """Exit status and resource usage of one tool invocation."""
+
+    def __init__(self, argv, tool):
+        self.argv = argv
+        self.tool = tool
+        self.returncode = None
+        self.output = ''
+        self.timed_out = False
+        self.wall = 0.0
+        self.utime = 0.0
+        self.stime = 0.0
+        # peak resident set size in KiB of the tool and its children
+        self.maxrss = 0
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def cpu(self):
+        return self.utime + self.stime
+
+    def __repr__(self):
+        return "<{} rc={} wall={:.1f}s cpu={:.1f}s rss={}KiB{}>".format(
+            self.tool, self.returncode, self.wall, self.cpu, self.maxrss,
+            ' timeout' if self.timed_out else '')
+
+# seconds between two reads of the peak RSS of a running tool
+RSS_SAMPLE_INTERVAL = 0.1
+
+def _vm_hwm(pid):
+    """Peak RSS in KiB of a live process, 0 once it exited."""
     try:
-        output = subprocess.check_output(cmd, shell=True, encoding='utf-8')
-        if showlog: log.debug(u"Success execute: {}".format(cmd))
-    except Exception as e:
-        log.exception(e)
-        
-    return output
+        with open('/proc/{}/status'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'): return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir('/proc/{}/task'.format(pid)):
+            with open('/proc/{}/task/{}/children'.format(pid, task)) as fp:
+                children.extend(int(child) for child in fp.read().split())
+    except (OSError, ValueError):
+        pass
+    return children
+
+def tree_hwm(pid):
+    """Sum of the peak RSS in KiB of pid and its live descendants.
+
+    Read from /proc instead of wait4() rusage, whose ru_maxrss also counts
+    the copy of this (large) process the tool was forked from."""
+    total, pids = 0, [pid]
+    while pids:
+        pid = pids.pop()
+        total += _vm_hwm(pid)
+        pids.extend(_children(pid))
+    return total
+
+def limit_argv(argv, memory):
+    """argv wrapped in a shell that caps the address space to memory bytes
+    and execs the tool, so the limit holds from its first instruction."""
+    return ['/bin/sh', '-c', 'ulimit -v {} 2>/dev/null; exec "$@"'.format(memory // 1024), argv[0]] + argv
+
+def executable(argv0, cwd=None):
+    if os.sep in argv0: return os.access(os.path.join(cwd or '', argv0), os.X_OK)
+    return shutil.which(argv0) is not None
+
+# per tool [runs, failures, wall, cpu, max rss] of every run() in this process
+tool_usage = defaultdict(lambda: [0, 0, 0.0, 0.0, 0])
+tool_usage_lock = threading.Lock()
+_collected = threading.local()
+
+@contextmanager
+def collect_runs():
+    """Collect the ProcessResult of every run() made by the current thread."""
+    previous = getattr(_collected, 'results', None)
+    _collected.results = []
+    try:
+        yield _collected.results
+    finally:
+        _collected.results = previous
+
+@contextmanager
+def open_run(argv, tool=None, timeout=None, memory=None, cwd=None, showlog=True):
+    """Run argv like run(), yielding (stdout, ProcessResult) so the binary
+    output can be read while the tool writes it. The result is complete
+    once the block is left; stopping to read early closes the pipe."""
+    argv = [str(arg) for arg in argv]
+    tool = tool or Path(argv[0]).name
+    timeout = timeout or TOOL_TIMEOUTS.get(tool, TOOL_TIMEOUT)
+    memory = memory or TOOL_MEMORY_LIMITS.get(tool, TOOL_MEMORY_LIMIT)
+    result = ProcessResult(argv, tool)
+
+    if not executable(argv[0], cwd):
+        log.warn(u"Failed to execute {}: {} not found".format(tool, argv[0]))
+        result.returncode = -1
+        yield io.BytesIO(), result
+        return
+
+    start = time.monotonic()
+    try:
+        # the limit is set by a shell, a preexec_fn is not safe in the threaded extractors
+        proc = subprocess.Popen(limit_argv(argv, memory) if memory else argv, stdout=subprocess.PIPE, cwd=cwd,
+                                start_new_session=True)
+    except OSError as e:
+        log.warn(u"Failed to execute {}: {}".format(tool, e))
+        result.returncode = -1
+        yield io.BytesIO(), result
+        return
+
+    done = threading.Event()
+    def sample():
+        while not done.wait(RSS_SAMPLE_INTERVAL):
+            result.maxrss = max(result.maxrss, tree_hwm(proc.pid))
+        result.maxrss = max(result.maxrss, tree_hwm(proc.pid))
+    sampler = threading.Thread(target=sample, name='rss-{}'.format(proc.pid), daemon=True)
+    sampler.start()
+
+    def kill():
+        result.timed_out = True
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer: timer.start()
+    try:
+        yield proc.stdout, result
+    finally:
+        proc.stdout.close()
+        done.set()
+        sampler.join()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        if timer: timer.cancel()
+
+        if os.WIFSIGNALED(status):
+            proc.returncode = result.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = result.returncode = os.WEXITSTATUS(status)
+        result.wall = time.monotonic() - start
+        result.utime, result.stime = rusage.ru_utime, rusage.ru_stime
+
+        with tool_usage_lock:
+            usage = tool_usage[tool]
+            usage[0] += 1
+            usage[1] += 0 if result.ok else 1
+            usage[2] += result.wall
+            usage[3] += result.cpu
+            usage[4] = max(usage[4], result.maxrss)
+        if getattr(_collected, 'results', None) is not None:
+            _collected.results.append(result)
+
+        if result.timed_out:
+            log.warn(u"Killed after {}s: {}".format(timeout, ' '.join(argv)))
+        elif not result.ok:
+            log.warn(u"Failed execute ({}): {}".format(result.returncode, ' '.join(argv)))
+        elif showlog:
+            log.debug(u"Success execute: {} {}".format(' '.join(argv), result))
+
+def run(argv, tool=None, timeout=None, memory=None, cwd=None, on_line=None, showlog=True):
+    """Run argv without a shell and return a ProcessResult.
+
+    The tool runs in its own process group, which is killed as a whole
+    once timeout seconds passed. memory caps its address space in bytes.
+    stdout is passed to on_line line by line if given, otherwise it is
+    kept in result.output. Both limits default to the per tool settings.
+    """
+    lines = []
+    with open_run(argv, tool, timeout, memory, cwd, showlog) as (stdout, result):
+        for line in io.TextIOWrapper(stdout, encoding='utf-8', errors='replace'):
+            if on_line: on_line(line)
+            else: lines.append(line)
+    result.output = ''.join(lines)
+    return result
+
+def execute(cmd, showlog=True):
+    """Run a shell command line and return its output, '' on failure.
+
+    Kept for callers that rely on the shell, new code should use run().
+    """
+    words = cmd.split() if isinstance(cmd, str) else cmd
+    tool = Path(words[0]).name if words else 'sh'
+    if isinstance(cmd, str):
+        cmd = ['/bin/sh', '-c', cmd]
+
+    result = run(cmd, tool=tool, showlog=showlog)
+    return result.output if result.ok else ''
@@ -0,0 +1,114 @@
+import tempfile
+from fnmatch import fnmatch
+from pathlib import Path, PurePosixPath
+
+from loguru import logger
+
+try:
+    # the in-process image readers of romanalyzer_extractor
+    from formats.ext4 import Ext4Image, Ext4Error
+    from formats.erofs import ErofsImage, ErofsError
+except ImportError:
+    Ext4Image = ErofsImage = None
+    Ext4Error = ErofsError = ValueError
+
+# partitions mounted below /system or / that may come as separate images
+SIDE_PARTITIONS = ("vendor", "product", "system_ext", "odm")
+
+
+def openImage(imagePath):
+    """Ext4Image or ErofsImage of a partition image, whichever it is."""
+    if Ext4Image is None:
+        raise ImportError("reading partition images needs romanalyzer_extractor on sys.path")
+    try:
+        return Ext4Image(imagePath)
+    except Ext4Error:
+        return ErofsImage(imagePath)
+
+
+class ImagePath(object):
+    """A ROM file inside a partition image, quacks like the pathlib.Path
+    objects TestEngine.localize() returns for extracted ROMs."""
+
+    def __init__(self, firmware, partition, path):
+        self._firmware = firmware
+        self._image = firmware.image(partition)
+        self.partition = partition
+        self.path = path
+        self.name = PurePosixPath(path).name
+
+    def __str__(self):
+        return "{}:{}".format(self.partition, self.path)
+
+    def exists(self):
+        return self._image.exists(self.path)
+
+    def open(self, mode="rb"):
+        if mode != "rb":
+            raise ValueError("partition images are read-only")
+        return self._image.open(self.path)
+
+    def absolute(self):
+        """Copy the file out for the tools that need a real path."""
+        return self._firmware.materialize(self)
+
+
+class FirmwareImage(object):
+    """ROM files read straight out of an ext4 or erofs system image.
+
+    vendor.img, product.img, ... next to the system image serve the
+    /vendor and /system/vendor paths.
+    """
+
+    def __init__(self, systemImage):
+        systemImage = Path(systemImage)
+        self._images = {"system": openImage(systemImage)}
+        # system-as-root images carry the rootfs with system/ below it
+        self._systemRoot = "/system/" if self._images["system"].exists("/system/build.prop") else "/"
+
+        for partition in SIDE_PARTITIONS:
+            imagePath = systemImage.parent / "{}.img".format(partition)
+            if not imagePath.is_file():
+                continue
+            try:
+                self._images[partition] = openImage(imagePath)
+            except (ErofsError, ValueError):
+                logger.debug("Skip {}, not an ext4 or erofs image".format(imagePath))
+
+        self._materialized = tempfile.TemporaryDirectory(prefix="firmware_image_")
+
+    def image(self, partition):
+        return self._images[partition]
+
+    def resolve(self, filePath):
+        """Return (partition, path inside its image) of an absolute ROM path."""
+        parts = PurePosixPath("/" + str(filePath).lstrip("/")).parts[1:]
+        if parts and parts[0] == "system":
+            parts = parts[1:]
+        if parts and parts[0] in SIDE_PARTITIONS and parts[0] in self._images:
+            return parts[0], "/" + "/".join(parts[1:])
+        return "system", self._systemRoot + "/".join(parts)
+
+    def localize(self, filePath):
+        partition, path = self.resolve(filePath)
+        return ImagePath(self, partition, path)
+
+    def materialize(self, imagePath):
+        output = Path(self._materialized.name) / imagePath.partition / imagePath.path.lstrip("/")
+        if not output.exists() and imagePath.exists():
+            self.image(imagePath.partition).extract(imagePath.path, output)
+        return output
+
+    def findFiles(self, pattern):
+        """Yield the ROM paths of all files whose name matches pattern."""
+        for partition, image in self._images.items():
+            prefix, root = "/" + partition, "/"
+            if partition == "system":
+                root = self._systemRoot
+            if not image.exists(root):
+                continue
+            for dirpath, _, files in image.walk(root):
+                for name in files:
+                    if fnmatch(name, pattern):
+                        relative = PurePosixPath(dirpath, name).relative_to(root)
+                        yield "{}/{}".format(prefix, relative)
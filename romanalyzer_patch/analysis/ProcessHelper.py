@@ -7,6 +7,12 @@ from collections import namedtuple
 
 from analysis.signatures.SymbolInformation import SymbolInformation
 
+try:
+    # the in-process ELF reader of romanalyzer_extractor, objdump is used without it
+    from formats.elf import ElfFile, ElfError
+except ImportError:
+    ElfFile = None
+
 OBJDUMP_PATH = "romanalyzer_patch/assets/objdump"
 # OBJDUMP_PATH = "objdump"
 SIGTOOL_PATH = "romanalyzer_patch/assets/sigtool"
@@ -64,11 +70,32 @@ def runCommand(cmd):
             logger.exception(e)
 
 
+def openElf(filepath):
+    """ElfFile of an executable or shared object, None where objdump has to be used."""
+    if ElfFile is None or Path(filepath).suffix == ".o":
+        return None
+    try:
+        return ElfFile(str(filepath))
+    except (ElfError, OSError, ValueError):
+        return None
+
+
+def getElfSymbolTableEntry(elf, symbol):
+    with elf:
+        entry = elf.find_symbol(symbol)
+    if entry is None:
+        return None
+    return {"addr": entry.value, "len": entry.size}
+
+
 def getSymbolTableEntry(fileOrLines, symbol):
     objdumpLines = None
     if isinstance(fileOrLines, list):
         objdumpLines = fileOrLines
     elif isinstance(fileOrLines, str):
+        elf = openElf(fileOrLines)
+        if elf:
+            return getElfSymbolTableEntry(elf, symbol)
         objdumpLines = runObjdumpCommand("-tT {}".format(fileOrLines))
 
     if not objdumpLines:
@@ -100,11 +127,40 @@ def getSymbolTableEntry(fileOrLines, symbol):
     return None
 
 
+def mapSymbolPositions(symtable, sections):
+    for symbolInformation in symtable.values():
+        addr = symbolInformation.addr
+        for section in sections:
+            if addr >= section.vma and addr < (section.vma + section.size):
+                symbolInformation.position = section.fileOffset + (addr - section.vma)
+
+
+def readElfSymbolTable(elf):
+    """The .text symbols with their file positions, like the objdump -tT and -h -w parse below."""
+    symtable = dict()
+    with elf:
+        for symbol in elf.symbols() + elf.symbols(dynamic=True):
+            if symbol.section != ".text" or not symbol.name:
+                continue
+            symtable[symbol.name] = SymbolInformation(
+                symbol.name, addr=symbol.value, length=symbol.size
+            )
+        sections = [
+            Section(section.size, section.addr, section.offset)
+            for section in elf.code_sections()
+        ]
+    mapSymbolPositions(symtable, sections)
+    return symtable
+
+
 def readSymbolTable(filePath):
     symtable = dict()
     if not filePath:
         logger.exception("filePath argument == null!")
         return None
+    elf = openElf(filePath)
+    if elf:
+        return readElfSymbolTable(elf)
     patternWhitespaces = re.compile("\\s+")
     lines = getObjDumptTOutput(filePath)
     for line in lines:
@@ -140,13 +196,7 @@ def readSymbolTable(filePath):
             vma = int(items[3], 16)
             fileOffset = int(items[5], 16)
             sections.append(Section(size, vma, fileOffset))
-    for symbolInformation in symtable.values():
-        addr = symbolInformation.addr
-        pos = addr
-        for section in sections:
-            if addr >= section.vma and addr < (section.vma + section.size):
-                pos = section.fileOffset + (addr - section.vma)
-                symbolInformation.position = pos
+    mapSymbolPositions(symtable, sections)
 
     if Path(filePath).suffix == ".o":
         for line in getObjDumpHWwithCheck(filePath):
@@ -13,6 +13,7 @@ from loguru import logger
 import multiprocessing
 
 from analysis.BuildProperty import BuildProperty
+from analysis.FirmwareImage import FirmwareImage
 from analysis.signatures.MaskSignature import MaskSignature
 from analysis.signatures.RollingSignature import RollingSignature
 from analysis.signatures.MultiSignatureScanner import MultiSignatureScanner
@@ -31,9 +32,25 @@ def validateFilename(filename):
     return True
 
 
+# the engine of a pool worker, set once per process by initWorker
+_workerEngine = None
+
+
+def initWorker(engine):
+    global _workerEngine
+    _workerEngine = engine
+
+
+def runWorker(testArgs):
+    return _workerEngine.testWorker(testArgs)
+
+
 class TestEngine(object):
     def __init__(self, localFirmwareRoot, buildProperty=None):
         self._localFirmwareRoot = Path(localFirmwareRoot)
+        # a system image is read in place instead of an extracted ROM directory
+        self._isImage = self._localFirmwareRoot.is_file()
+        self._firmwareImage = None
         if not buildProperty:
             buildProperty = self.searchBuildProperty()
 
@@ -44,7 +61,23 @@ class TestEngine(object):
         self._basicTestResultCache = dict()
         self.loadTestSuites()
 
+    def __getstate__(self):
+        # the mmap backed image readers do not pickle, each worker opens its own
+        state = self.__dict__.copy()
+        state["_firmwareImage"] = None
+        return state
+
+    @property
+    def firmwareImage(self):
+        if self._isImage and self._firmwareImage is None:
+            self._firmwareImage = FirmwareImage(self._localFirmwareRoot)
+        return self._firmwareImage
+
     def searchBuildProperty(self):
+        if self._isImage:
+            buildProperty = self.localize("/system/build.prop")
+            return buildProperty.absolute() if buildProperty.exists() else None
+
         outputs = os.popen(f'find {self._localFirmwareRoot} -name "build.prop"').read()
         outputs = outputs.splitlines()
         if not outputs:
@@ -59,6 +92,8 @@ class TestEngine(object):
         return result
 
     def localize(self, filePath):
+        if self._isImage:
+            return self.firmwareImage.localize(filePath)
         return self._localFirmwareRoot / filePath.lstrip("/")
 
     def loadAllBasicTests(self, allBasicTests):
@@ -186,7 +221,7 @@ class TestEngine(object):
         logger.debug("Total number of testcase: {}".format(totalTasks))
 
         # pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-        pool = multiprocessing.Pool(processes=8)
+        pool = multiprocessing.Pool(processes=8, initializer=initWorker, initargs=(self,))
         
         taskArgs = (
             [cve, vulnObject]
@@ -199,7 +234,7 @@ class TestEngine(object):
         #     description="Runing vulnerability testing...",
         # ):
         
-        for testResult in pool.imap_unordered(self.testWorker, taskArgs):
+        for testResult in pool.imap_unordered(runWorker, taskArgs):
             reports.update(testResult)
 
         pool.close()
@@ -438,7 +473,8 @@ class TestEngine(object):
         if not f.exists():
             return None
 
-        data = lzma.open(str(f.absolute())).read()
+        with f.open("rb") as fp:
+            data = lzma.open(fp).read()
         return needle in data
 
     def runZipContainsSubstringTest(self, test):
@@ -463,7 +499,7 @@ class TestEngine(object):
         if not filepath.exists():
             return None
 
-        with zipfile.ZipFile(str(filepath.absolute())) as zf:
+        with filepath.open("rb") as fp, zipfile.ZipFile(fp) as zf:
             if zipitem not in zf.namelist():
                 return None
             with zf.open(zipitem) as f:
@@ -481,8 +517,8 @@ class TestEngine(object):
         if not filepath.exists():
             return None
 
-        zf = zipfile.ZipFile(str(filepath.absolute()))
-        return zipitem in zf.namelist()
+        with filepath.open("rb") as fp, zipfile.ZipFile(fp) as zf:
+            return zipitem in zf.namelist()
 
     def runBuildPropEqualsTest(self, test):
         buildProperty = test["buildProperty"]
@@ -1,11 +1,14 @@
 
 import sys
 import os
+import glob
 sys.path.append("romanalyzer_extractor")
 from extractor.rom import ROMExtractor
+from analysis_extractor.dedup import dedup_index
 
 sys.path.append("romanalyzer_patch")
 from analysis.TestEngine import TestEngine
+from analysis.FirmwareImage import FirmwareImage
 
 #===============ROM Extractor===============
 
@@ -41,13 +44,22 @@ def rom_extractor(file_path,rom_brand=None):
 
     elif rom_brand=='huawei':
         extracted = ROMExtractor(os.path.abspath(file_path)).extract()
-        os.system('mkdir '+str(extracted)+'/tmp')
+        # the extractor already split the logical partitions out of SUPER.img and unpacked the erofs system
+        system_dir=glob.glob(str(extracted)+'/UPDATE.APP.extracted/SUPER.img*.extracted/system*.img.extracted')
+        if system_dir:
+            print(system_dir[0]+'/')
+            return (system_dir[0]+'/')
+
+        system_img=glob.glob(str(extracted)+'/UPDATE.APP.extracted/SUPER.img*.extracted/system*.img')
+        if not system_img:
+            print("detect error: can not find the system image in "+str(extracted)+"/UPDATE.APP.extracted")
+            return None
+        system_img=system_img[0]
 
         path1=str(os.path.abspath(sys.argv[0]))
         work_path=path1[:path1.rfind('/')]
         
-        os.system(work_path+'/romanalyzer_extractor/tools/huawei_erofs/lpunpack '+str(extracted)+'/UPDATE.APP.extracted/SUPER.img.ext4 '+str(extracted)+'/tmp')
-        os.system(work_path+'/romanalyzer_extractor/tools/huawei_erofs/erofsUnpackKt_x64 '+str(extracted)+'/tmp/system.img '+str(extracted)+'/sys')
+        os.system(work_path+'/romanalyzer_extractor/tools/huawei_erofs/erofsUnpackKt_x64 '+system_img+' '+str(extracted)+'/sys')
         
         print(str(extracted)+'/sys/')
         return (str(extracted)+'/sys/')
@@ -84,7 +96,8 @@ def path_change(targetFirmware):
 
 
 def runVulnLogic(targetFirmware):
-    firmware=path_change(targetFirmware)
+    # a system image is scanned in place, no need to relocate build.prop
+    firmware=targetFirmware if os.path.isfile(targetFirmware) else path_change(targetFirmware)
     
     if firmware==None:
         print("detect error: can not find build.prop")
@@ -96,14 +109,39 @@ def runVulnLogic(targetFirmware):
 
 #================App Analyzer================
 
+def runApkReport(apk_path, report_path):
+    # an apk seen in an earlier ROM gets a copy of its report instead of another androguard run
+    sha256 = None
+    if dedup_index is not None:
+        sha256, reused = dedup_index.reuse_report(apk_path, report_path)
+        if reused:
+            return
+    command_str = 'python ./static/androguard-3.3.6/main.py -i ' + apk_path + ' -r ' + report_path
+    os.system(command_str)
+    if dedup_index is not None and os.path.isdir(report_path):
+        dedup_index.add_report(apk_path, sha256, report_path)
+
+def runImageAppAnalyzer(systemImage, reportDir):
+    image = FirmwareImage(systemImage)
+    for path_str in image.findFiles('*.apk'):
+        # only the apk under analysis is copied out of the image
+        apk_path = image.localize(path_str).absolute()
+        if not apk_path.exists():
+            continue
+        report_path = reportDir + '/' + path_str.replace('/', '_')
+        runApkReport(str(apk_path), report_path)
+        apk_path.unlink()
+
 def runAppAnalyzer(targetDir, reportDir):
+    if os.path.isfile(targetDir):
+        return runImageAppAnalyzer(targetDir, reportDir)
+
     for root, dirs, files in os.walk(targetDir):
         for file_str in files:
             if file_str.endswith('.apk'):
                 path_str = os.path.join(root, file_str)
                 report_path = reportDir + '/' + path_str.replace('/', '_')
-                command_str = 'python ./static/androguard-3.3.6/main.py -i ' + path_str + ' -r ' + report_path
-                os.system(command_str)
+                runApkReport(path_str, report_path)
 
 if __name__ == "__main__":
     
@@ -115,7 +153,8 @@ if __name__ == "__main__":
     apk_report=str(rom_path)+'.apk_report/'
     
     extracted_path=rom_extractor(rom_path,rom_brand)
-    runVulnLogic(extracted_path)
-    runAppAnalyzer(extracted_path, apk_report)
+    if extracted_path:
+        runVulnLogic(extracted_path)
+        runAppAnalyzer(extracted_path, apk_report)
 
 